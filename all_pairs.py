@@ -0,0 +1,171 @@
+import argparse
+import collections
+import hashlib
+import heapq
+import multiprocessing
+import os
+import socket
+import sys
+
+from shortest_path import construct_adjacency_list
+from topology import read_topology
+
+# below this many nodes a process pool costs more than it saves
+MIN_NODES_PER_POOL = 500
+
+# the forwarding tables of every node in a topology, computed in one go for tools that want the
+# routing state of the whole network without running an emulator per node
+# next_hops[source_index][dest_index] is a tuple of next hop indexes, or None when dest can't be
+# reached, the index of each node is the one construct_adjacency_list gives it
+class AllPairsRoutes:
+    def __init__(self, index_to_node_map, node_to_index_map, next_hops):
+        self.index_to_node_map = index_to_node_map
+        self.node_to_index_map = node_to_index_map
+        self.next_hops = next_hops
+
+    # same as find_shortest_path_and_return_forwarding_table(node, network_topology) returns
+    def forwarding_table(self, node):
+        source_index = self.node_to_index_map[node]
+        forwarding_table = {}
+        for dest_index, hops in enumerate(self.next_hops[source_index]):
+            if hops is not None and dest_index != source_index:
+                forwarding_table[self.index_to_node_map[dest_index]] = tuple(self.index_to_node_map[hop] for hop in hops)
+        return forwarding_table
+
+    def next_hops_between(self, source, dest):
+        hops = self.next_hops[self.node_to_index_map[source]][self.node_to_index_map[dest]]
+        if hops is None:
+            return None
+        return tuple(self.index_to_node_map[hop] for hop in hops)
+
+    def __len__(self):
+        return len(self.next_hops)
+
+# the adjacency list is handed to every worker once when the pool starts instead of with every task
+worker_adjacency_list = None
+
+def init_worker(adjacency_list):
+    global worker_adjacency_list
+    worker_adjacency_list = adjacency_list
+
+# dijkstra from source_index that works out the next hops while relaxing edges instead of in a
+# second pass over the settled nodes, gives the same next hops as construct_next_hops
+# a node's next hops are final by the time it is settled, links cost at least 1 so all of its
+# predecessors were settled before it
+def next_hops_from_source(adjacency_list, source_index):
+    num_nodes = len(adjacency_list)
+    min_distance = [sys.maxsize] * num_nodes
+    next_hops = [None] * num_nodes
+    visited = [False] * num_nodes
+    min_distance[source_index] = 0
+    heap = [(0, source_index)]
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+
+    while heap:
+        distance, node_index = heappop(heap)
+        if visited[node_index]:
+            continue
+        visited[node_index] = True
+        hops = next_hops[node_index]
+
+        for neighbor_index, edge_distance in adjacency_list[node_index].items():
+            neighbor_distance = distance + edge_distance
+            if neighbor_distance < min_distance[neighbor_index]:
+                min_distance[neighbor_index] = neighbor_distance
+                next_hops[neighbor_index] = (neighbor_index,) if node_index == source_index else hops
+                heappush(heap, (neighbor_distance, neighbor_index))
+            elif neighbor_distance == min_distance[neighbor_index] and not visited[neighbor_index]:
+                # another equal cost path
+                other_hops = next_hops[neighbor_index]
+                if other_hops != hops:
+                    next_hops[neighbor_index] = tuple(sorted(set(other_hops).union(hops)))
+
+    return next_hops
+
+# next hops from every source in source_indexes
+# nodes reached through the same neighbor share its next hop tuple, so the result stays small to
+# send back and to hold on to
+def next_hops_from_sources(source_indexes, adjacency_list=None):
+    if adjacency_list is None:
+        adjacency_list = worker_adjacency_list
+    return [next_hops_from_source(adjacency_list, source_index) for source_index in source_indexes]
+
+# runs a heap dijkstra from every node, spread over a pool of processes
+# floyd-warshall would be O(N^3) and too slow at thousands of nodes even vectorized, a dijkstra
+# per source is O(N E log N) in total and every source is independent
+def compute_all_pairs_routes(network_topology, processes=None):
+    adjacency_list, index_to_node_map, node_to_index_map = construct_adjacency_list(network_topology)
+    num_nodes = len(adjacency_list)
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    if processes <= 1 or num_nodes < MIN_NODES_PER_POOL:
+        return AllPairsRoutes(index_to_node_map, node_to_index_map, next_hops_from_sources(range(num_nodes), adjacency_list))
+
+    # a few chunks per process so a slow chunk doesn't hold up the rest
+    chunk_size = max(1, num_nodes // (processes * 4))
+    chunks = [range(start, min(start + chunk_size, num_nodes)) for start in range(0, num_nodes, chunk_size)]
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(adjacency_list,)) as pool:
+        next_hops = [hops for chunk in pool.map(next_hops_from_sources, chunks) for hops in chunk]
+    return AllPairsRoutes(index_to_node_map, node_to_index_map, next_hops)
+
+# identifies a topology by its nodes, links and costs, whatever order they were listed in
+# works for a LiveTopology too, two with the same nodes and links down hash the same
+def topology_hash(network_topology):
+    digest = hashlib.sha1()
+    for node in sorted(network_topology):
+        digest.update(node.encode())
+        for neighbor, cost in sorted(network_topology[node].items()):
+            digest.update(b' ' + neighbor.encode() + b',' + str(cost).encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+# keeps the routes of the last max_entries topologies it was asked about, so what-if tooling going
+# over the same failure sets again doesn't recompute them
+class AllPairsCache:
+    def __init__(self, max_entries=16, processes=None):
+        self.max_entries = max_entries
+        self.processes = processes
+        self.entries = collections.OrderedDict() # { topology hash: AllPairsRoutes }
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, network_topology):
+        key = topology_hash(network_topology)
+        routes = self.entries.get(key)
+        if routes is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return routes
+
+        self.misses += 1
+        routes = compute_all_pairs_routes(network_topology, self.processes)
+        self.entries[key] = routes
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return routes
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-f', '--filename', help='the name of the topology file', required=True, type=str)
+    parser.add_argument('-j', '--processes', help='number of worker processes, defaults to one per core', default=None, type=int)
+    parser.add_argument('-n', '--no_resolve', help='keep hostnames as they are instead of resolving them', action='store_true')
+
+    args = parser.parse_args()
+    return args
+
+# prints the forwarding table of every node in the topology file
+def main():
+    args = parse_command_line_args()
+    network_topology = read_topology(args.filename, resolve=None if args.no_resolve else socket.gethostbyname)
+    routes = compute_all_pairs_routes(network_topology, args.processes)
+    for node in network_topology:
+        print(node)
+        for dest, next_hops in routes.forwarding_table(node).items():
+            print('   ', dest, ' '.join(next_hops))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1141 @@
+import argparse
+import collections
+import copy
+import multiprocessing
+import os
+import pickle
+import random
+import socket
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from all_pairs import AllPairsCache, compute_all_pairs_routes
+from dataplane import DataPlane
+from emulator import HELLO_INTERVAL, NEIGHBOR_DEADLINE, Router
+from liveness import NeighborLiveness
+from lsdb import LinkStateDatabase
+from nodes import NodeRegistry
+
+from packet import LEGACY_HEADER, NO_NODE, PacketCache, Packet_Type, decode_lsp_payload, decrement_time_to_live, encode_lsp_entries, encode_lsp_payload, pack_header, pack_legacy_header, pack_node, packed_nodes, parse_header, send_to_nodes, socket_addresses, unpacked_nodes
+from scheduler import EventLoop
+from simulator import SimulatedEventLoop, VirtualAddresses
+from shortest_path import ENGINES, IncrementalSPF, construct_adjacency_list, find_loop_free_alternates, find_shortest_path_and_return_forwarding_table, heap_dijkstra, select_next_hop
+from table_writer import TableWriter, get_ip_and_port_from_full_addr
+from topology import CompiledTopology, LiveTopology, read_topology, resolved_hostnames, synthetic_node, synthetic_topology, write_compiled_topology
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    spf_parser = subparsers.add_parser('spf', help='compare the shortest path engines on synthetic topologies')
+    spf_parser.add_argument('-n', '--nodes', help='topology sizes to run', nargs='+', default=[100, 1000, 10000], type=int)
+    spf_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    spf_parser.add_argument('-r', '--repeat', help='number of runs per engine and size', default=3, type=int)
+    spf_parser.add_argument('-m', '--max_matrix_nodes', help='skip the matrix engine above this many nodes', default=10000, type=int)
+    spf_parser.add_argument('-s', '--seed', help='random seed for the synthetic topologies', default=1, type=int)
+    spf_parser.add_argument('-c', '--max_cost', help='link costs are picked between 1 and this', default=1, type=int)
+
+    incremental_parser = subparsers.add_parser('incremental', help='check incremental SPF against a full recompute on random flaps and time both')
+    incremental_parser.add_argument('-n', '--nodes', help='topology sizes to run', nargs='+', default=[100, 1000], type=int)
+    incremental_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    incremental_parser.add_argument('-e', '--events', help='number of random link and node flaps per size', default=200, type=int)
+    incremental_parser.add_argument('-s', '--seed', help='random seed for the topologies and flaps', default=1, type=int)
+    incremental_parser.add_argument('-c', '--max_cost', help='link costs are picked between 1 and this, above 1 links also change cost', default=1, type=int)
+
+    timers_parser = subparsers.add_parser('timers', help='idle cpu use and timer accuracy of the event loop against the old busy loop')
+    timers_parser.add_argument('-t', '--duration', help='seconds to run each loop for', default=10, type=float)
+
+    lsp_codec_parser = subparsers.add_parser('lsp-codec', help='encode and decode throughput and size of LSP payloads, binary against pickle')
+    lsp_codec_parser.add_argument('-n', '--neighbors', help='neighbor counts to run', nargs='+', default=[10, 100, 1000], type=int)
+    lsp_codec_parser.add_argument('-r', '--repeat', help='encodes and decodes per neighbor count', default=2000, type=int)
+
+    header_parser = subparsers.add_parser('header', help='per packet cost and size of the compact header against the legacy one')
+    header_parser.add_argument('-r', '--repeat', help='headers to pack and parse', default=200000, type=int)
+
+    flood_parser = subparsers.add_parser('flood', help='hello and LSP packets per second per core with and without the packet cache')
+    flood_parser.add_argument('-n', '--neighbors', help='number of neighbors of the sending node', default=1000, type=int)
+    flood_parser.add_argument('-r', '--rounds', help='hello and LSP rounds to send', default=20, type=int)
+
+    forward_parser = subparsers.add_parser('forward', help='check the in place TTL rewrite keeps the payload and time it against a full repack')
+    forward_parser.add_argument('-n', '--neighbors', help='neighbors listed in the forwarded LSP', default=100, type=int)
+    forward_parser.add_argument('-r', '--repeat', help='packets to forward', default=200000, type=int)
+
+    lsdb_parser = subparsers.add_parser('lsdb', help='LSP flood messages per link state update, flooding every copy against the link state database')
+    lsdb_parser.add_argument('-f', '--filenames', help='topology files to flood over, hostnames are kept as they are', nargs='+', default=['test/topology.txt', 'test/topology2.txt'], type=str)
+    lsdb_parser.add_argument('-n', '--nodes', help='synthetic topology sizes to flood over', nargs='+', default=[100, 1000], type=int)
+    lsdb_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    lsdb_parser.add_argument('-o', '--origins', help='most origins to flood from per topology', default=20, type=int)
+    lsdb_parser.add_argument('-s', '--seed', help='random seed for the synthetic topologies', default=1, type=int)
+
+    topology_parser = subparsers.add_parser('topology', help='time and memory per node flap, copying the topology against the live overlay')
+    topology_parser.add_argument('-n', '--nodes', help='topology sizes to run', nargs='+', default=[1000, 10000], type=int)
+    topology_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    topology_parser.add_argument('-e', '--events', help='number of random node flaps per size', default=50, type=int)
+    topology_parser.add_argument('-s', '--seed', help='random seed for the topologies and flaps', default=1, type=int)
+
+    ecmp_parser = subparsers.add_parser('ecmp', help='how evenly flows spread over equal cost next hops on the test topologies')
+    ecmp_parser.add_argument('-f', '--filenames', help='topology files to route over, hostnames are given made up addresses like in the simulator', nargs='+', default=['test/topology.txt', 'test/topology2.txt'], type=str)
+    ecmp_parser.add_argument('-n', '--nodes', help='synthetic topology sizes to route over', nargs='+', default=[50], type=int)
+    ecmp_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    ecmp_parser.add_argument('-l', '--flows', help='flows with a random source per ingress node and dest', default=1000, type=int)
+    ecmp_parser.add_argument('-s', '--seed', help='random seed for the topologies and flow sources', default=1, type=int)
+
+    all_pairs_parser = subparsers.add_parser('all-pairs', help='time every forwarding table of a topology at once, serial and across a process pool, and the cache')
+    all_pairs_parser.add_argument('-n', '--nodes', help='topology sizes to run', nargs='+', default=[1000, 5000], type=int)
+    all_pairs_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    all_pairs_parser.add_argument('-j', '--processes', help='worker processes for the pooled run, defaults to one per core', default=None, type=int)
+    all_pairs_parser.add_argument('-k', '--checked_sources', help='nodes whose table is checked against a single source run', default=20, type=int)
+    all_pairs_parser.add_argument('-s', '--seed', help='random seed for the topologies', default=1, type=int)
+
+    output_parser = subparsers.add_parser('output', help='time and bytes of the forwarding table output under churn, printing everything on every change against the diff and json writers')
+    output_parser.add_argument('-n', '--nodes', help='topology size', default=1000, type=int)
+    output_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    output_parser.add_argument('-e', '--events', help='number of random node flaps', default=200, type=int)
+    output_parser.add_argument('-g', '--gap', help='milliseconds between two flaps', default=50, type=int)
+    output_parser.add_argument('-i', '--interval', help='minimum milliseconds between writes for the rate limited runs', default=1000, type=int)
+    output_parser.add_argument('-s', '--seed', help='random seed for the topology and flaps', default=1, type=int)
+
+    load_parser = subparsers.add_parser('load', help='cold start time of a topology file behind a slow resolver, resolving every token against resolving each hostname once in parallel and the compiled file')
+    load_parser.add_argument('-n', '--nodes', help='topology size', default=10000, type=int)
+    load_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    load_parser.add_argument('-p', '--ports_per_host', help='nodes that share a hostname', default=100, type=int)
+    load_parser.add_argument('-l', '--latency', help='milliseconds the resolver takes per hostname', default=0.5, type=float)
+    load_parser.add_argument('-s', '--seed', help='random seed for the topology', default=1, type=int)
+
+    router_parser = subparsers.add_parser('router', help='time per packet the router spends on hellos, LSPs and routetrace packets, and memory per router')
+    router_parser.add_argument('-n', '--nodes', help='topology size', default=2000, type=int)
+    router_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    router_parser.add_argument('-r', '--repeat', help='packets of each type to handle', default=50000, type=int)
+    router_parser.add_argument('-k', '--routers', help='routers to measure memory over, each installs an LSP from every node', default=50, type=int)
+    router_parser.add_argument('-s', '--seed', help='random seed for the topology', default=1, type=int)
+
+    liveness_parser = subparsers.add_parser('liveness', help='cpu time of neighbor hello deadlines on a router with many neighbors and a few fast ones, a full scan against the deadline heap, and how fast failures are detected')
+    liveness_parser.add_argument('-n', '--neighbors', help='number of neighbors of the router', default=1000, type=int)
+    liveness_parser.add_argument('-b', '--fast_neighbors', help='neighbors with fast BFD like hello timers, the rest have the defaults', default=10, type=int)
+    liveness_parser.add_argument('-i', '--fast_hello_interval', help='milliseconds between hellos of the fast neighbors', default=50, type=int)
+    liveness_parser.add_argument('-x', '--fast_dead_interval', help='dead interval in milliseconds of the fast neighbors', default=150, type=int)
+    liveness_parser.add_argument('-t', '--duration', help='simulated seconds, one fast and one default neighbor fail halfway', default=60, type=float)
+    liveness_parser.add_argument('-s', '--seed', help='random seed for when the neighbors send their hellos', default=1, type=int)
+
+    lfa_parser = subparsers.add_parser('lfa', help='time to find loop-free alternates against a plain route recompute, how many dests get one and a check that none loops back')
+    lfa_parser.add_argument('-n', '--nodes', help='topology sizes to run', nargs='+', default=[100, 1000, 10000], type=int)
+    lfa_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    lfa_parser.add_argument('-c', '--max_cost', help='link costs are picked between 1 and this', default=1, type=int)
+    lfa_parser.add_argument('-k', '--routers', help='random routers to count alternates of', default=10, type=int)
+    lfa_parser.add_argument('-l', '--max_checked_nodes', help='only walk the paths of the alternates for loops up to this topology size', default=1000, type=int)
+    lfa_parser.add_argument('-r', '--repeat', help='runs to time per size', default=3, type=int)
+    lfa_parser.add_argument('-s', '--seed', help='random seed for the topologies and routers', default=1, type=int)
+
+    dataplane_parser = subparsers.add_parser('dataplane', help='routetrace packets per second a router forwards over localhost udp, in its event loop against receive workers, with the routes recomputed over and over or not')
+    dataplane_parser.add_argument('-n', '--nodes', help='topology size', default=1000, type=int)
+    dataplane_parser.add_argument('-d', '--degree', help='average number of neighbors per node', default=4, type=int)
+    dataplane_parser.add_argument('-w', '--workers', help='receive workers to run, 0 is the router forwarding in its event loop', nargs='+', default=[0, 1, 2, 4], type=int)
+    dataplane_parser.add_argument('-c', '--spf_every', help='milliseconds between forced route recomputes in the runs with churn', default=20, type=int)
+    dataplane_parser.add_argument('-k', '--senders', help='processes sending probes, each from its own port', default=4, type=int)
+    dataplane_parser.add_argument('-t', '--duration', help='seconds each run sends for', default=3, type=float)
+    dataplane_parser.add_argument('-p', '--port', help='first localhost port of the topology, the router gets this one', default=20000, type=int)
+    dataplane_parser.add_argument('-s', '--seed', help='random seed for the topology', default=1, type=int)
+
+    args = parser.parse_args()
+    return args
+
+def time_call(function, repeat):
+    best = None
+    result = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def benchmark_spf(args):
+    print('nodes\tengine\tbest (s)\tsame table as matrix')
+    for num_nodes in args.nodes:
+        network_topology = synthetic_topology(num_nodes, args.degree, args.seed, args.max_cost)
+        my_addr = next(iter(network_topology))
+        tables = {}
+        for engine in ENGINES:
+            if engine == 'matrix' and num_nodes > args.max_matrix_nodes:
+                print(num_nodes, engine, 'skipped', '-', sep='\t')
+                continue
+            elapsed, tables[engine] = time_call(lambda: find_shortest_path_and_return_forwarding_table(my_addr, network_topology, engine), args.repeat)
+            same = '-' if 'matrix' not in tables or engine == 'matrix' else tables[engine] == tables['matrix']
+            print(num_nodes, engine, '%.4f' % elapsed, same, sep='\t')
+
+# the topology the emulator should route over with some nodes and links taken out
+def topology_without(network_topology, down_nodes, down_links):
+    live_topology = {}
+    for node in network_topology:
+        if node in down_nodes:
+            continue
+        live_topology[node] = {neighbor: cost for neighbor, cost in network_topology[node].items()
+                               if neighbor not in down_nodes and frozenset((node, neighbor)) not in down_links}
+    return live_topology
+
+# takes a random node or link down or brings it back up, or with max_cost above 1 sometimes gives
+# a link a new cost instead
+def random_flap(rng, network_topology, nodes, my_addr, down_nodes, down_links, max_cost=1):
+    if max_cost > 1 and rng.random() < 0.3:
+        node = rng.choice(nodes)
+        neighbor = rng.choice(list(network_topology[node]))
+        cost = rng.randint(1, max_cost)
+        network_topology[node][neighbor] = cost
+        network_topology[neighbor][node] = cost
+        return 'cost', node, neighbor, cost
+
+    if rng.random() < 0.5:
+        node = rng.choice(nodes)
+        while node == my_addr:
+            node = rng.choice(nodes)
+        if node in down_nodes:
+            down_nodes.discard(node)
+            return 'node', node, None, True
+        down_nodes.add(node)
+        return 'node', node, None, False
+
+    node = rng.choice(nodes)
+    neighbor = rng.choice(list(network_topology[node]))
+    link = frozenset((node, neighbor))
+    if link in down_links:
+        down_links.discard(link)
+        return 'link', node, neighbor, True
+    down_links.add(link)
+    return 'link', node, neighbor, False
+
+# times the patched table against a full recompute after every flap, the two are checked to be the
+# same by test/test_incremental_spf.py
+def benchmark_incremental(args):
+    print('nodes\tevents\tmismatches\tfull (ms/event)\tincremental (ms/event)\tentries patched/event')
+    for num_nodes in args.nodes:
+        rng = random.Random(args.seed)
+        network_topology = synthetic_topology(num_nodes, args.degree, args.seed, args.max_cost)
+        nodes = list(network_topology)
+        my_addr = nodes[0]
+        spf = IncrementalSPF(my_addr, network_topology)
+        down_nodes = set()
+        down_links = set()
+        mismatches = 0
+        full_time = 0
+        incremental_time = 0
+        patched_entries = 0
+
+        for i in range(args.events):
+            kind, node, neighbor, available = random_flap(rng, network_topology, nodes, my_addr, down_nodes, down_links, args.max_cost)
+
+            start = time.perf_counter()
+            if kind == 'node':
+                changed_entries = spf.set_node_available(node, available)
+            elif kind == 'cost':
+                changed_entries = spf.set_link_cost(node, neighbor, available)
+            else:
+                changed_entries = spf.set_link_available(node, neighbor, available)
+            incremental_time += time.perf_counter() - start
+            patched_entries += len(changed_entries)
+
+            start = time.perf_counter()
+            live_topology = topology_without(network_topology, down_nodes, down_links)
+            expected_table = find_shortest_path_and_return_forwarding_table(my_addr, live_topology, 'heap')
+            full_time += time.perf_counter() - start
+
+            if spf.forwarding_table != expected_table:
+                mismatches += 1
+
+        print(num_nodes, args.events, mismatches,
+              '%.3f' % (full_time * 1000 / args.events),
+              '%.3f' % (incremental_time * 1000 / args.events),
+              '%.1f' % (patched_entries / args.events), sep='\t')
+
+def milliseconds_now():
+    return round(time.time() * 1000)
+
+def idle_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.setblocking(0)
+    return sock
+
+# the emulator's main loop before the event loop: spin on a non-blocking recvfrom
+def run_busy_loop(duration):
+    sock = idle_socket()
+    end = time.time() + duration
+    while time.time() < end:
+        try:
+            sock.recvfrom(8192)
+        except:
+            pass
+    sock.close()
+
+# the emulator's timers on an idle socket: hello every 1000 ms, lsp every 5000 ms
+# and a neighbor deadline 4000 ms out that keeps getting pushed back
+def run_event_loop(duration):
+    sock = idle_socket()
+    event_loop = EventLoop(milliseconds_now)
+    event_loop.add_reader(sock, lambda: sock.recvfrom(8192))
+
+    def every(interval):
+        def on_timer():
+            event_loop.call_later(interval, on_timer)
+        return on_timer
+
+    every(1000)()
+    every(5000)()
+    every(4000)()
+    event_loop.call_later(duration * 1000, event_loop.stop)
+    event_loop.run_forever()
+    sock.close()
+    return event_loop
+
+def benchmark_timers(args):
+    print('loop\tcpu %\ttimers fired\tmean lateness (ms)\tmax lateness (ms)')
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    run_busy_loop(args.duration)
+    cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start) * 100
+    print('busy', '%.1f' % cpu, '-', '-', '-', sep='\t')
+
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    event_loop = run_event_loop(args.duration)
+    cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start) * 100
+    mean_lateness = event_loop.total_timer_lateness / max(1, event_loop.timers_fired)
+    print('event', '%.1f' % cpu, event_loop.timers_fired, '%.2f' % mean_lateness, event_loop.max_timer_lateness, sep='\t')
+
+def operations_per_second(function, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        function()
+    return repeat / (time.perf_counter() - start)
+
+# binary cold is a neighbor list the encoder hasn't seen and an LSP decoded for the first time in the
+# process, straight from the received packet. binary cached is the refresh of a neighbor list the
+# encoder has seen, which is what most LSPs are, and the same LSP reaching another router of the
+# process
+def benchmark_lsp_codec(args):
+    print('neighbors\tformat\tbytes\tencodes/s\tdecodes/s')
+    origin = pack_node(synthetic_node(0))
+    for num_neighbors in args.neighbors:
+        neighboring_nodes = [synthetic_node(index) for index in range(num_neighbors)]
+        repeat = max(1, args.repeat * 10 // num_neighbors)
+
+        payload = pickle.dumps(neighboring_nodes)
+        encodes = operations_per_second(lambda: pickle.dumps(neighboring_nodes), repeat)
+        decodes = operations_per_second(lambda: pickle.loads(payload), repeat)
+        print(num_neighbors, 'pickle', len(payload), '%.0f' % encodes, '%.0f' % decodes, sep='\t')
+
+        payload = encode_lsp_payload(neighboring_nodes)
+        packet = bytearray(pack_header(Packet_Type.LINK_STATE_MESSAGE.value, origin, num_neighbors, 20, NO_NODE) + payload)
+        payload_view = memoryview(packet)[parse_header(packet)[5]:]
+        assert list(decode_lsp_payload(payload_view)) == [pack_node(node) for node in neighboring_nodes]
+        encodes = operations_per_second(lambda: encode_lsp_entries.__wrapped__(tuple(neighboring_nodes), False), repeat)
+        decodes = operations_per_second(lambda: decode_lsp_payload(payload_view), repeat)
+        print(num_neighbors, 'binary cold', len(payload), '%.0f' % encodes, '%.0f' % decodes, sep='\t')
+
+        encodes = operations_per_second(lambda: encode_lsp_payload(neighboring_nodes), repeat)
+        decodes = operations_per_second(lambda: decode_lsp_payload(payload_view, origin, num_neighbors), repeat)
+        print(num_neighbors, 'binary cached', len(payload), '%.0f' % encodes, '%.0f' % decodes, sep='\t')
+
+# how the send functions built the 49 byte header before, from "ip:port" strings
+def pack_header_from_strings(source_addr, time_to_live, dest_addr):
+    source_ip = source_addr.split(':')[0]
+    source_port = int(source_addr.split(':')[1])
+    dest_ip = dest_addr.split(':')[0]
+    dest_port = int(dest_addr.split(':')[1])
+    return struct.pack(
+        '!cIIIIIIIIIIII',
+        Packet_Type.ROUTE_TRACE.value.encode('ascii'),
+        int(source_ip.split('.')[0]), int(source_ip.split('.')[1]), int(source_ip.split('.')[2]), int(source_ip.split('.')[3]),
+        source_port,
+        0,
+        time_to_live,
+        int(dest_ip.split('.')[0]), int(dest_ip.split('.')[1]), int(dest_ip.split('.')[2]), int(dest_ip.split('.')[3]),
+        dest_port
+    )
+
+def parse_header_to_strings(packet):
+    header = struct.unpack('!cIIIIIIIIIIII', packet[:49])
+    source_ip = str(header[1]) + '.' + str(header[2]) + '.' + str(header[3]) + '.' + str(header[4])
+    dest_ip = str(header[8]) + '.' + str(header[9]) + '.' + str(header[10]) + '.' + str(header[11])
+    return header[0].decode('ascii'), source_ip, header[5], header[6], header[7], dest_ip, header[12]
+
+def benchmark_header(args):
+    source_addr = synthetic_node(1)
+    dest_addr = synthetic_node(2)
+    source_node = pack_node(source_addr)
+    dest_node = pack_node(dest_addr)
+
+    print('header\tbytes\tpacks/s\tparses/s')
+    packet = pack_header_from_strings(source_addr, 5, dest_addr)
+    packs = operations_per_second(lambda: pack_header_from_strings(source_addr, 5, dest_addr), args.repeat)
+    parses = operations_per_second(lambda: parse_header_to_strings(packet), args.repeat)
+    print('legacy', LEGACY_HEADER.size, '%.0f' % packs, '%.0f' % parses, sep='\t')
+
+    packet = pack_header(Packet_Type.ROUTE_TRACE.value, source_node, 0, 5, dest_node)
+    packs = operations_per_second(lambda: pack_header(Packet_Type.ROUTE_TRACE.value, source_node, 0, 5, dest_node), args.repeat)
+    parses = operations_per_second(lambda: parse_header(packet), args.repeat)
+    print('compact', len(packet), '%.0f' % packs, '%.0f' % parses, sep='\t')
+
+# the send loops before the packet cache: every packet is built again for every neighbor
+def send_uncached_round(sock, source_node, neighboring_nodes, sequence_number):
+    for neighbor in neighboring_nodes:
+        header = pack_header(Packet_Type.HELLO_MESSAGE.value, source_node, 0, 0, NO_NODE)
+        sock.sendto(header + 'hello'.encode(), socket_addresses[neighbor])
+    for neighbor in neighboring_nodes:
+        header = pack_header(Packet_Type.LINK_STATE_MESSAGE.value, source_node, sequence_number, 20, NO_NODE)
+        sock.sendto(header + encode_lsp_payload(neighboring_nodes), socket_addresses[neighbor])
+
+def send_cached_round(sock, packet_cache, neighboring_nodes, sequence_number):
+    send_to_nodes(sock, packet_cache.hello_packet(), neighboring_nodes)
+    send_to_nodes(sock, packet_cache.link_state_packet(sequence_number, 20, neighboring_nodes), neighboring_nodes)
+
+# nobody listens on the neighbor ports, the packets are dropped by the kernel after being sent
+def benchmark_flood(args):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    source_node = pack_node('127.0.0.1:' + str(sock.getsockname()[1]))
+    neighboring_nodes = ['127.0.0.1:' + str(20000 + index) for index in range(args.neighbors)]
+    packet_cache = PacketCache(pack_header, source_node)
+    num_packets = args.rounds * 2 * args.neighbors
+
+    print('sender\tpackets\tpackets/s per core\tpackets built')
+    cpu_start = time.process_time()
+    for sequence_number in range(args.rounds):
+        send_uncached_round(sock, source_node, neighboring_nodes, sequence_number)
+    cpu = time.process_time() - cpu_start
+    print('uncached', num_packets, '%.0f' % (num_packets / cpu), num_packets, sep='\t')
+
+    cpu_start = time.process_time()
+    for sequence_number in range(args.rounds):
+        send_cached_round(sock, packet_cache, neighboring_nodes, sequence_number)
+    cpu = time.process_time() - cpu_start
+    print('cached', num_packets, '%.0f' % (num_packets / cpu), packet_cache.builds, sep='\t')
+    sock.close()
+
+# the forwarding path before the in place rewrite: parse the header and pack a new one
+def forward_by_repacking(packet):
+    packet_type, source_node, sequence_number, time_to_live, dest_node, payload_offset = parse_header(packet)
+    return pack_header(packet_type, source_node, sequence_number, time_to_live - 1, dest_node) + ''.encode()
+
+def benchmark_forward(args):
+    source_node = pack_node(synthetic_node(1))
+    payload = encode_lsp_payload([synthetic_node(index) for index in range(args.neighbors)])
+
+    print('header\tpayload kept\tttl after\tforwards/s')
+    for header_format, pack_packet_header in (('compact', pack_header), ('legacy', pack_legacy_header)):
+        packet = bytearray(pack_packet_header(Packet_Type.LINK_STATE_MESSAGE.value, source_node, 7, 20, NO_NODE) + payload)
+        forwarded = decrement_time_to_live(memoryview(packet))
+        packet_type, node, sequence_number, time_to_live, dest_node, payload_offset = parse_header(forwarded)
+        payload_kept = bytes(forwarded[payload_offset:]) == payload and node == source_node and sequence_number == 7
+        # every packet is forwarded once, put the header back before the next one
+        original_header = bytes(packet[:payload_offset])
+        header_slice = slice(0, payload_offset)
+        forwards = operations_per_second(lambda: decrement_time_to_live(packet).__setitem__(header_slice, original_header), args.repeat)
+        print(header_format, payload_kept, time_to_live, '%.0f' % forwards, sep='\t')
+
+    packet = pack_header(Packet_Type.LINK_STATE_MESSAGE.value, source_node, 7, 20, NO_NODE) + payload
+    forwarded = forward_by_repacking(packet)
+    forwards = operations_per_second(lambda: forward_by_repacking(packet), args.repeat)
+    print('repack', len(forwarded) == len(packet), parse_header(forwarded)[3], '%.0f' % forwards, sep='\t')
+
+# messages one LSP costs when every node forwards every copy it receives to all its neighbors but
+# the origin until the time to live runs out, which is what the emulator did without duplicate
+# suppression
+# copies are counted per node and time to live rather than sent one by one, the count grows with
+# the number of paths
+def count_flood_without_suppression(network_topology, origin, time_to_live):
+    messages = 0
+    copies = {}
+    for neighbor in network_topology[origin]:
+        copies[neighbor] = copies.get(neighbor, 0) + 1
+        messages += 1
+
+    while time_to_live > 0 and len(copies) > 0:
+        time_to_live -= 1
+        forwarded_copies = {}
+        for node, count in copies.items():
+            for neighbor in network_topology[node]:
+                if neighbor == origin:
+                    continue
+                forwarded_copies[neighbor] = forwarded_copies.get(neighbor, 0) + count
+                messages += count
+        copies = forwarded_copies
+    return messages
+
+# messages one LSP costs with a link state database at every node: a copy is only forwarded the
+# first time it is installed, and never back to the neighbor it came from or to the origin
+def count_flood_with_lsdb(network_topology, origin, time_to_live, sequence_number):
+    lsdbs = {node: LinkStateDatabase(max_age=1) for node in network_topology}
+    messages = 0
+    queue = collections.deque((neighbor, origin, time_to_live) for neighbor in network_topology[origin])
+    messages += len(queue)
+    while len(queue) > 0:
+        node, received_from, time_to_live = queue.popleft()
+        if node == origin or not lsdbs[node].install(origin, sequence_number, 0):
+            continue
+        if time_to_live == 0:
+            continue
+        for neighbor in network_topology[node]:
+            if neighbor != received_from and neighbor != origin:
+                queue.append((neighbor, node, time_to_live - 1))
+                messages += 1
+    return messages
+
+def benchmark_lsdb(args):
+    topologies = [(filename, read_topology(filename, resolve=None)) for filename in args.filenames]
+    topologies += [('synthetic ' + str(num_nodes), synthetic_topology(num_nodes, args.degree, args.seed)) for num_nodes in args.nodes]
+    rng = random.Random(args.seed)
+
+    print('topology\tnodes\tlinks\tmessages per LSP without lsdb\twith lsdb\twith lsdb / links')
+    for name, network_topology in topologies:
+        nodes = list(network_topology)
+        num_links = sum(len(neighbors) for neighbors in network_topology.values()) // 2
+        origins = nodes if len(nodes) <= args.origins else rng.sample(nodes, args.origins)
+
+        without_lsdb = sum(count_flood_without_suppression(network_topology, origin, 20) for origin in origins) / len(origins)
+        with_lsdb = sum(count_flood_with_lsdb(network_topology, origin, 20, 1) for origin in origins) / len(origins)
+        print(name, len(nodes), num_links, '%.0f' % without_lsdb, '%.1f' % with_lsdb, '%.2f' % (with_lsdb / num_links), sep='\t')
+
+# how the emulator rebuilt its topology on every change before the live overlay
+def update_network_topology_by_copying(original_network_topology, available_nodes):
+    updated_network_topology = copy.deepcopy(original_network_topology)
+    unavailable_nodes = []
+    for node in available_nodes:
+        if not available_nodes[node] and node in updated_network_topology:
+            updated_network_topology.pop(node)
+            unavailable_nodes.append(node)
+    for node in updated_network_topology:
+        neighbors = updated_network_topology[node]
+        for neighbor in list(neighbors):
+            if neighbor in unavailable_nodes:
+                neighbors.pop(neighbor)
+    return updated_network_topology
+
+def walk_topology(network_topology):
+    return sum(1 for node in network_topology for neighbor in network_topology[node])
+
+# runs every event twice, timed and then under tracemalloc, and returns the seconds and the peak
+# bytes allocated per event
+def measure_events(events, handle_event):
+    start = time.perf_counter()
+    for event in events:
+        handle_event(event)
+    elapsed = time.perf_counter() - start
+
+    peak = 0
+    for event in events:
+        tracemalloc.start()
+        handle_event(event)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return elapsed / len(events), peak
+
+def benchmark_topology(args):
+    print('nodes\ttopology\tms/event\tpeak KiB/event\tms per full walk\tsame links')
+    for num_nodes in args.nodes:
+        rng = random.Random(args.seed)
+        original_network_topology = synthetic_topology(num_nodes, args.degree, args.seed)
+        nodes = list(original_network_topology)
+        # half of the flaps take a node down and the other half bring it back
+        events = []
+        for i in range(args.events // 2):
+            node = rng.choice(nodes)
+            events += [(node, False), (node, True)]
+        events.sort(key=lambda event: event[1])
+
+        available_nodes = {node: True for node in nodes}
+        def copy_event(event):
+            available_nodes[event[0]] = event[1]
+            update_network_topology_by_copying(original_network_topology, available_nodes)
+
+        live_topology = LiveTopology(original_network_topology)
+        def overlay_event(event):
+            live_topology.set_node_available(event[0], event[1])
+
+        copy_time, copy_peak = measure_events(events, copy_event)
+        overlay_time, overlay_peak = measure_events(events, overlay_event)
+
+        # both have to agree on what the topology looks like halfway through the flaps
+        for node, available in events[:len(events) // 2]:
+            available_nodes[node] = available
+            live_topology.set_node_available(node, available)
+        copied_topology = update_network_topology_by_copying(original_network_topology, available_nodes)
+        same_links = {node: dict(neighbors.items()) for node, neighbors in live_topology.items()} == copied_topology
+
+        copy_walk, walked = time_call(lambda: walk_topology(copied_topology), 3)
+        overlay_walk, walked = time_call(lambda: walk_topology(live_topology), 3)
+        print(num_nodes, 'copy', '%.3f' % (copy_time * 1000), '%.1f' % (copy_peak / 1024), '%.3f' % (copy_walk * 1000), '-', sep='\t')
+        print(num_nodes, 'overlay', '%.4f' % (overlay_time * 1000), '%.1f' % (overlay_peak / 1024), '%.3f' % (overlay_walk * 1000), same_links, sep='\t')
+
+# walks a flow hop by hop from ingress to dest the way the emulators forward it, counting every
+# pick among equal cost next hops in picks { (node, dest): { next_hop: flows } }
+# returns the cost of the path taken
+def walk_flow(network_topology, forwarding_tables, source_addr, ingress, dest, picks):
+    node = ingress
+    cost = 0
+    for hop in range(len(network_topology)):
+        if node == dest:
+            return cost
+        next_hops = forwarding_tables[node][dest]
+        next_hop = select_next_hop(next_hops, source_addr, dest, node)
+        if len(next_hops) > 1:
+            node_picks = picks.setdefault((node, dest), dict.fromkeys(next_hops, 0))
+            node_picks[next_hop] += 1
+        cost += max(network_topology[node].get(next_hop, 0), network_topology[next_hop].get(node, 0))
+        node = next_hop
+    return None # looped
+
+def benchmark_ecmp(args):
+    # flows are hashed over packed addresses like the emulator does, so hostnames need an ip
+    resolve = VirtualAddresses().__getitem__
+    topologies = [(filename, read_topology(filename, resolve=resolve, resolve_workers=1)) for filename in args.filenames]
+    topologies += [('synthetic ' + str(num_nodes), synthetic_topology(num_nodes, args.degree, args.seed)) for num_nodes in args.nodes]
+    rng = random.Random(args.seed)
+
+    print('topology\tequal cost (node, dest) pairs\tflows\tall on shortest paths\tbusiest next hop share / fair share, mean\tworst')
+    for name, network_topology in topologies:
+        nodes = list(network_topology)
+        forwarding_tables = {node: find_shortest_path_and_return_forwarding_table(node, network_topology, 'heap') for node in nodes}
+        adjacency_list, index_to_node_map, node_to_index_map = construct_adjacency_list(network_topology)
+        num_equal_cost_pairs = sum(1 for table in forwarding_tables.values() for next_hops in table.values() if len(next_hops) > 1)
+
+        picks = {}
+        num_flows = 0
+        all_shortest = True
+        for ingress in nodes:
+            min_distance = heap_dijkstra(adjacency_list, node_to_index_map[ingress])[0]
+            for dest in forwarding_tables[ingress]:
+                for flow in range(args.flows):
+                    source_addr = synthetic_node(rng.randrange(1 << 24))
+                    cost = walk_flow(network_topology, forwarding_tables, source_addr, ingress, dest, picks)
+                    all_shortest = all_shortest and cost == min_distance[node_to_index_map[dest]]
+                    num_flows += 1
+
+        # 1.00 is a perfectly even split at every node that had a choice
+        shares = [max(node_picks.values()) / sum(node_picks.values()) * len(node_picks) for node_picks in picks.values()] or [1]
+        print(name, num_equal_cost_pairs, num_flows, all_shortest, '%.2f' % (sum(shares) / len(shares)), '%.2f' % max(shares), sep='\t')
+
+def benchmark_all_pairs(args):
+    processes = args.processes or os.cpu_count() or 1
+    print('nodes\truns\tseconds\ttables checked\tsame as single source')
+    for num_nodes in args.nodes:
+        rng = random.Random(args.seed)
+        network_topology = synthetic_topology(num_nodes, args.degree, args.seed)
+        nodes = list(network_topology)
+
+        start = time.perf_counter()
+        routes = compute_all_pairs_routes(network_topology, processes=1)
+        print(num_nodes, 'serial', '%.2f' % (time.perf_counter() - start), '-', '-', sep='\t')
+
+        start = time.perf_counter()
+        routes = compute_all_pairs_routes(network_topology, processes)
+        elapsed = time.perf_counter() - start
+        checked_sources = rng.sample(nodes, min(args.checked_sources, num_nodes))
+        same = all(routes.forwarding_table(node) == find_shortest_path_and_return_forwarding_table(node, network_topology, 'heap') for node in checked_sources)
+        print(num_nodes, str(processes) + ' processes', '%.2f' % elapsed, len(checked_sources), same, sep='\t')
+
+        # what-if: the same failure set asked about twice is only computed once
+        cache = AllPairsCache(processes=processes)
+        live_topology = LiveTopology(network_topology)
+        live_topology.set_node_available(nodes[1], False)
+        start = time.perf_counter()
+        cache.get(live_topology)
+        first = time.perf_counter() - start
+        live_topology.set_node_available(nodes[1], True)
+        live_topology.set_node_available(nodes[1], False)
+        start = time.perf_counter()
+        cache.get(live_topology)
+        print(num_nodes, 'node down', '%.2f' % first, '-', '-', sep='\t')
+        print(num_nodes, 'same again', '%.2f' % (time.perf_counter() - start), '-', 'cache hits ' + str(cache.hits), sep='\t')
+
+# how the emulator printed the routes before table_writer.py, one print per field
+def print_topology_and_forwarding_table(network_topology, forwarding_table, file=sys.stdout):
+    print('Topology:', file=file)
+    print(file=file)
+    for node in network_topology:
+        ip, port = get_ip_and_port_from_full_addr(node)
+        print(ip, ',', port, sep='', end=" ", file=file)
+        for neighbor, cost in network_topology[node].items():
+            ip, port = get_ip_and_port_from_full_addr(neighbor)
+            if cost == 1:
+                print(ip, ',', port, sep='', end=" ", file=file)
+            else:
+                print(ip, ',', port, ',', cost, sep='', end=" ", file=file)
+        print(file=file)
+
+    print(file=file)
+    print('Forwarding table:', file=file)
+    print(file=file)
+    for node in forwarding_table:
+        ip, port = get_ip_and_port_from_full_addr(node)
+        print(ip, ',', port, sep='', end=" ", file=file)
+        next_hops = forwarding_table[node]
+        for next_hop in next_hops:
+            ip, port = get_ip_and_port_from_full_addr(next_hop)
+            print(ip, ',', port, sep='', end=" ", file=file)
+        print(file=file)
+    print(file=file)
+
+# replays the same node flaps, one every gap milliseconds of simulated time, into one way of writing
+# the routes. the file is line buffered like a terminal, only the time spent writing is counted
+def replay_churn_into_output(args, mode, interval):
+    rng = random.Random(args.seed)
+    network_topology = LiveTopology(synthetic_topology(args.nodes, args.degree, args.seed))
+    nodes = list(network_topology.original_network_topology)
+    my_addr = nodes[0]
+    spf = IncrementalSPF(my_addr, network_topology)
+    event_loop = SimulatedEventLoop()
+    elapsed = 0
+
+    with tempfile.TemporaryFile('w', buffering=1) as file:
+        table_writer = None
+        if mode is not None:
+            table_writer = TableWriter(file, event_loop, my_addr, mode, interval)
+
+        def routes_changed():
+            if table_writer is None:
+                print_topology_and_forwarding_table(network_topology, spf.forwarding_table, file)
+            else:
+                table_writer.routes_changed(network_topology, spf.forwarding_table)
+
+        start = time.perf_counter()
+        routes_changed()
+        elapsed += time.perf_counter() - start
+
+        for i in range(args.events):
+            start = time.perf_counter()
+            event_loop.run_until(i * args.gap)
+            elapsed += time.perf_counter() - start
+
+            node = rng.choice(nodes[1:])
+            available = not network_topology.is_available(node)
+            network_topology.set_node_available(node, available)
+            spf.set_node_available(node, available)
+
+            start = time.perf_counter()
+            routes_changed()
+            elapsed += time.perf_counter() - start
+
+        start = time.perf_counter()
+        event_loop.run_until(args.events * args.gap + interval)
+        elapsed += time.perf_counter() - start
+        writes = args.events + 1 if table_writer is None else table_writer.writes
+        return writes, file.tell(), elapsed
+
+def benchmark_output(args):
+    print('output\tinterval (ms)\twrites\tKiB written\toutput ms/change')
+    runs = [('print', None, 0), ('full', 'full', 0), ('diff', 'diff', 0), ('json', 'json', 0), ('diff', 'diff', args.interval), ('json', 'json', args.interval)]
+    for name, mode, interval in runs:
+        writes, bytes_written, elapsed = replay_churn_into_output(args, mode, interval)
+        print(name, interval, writes, '%.0f' % (bytes_written / 1024), '%.3f' % (elapsed * 1000 / args.events), sep='\t')
+
+# how read_topology resolved before resolve_hostnames, every hostname on every line one at a time
+def read_topology_resolving_every_token(filename, resolve):
+    network_topology = {}
+    with open(filename, 'r') as file:
+        file_lines = file.readlines()
+
+    for line in file_lines:
+        nodes_in_line = line.split()
+        if len(nodes_in_line) == 0:
+            continue
+        source_hostname = nodes_in_line[0].split(',')[0]
+        source_port = nodes_in_line[0].split(',')[1]
+        source_node = resolve(source_hostname) + ':' + source_port
+        network_topology[source_node] = {}
+        for index in range(1, len(nodes_in_line)):
+            node_fields = nodes_in_line[index].split(',')
+            node = resolve(node_fields[0]) + ':' + node_fields[1]
+            cost = int(node_fields[2]) if len(node_fields) > 2 else 1
+            if node not in network_topology[source_node]:
+                network_topology[source_node][node] = cost
+    return network_topology
+
+def benchmark_load(args):
+    network_topology = synthetic_topology(args.nodes, args.degree, args.seed)
+    node_ids = {node: node_id for node_id, node in enumerate(network_topology)}
+
+    # node i is port i on host i // ports_per_host
+    def node_in_file(node):
+        node_id = node_ids[node]
+        return 'host-' + str(node_id // args.ports_per_host) + ',' + str(1024 + node_id)
+
+    # a resolver that takes latency ms per lookup, like one that has to ask a slow dns server
+    def slow_resolve(hostname):
+        time.sleep(args.latency / 1000)
+        host_index = int(hostname.split('-')[1])
+        return '10.0.' + str(host_index >> 8) + '.' + str(host_index & 255)
+
+    with tempfile.TemporaryDirectory() as directory:
+        text_filename = os.path.join(directory, 'topology.txt')
+        compiled_filename = os.path.join(directory, 'topology.bin')
+        with open(text_filename, 'w') as file:
+            for node in network_topology:
+                file.write(' '.join([node_in_file(node)] + [node_in_file(neighbor) for neighbor in network_topology[node]]) + '\n')
+
+        print('load\tseconds\tnodes\tsame topology')
+        start = time.perf_counter()
+        expected_topology = read_topology_resolving_every_token(text_filename, slow_resolve)
+        print('every token', '%.3f' % (time.perf_counter() - start), len(expected_topology), '-', sep='\t')
+
+        start = time.perf_counter()
+        text_topology = read_topology(text_filename, resolve=slow_resolve)
+        print('each hostname once', '%.3f' % (time.perf_counter() - start), len(text_topology), text_topology == expected_topology, sep='\t')
+
+        start = time.perf_counter()
+        text_topology = read_topology(text_filename, resolve=slow_resolve)
+        print('resolver cached', '%.3f' % (time.perf_counter() - start), len(text_topology), text_topology == expected_topology, sep='\t')
+        resolved_hostnames.clear()
+
+        write_compiled_topology(text_topology, compiled_filename)
+        start = time.perf_counter()
+        compiled_topology = read_topology(compiled_filename)
+        print('compiled', '%.3f' % (time.perf_counter() - start), len(compiled_topology), compiled_topology == expected_topology, sep='\t')
+
+        # what a router loads before it can start: the topology and the node registry on top of it,
+        # every run packs the nodes from scratch
+        packed_node_caches = (packed_nodes, unpacked_nodes, socket_addresses)
+        for cache in packed_node_caches:
+            cache.clear()
+        start = time.perf_counter()
+        registry = NodeRegistry(read_topology(text_filename, resolve=slow_resolve))
+        print('text + registry', '%.3f' % (time.perf_counter() - start), len(registry), '-', sep='\t')
+        resolved_hostnames.clear()
+
+        for cache in packed_node_caches:
+            cache.clear()
+        start = time.perf_counter()
+        registry = NodeRegistry(CompiledTopology(compiled_filename).to_dict())
+        print('compiled dict + registry', '%.3f' % (time.perf_counter() - start), len(registry), '-', sep='\t')
+
+        for cache in packed_node_caches:
+            cache.clear()
+        start = time.perf_counter()
+        registry = NodeRegistry(read_topology(compiled_filename))
+        print('compiled + registry', '%.3f' % (time.perf_counter() - start), len(registry), '-', sep='\t')
+
+# a socket that sends nowhere
+class DiscardSocket:
+    def sendto(self, packet, address):
+        pass
+
+# microseconds a router spends in handle_packet per packet, the best of rounds runs over a share of
+# the packets each. every packet is a fresh copy since forwarded packets are changed in place
+def time_handle_packet(router, packets, sender_address, rounds=5):
+    copies = [bytearray(packet) for packet in packets]
+    round_size = len(copies) // rounds
+    best = None
+    for start_index in range(0, round_size * rounds, round_size):
+        start = time.perf_counter()
+        for packet in copies[start_index:start_index + round_size]:
+            router.handle_packet(packet, sender_address)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e6 / round_size
+
+def benchmark_router(args):
+    network_topology = synthetic_topology(args.nodes, args.degree, args.seed)
+    nodes = list(network_topology)
+    my_addr = nodes[0]
+    neighbor = next(iter(network_topology[my_addr]))
+    neighbor_address = socket_addresses[neighbor]
+    router = Router(my_addr, network_topology, DiscardSocket(), SimulatedEventLoop(), output=None, log=None)
+
+    hellos = [PacketCache(pack_header, pack_node(neighbor)).hello_packet()] * args.repeat
+    # a new sequence number every time, so every LSP is installed and flooded, from origins that
+    # change nothing
+    lsps = []
+    for i in range(args.repeat):
+        origin = nodes[1 + i % (len(nodes) - 1)]
+        lsps.append(PacketCache(pack_header, pack_node(origin)).link_state_packet(1 + i, 20, network_topology[origin]))
+    # from a routetrace tool that isn't in the topology, to dests all over it
+    tool_node = pack_node('127.0.0.1:9')
+    routetraces = [pack_header(Packet_Type.ROUTE_TRACE.value, tool_node, i, 10, pack_node(nodes[1 + i % (len(nodes) - 1)])) for i in range(args.repeat)]
+
+    print('packet\tus/packet')
+    print('hello', '%.2f' % time_handle_packet(router, hellos, neighbor_address), sep='\t')
+    print('lsp', '%.2f' % time_handle_packet(router, lsps, neighbor_address), sep='\t')
+    print('routetrace', '%.2f' % time_handle_packet(router, routetraces, ('127.0.0.1', 9)), sep='\t')
+
+    # what a router keeps once it has heard from every node, the topology and the node registry
+    # are shared by every router of a process
+    lsps_of_every_node = [PacketCache(pack_header, pack_node(origin)).link_state_packet(1, 20, network_topology[origin]) for origin in nodes]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    registry = NodeRegistry(network_topology)
+    registry_bytes = tracemalloc.get_traced_memory()[0] - before
+    print('registry', '%.0f bytes per node' % (registry_bytes / len(nodes)), sep='\t')
+
+    before = tracemalloc.get_traced_memory()[0]
+    routers = []
+    for node in nodes[:args.routers]:
+        router = Router(node, network_topology, DiscardSocket(), SimulatedEventLoop(), output=None, log=None, registry=registry)
+        for packet in lsps_of_every_node:
+            router.handle_packet(bytearray(packet), neighbor_address)
+        routers.append(router)
+    bytes_per_router = (tracemalloc.get_traced_memory()[0] - before) / len(routers)
+    tracemalloc.stop()
+    print('memory', '%.1f KiB/router' % (bytes_per_router / 1024), '%.0f bytes per node per router' % (bytes_per_router / len(nodes)), sep='\t')
+
+# whether any shortest path from backup to dest leads through my_addr, following every equal cost
+# next hop of every router on the way. tables caches the routers' forwarding tables
+def alternate_loops_back(network_topology, tables, my_addr, backup, dest):
+    seen = set()
+    stack = [backup]
+    while len(stack) > 0:
+        node = stack.pop()
+        if node == my_addr:
+            return True
+        if node == dest or node in seen:
+            continue
+        seen.add(node)
+        if node not in tables:
+            tables[node] = find_shortest_path_and_return_forwarding_table(node, network_topology, 'heap')
+        stack.extend(tables[node][dest])
+    return False
+
+def benchmark_lfa(args):
+    rng = random.Random(args.seed)
+    print('nodes\tspf (s)\trecompute with alternates (s)\tdests with an alternate\tor a second next hop\talternates that loop back')
+    for num_nodes in args.nodes:
+        network_topology = synthetic_topology(num_nodes, args.degree, args.seed, args.max_cost)
+        nodes = list(network_topology)
+        my_addr = nodes[0]
+        spf_time, forwarding_table = time_call(lambda: find_shortest_path_and_return_forwarding_table(my_addr, network_topology, 'heap'), args.repeat)
+        lfa_time, backups = time_call(lambda: find_loop_free_alternates(my_addr, network_topology), args.repeat)
+
+        dests = 0
+        with_alternate = 0
+        protected = 0
+        loops = 0 if num_nodes <= args.max_checked_nodes else '-'
+        tables = {}
+        for node in rng.sample(nodes, min(args.routers, num_nodes)):
+            backups = find_loop_free_alternates(node, network_topology)
+            forwarding_table = find_shortest_path_and_return_forwarding_table(node, network_topology, 'heap')
+            dests += len(forwarding_table)
+            with_alternate += len(backups)
+            protected += sum(1 for dest, next_hops in forwarding_table.items() if dest in backups or len(next_hops) > 1)
+            if num_nodes <= args.max_checked_nodes:
+                loops += sum(1 for dest, backup in backups.items() if alternate_loops_back(network_topology, tables, node, backup, dest))
+        print(num_nodes, '%.4f' % spf_time, '%.4f' % (spf_time + lfa_time), '%.1f%%' % (100 * with_alternate / dests), '%.1f%%' % (100 * protected / dests), loops, sep='\t')
+
+# how the emulator tracked hello deadlines before liveness.py: every time the deadline timer fires
+# it scans every neighbor, and finding when to wake up next is a min over every neighbor too.
+# same methods as NeighborLiveness so run_liveness can drive either
+class ScanningLiveness:
+    def __init__(self):
+        self.neighbors = {} # { node: {"deadline", "dead_interval", "up"} }
+
+    def add(self, node, hello_interval, dead_interval, time_now):
+        self.neighbors[node] = {"deadline": time_now + dead_interval, "dead_interval": dead_interval, "up": True}
+
+    def heard_from(self, node, time_now):
+        hello = self.neighbors[node]
+        hello["deadline"] = time_now + hello["dead_interval"]
+        if hello["up"]:
+            return False
+        hello["up"] = True
+        return True
+
+    def next_deadline(self):
+        deadlines = [hello["deadline"] for hello in self.neighbors.values() if hello["up"]]
+        return min(deadlines) if len(deadlines) > 0 else None
+
+    def expire(self, time_now):
+        expired = []
+        for node, hello in self.neighbors.items():
+            if time_now > hello["deadline"] and hello["up"]:
+                hello["up"] = False
+                expired.append(node)
+        return expired
+
+# one router's neighbors sending hellos on a simulated clock, with the router's deadline timer
+# logic from emulator.Router. fails the nodes of failed at fail_at, they send nothing afterwards
+# returns the seconds spent in the liveness tracking on hellos and on the deadline timer, the
+# number of timer wakeups and { failed node: milliseconds from its failure until it was found down }
+def run_liveness(liveness, neighbor_timers, duration, fail_at, failed, seed):
+    rng = random.Random(seed)
+    event_loop = SimulatedEventLoop()
+    deadline_timer = [None]
+    spent = [0.0]
+    spent_on_hellos = [0.0]
+    wakeups = [0]
+    detected = {}
+
+    def schedule_deadline_timer():
+        start = time.perf_counter()
+        deadline = liveness.next_deadline()
+        spent[0] += time.perf_counter() - start
+        if deadline is None:
+            return
+        timer = deadline_timer[0]
+        if timer is not None:
+            if timer.deadline <= deadline + 1:
+                return
+            timer.cancel()
+        deadline_timer[0] = event_loop.call_at(deadline + 1, on_deadline_timer)
+
+    def on_deadline_timer():
+        deadline_timer[0] = None
+        wakeups[0] += 1
+        start = time.perf_counter()
+        expired = liveness.expire(event_loop.time())
+        spent[0] += time.perf_counter() - start
+        for node in expired:
+            if node in failed and node not in detected:
+                detected[node] = event_loop.time() - fail_at
+        schedule_deadline_timer()
+
+    def hello_timer(node, hello_interval):
+        def on_hello():
+            if node in failed and event_loop.time() >= fail_at:
+                return
+            event_loop.call_later(hello_interval, on_hello)
+            start = time.perf_counter()
+            came_up = liveness.heard_from(node, event_loop.time())
+            spent_on_hellos[0] += time.perf_counter() - start
+            if came_up:
+                schedule_deadline_timer()
+        return on_hello
+
+    for node, (hello_interval, dead_interval) in neighbor_timers.items():
+        liveness.add(node, hello_interval, dead_interval, 0)
+        event_loop.call_at(rng.randrange(hello_interval), hello_timer(node, hello_interval))
+    schedule_deadline_timer()
+    event_loop.run_until(duration)
+    return spent_on_hellos[0], spent[0], wakeups[0], detected
+
+def benchmark_liveness(args):
+    neighbor_timers = {}
+    for i in range(args.neighbors):
+        if i < args.fast_neighbors:
+            neighbor_timers[synthetic_node(i)] = (args.fast_hello_interval, args.fast_dead_interval)
+        else:
+            neighbor_timers[synthetic_node(i)] = (HELLO_INTERVAL, NEIGHBOR_DEADLINE)
+    duration = round(args.duration * 1000)
+    fail_at = duration // 2
+    failed = {synthetic_node(0), synthetic_node(args.neighbors - 1)}
+
+    print('tracking\thello cpu ms\ttimer cpu ms\twakeups\tus/wakeup\tfast detected after ms\tdefault detected after ms')
+    for name, liveness in [('full scan', ScanningLiveness()), ('deadline heap', NeighborLiveness())]:
+        spent_on_hellos, spent, wakeups, detected = run_liveness(liveness, neighbor_timers, duration, fail_at, failed, args.seed)
+        print(name, '%.1f' % (spent_on_hellos * 1000), '%.1f' % (spent * 1000), wakeups, '%.1f' % (spent * 1e6 / max(1, wakeups)),
+              detected.get(synthetic_node(0), '-'), detected.get(synthetic_node(args.neighbors - 1), '-'), sep='\t')
+
+# the topology with every node on a localhost port from base_port on, in topology order
+def localhost_topology(network_topology, base_port):
+    names = {node: '127.0.0.1:' + str(base_port + index) for index, node in enumerate(network_topology)}
+    return {names[node]: {names[neighbor]: cost for neighbor, cost in links.items()} for node, links in network_topology.items()}
+
+# sends probes to address from a port of its own until stop_time, puts how many it sent on results
+def send_probes(address, probes, stop_time, results):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sent = 0
+    while time.monotonic() < stop_time:
+        for probe in probes:
+            sock.sendto(probe, address)
+        sent += len(probes)
+    results.put(('sent', sent))
+
+# runs the router on my_addr until duration after it said it is ready, then puts the packets it
+# forwarded and how many times it ran SPF on results. spf_every forces a full route recompute
+# every that many milliseconds, 0 never
+def run_dataplane_router(network_topology, my_addr, num_workers, spf_every, duration, ready, results):
+    registry = NodeRegistry(network_topology)
+    event_loop = EventLoop(milliseconds_now)
+    address = socket_addresses[my_addr]
+    dataplane = None
+    if num_workers > 0:
+        dataplane = DataPlane(my_addr, address, registry, num_workers)
+        sock = dataplane.control_socket
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(address)
+        sock.setblocking(0)
+    router = Router(my_addr, network_topology, sock, event_loop, output=None, log=None, registry=registry,
+                    snapshot=None if dataplane is None else dataplane.snapshot)
+    if dataplane is None:
+        router.listen()
+    else:
+        dataplane.start()
+        dataplane.listen(event_loop, router.handle_packet)
+
+    def recompute():
+        router.on_spf_timer()
+        event_loop.call_later(spf_every, recompute)
+    if spf_every > 0:
+        event_loop.call_later(spf_every, recompute)
+    event_loop.call_later(duration * 1000, event_loop.stop)
+    ready.put(True)
+    event_loop.run_forever()
+
+    if dataplane is None:
+        forwarded = router.metrics.packets_sent[Packet_Type.ROUTE_TRACE.value]
+    else:
+        forwarded = sum(worker["forwarded"] for worker in dataplane.stats()["workers"])
+        dataplane.stop()
+    results.put(('router', forwarded, router.spf_throttle.runs))
+
+def benchmark_dataplane(args):
+    network_topology = localhost_topology(synthetic_topology(args.nodes, args.degree, args.seed), args.port)
+    nodes = list(network_topology)
+    my_addr = nodes[0]
+    # from a routetrace tool that isn't in the topology to dests all over it, never answered by the
+    # router itself. the neighbors' ports aren't bound, what is forwarded to them is dropped there
+    tool_node = pack_node('127.0.0.1:9')
+    probes = [pack_header(Packet_Type.ROUTE_TRACE.value, tool_node, i, 64, pack_node(nodes[1 + i % (len(nodes) - 1)])) for i in range(100)]
+    context = multiprocessing.get_context('fork')
+
+    print('cpus', os.cpu_count(), sep='\t')
+    print('workers\tspf every ms\tspf runs\tsent/s\tforwarded/s')
+    for spf_every in [0, args.spf_every]:
+        for num_workers in args.workers:
+            ready = context.Queue()
+            results = context.Queue()
+            # the router runs a little longer than the probes are sent, so it counts every probe it got
+            router_process = context.Process(target=run_dataplane_router, args=(network_topology, my_addr, num_workers, spf_every, args.duration + 0.5, ready, results))
+            router_process.start()
+            ready.get()
+            stop_time = time.monotonic() + args.duration
+            senders = [context.Process(target=send_probes, args=(socket_addresses[my_addr], probes, stop_time, results)) for i in range(args.senders)]
+            for sender in senders:
+                sender.start()
+            sent = 0
+            for i in range(args.senders + 1):
+                result = results.get()
+                if result[0] == 'sent':
+                    sent += result[1]
+                else:
+                    forwarded, spf_runs = result[1], result[2]
+            for process in senders + [router_process]:
+                process.join()
+            print(num_workers, spf_every if spf_every > 0 else '-', spf_runs, '%.0f' % (sent / args.duration), '%.0f' % (forwarded / args.duration), sep='\t')
+
+BENCHMARKS = {
+    'spf': benchmark_spf,
+    'incremental': benchmark_incremental,
+    'timers': benchmark_timers,
+    'lsp-codec': benchmark_lsp_codec,
+    'header': benchmark_header,
+    'flood': benchmark_flood,
+    'forward': benchmark_forward,
+    'lsdb': benchmark_lsdb,
+    'topology': benchmark_topology,
+    'ecmp': benchmark_ecmp,
+    'all-pairs': benchmark_all_pairs,
+    'output': benchmark_output,
+    'load': benchmark_load,
+    'router': benchmark_router,
+    'liveness': benchmark_liveness,
+    'lfa': benchmark_lfa,
+    'dataplane': benchmark_dataplane,
+}
+
+if __name__ == '__main__':
+    args = parse_command_line_args()
+    BENCHMARKS[args.benchmark](args)
@@ -0,0 +1,325 @@
+import array
+import functools
+import mmap
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import struct
+
+from packet import HEADER_FORMATS, Packet_Type, decrement_time_to_live, parse_header
+from shortest_path import flow_hash, flow_hash_seed
+
+ROUTE_TRACE = Packet_Type.ROUTE_TRACE.value
+
+MAX_PACKETS_PER_BATCH = 64
+MAX_PACKET_SIZE = 65535
+SNAPSHOT_MAX_NEXT_HOPS = 4 # equal cost next hops kept per dest, the rest are left out
+WORKER_IDLE_TIMEOUT = 1 # seconds a worker waits for packets before checking its control process is still there
+WORKER_CHECK_INTERVAL = 1000 # milliseconds between two checks of the control process for dead workers
+
+# how a worker hands a control packet to the control process: the address it came from, then the packet
+RELAYED_ADDRESS = struct.Struct('!4sH')
+
+# per worker counters in shared memory
+WORKER_COUNTERS = ('forwarded', 'answered', 'relayed', 'relay_dropped', 'no_route', 'send_dropped')
+
+# the next hops of every dest as the data plane forwards with them, in memory shared with the
+# worker processes. there are two copies: the control process writes the one the workers aren't
+# reading and then flips which one is active, so a worker never sees half a table
+# every copy has a generation that is odd while the copy is being written; a worker that read a
+# copy while it got rewritten, because it was stalled across two publishes, sees the generation
+# change and looks again
+# layout, uint32 words: the active copy, the generation of either copy, then either copy, where
+# every dest id has 1 + max_next_hops words: how many next hops and the next hop ids
+class ForwardingSnapshot:
+    HEADER_WORDS = 4
+
+    def __init__(self, num_nodes, max_next_hops=SNAPSHOT_MAX_NEXT_HOPS):
+        self.num_nodes = num_nodes
+        self.max_next_hops = max_next_hops
+        self.stride = 1 + max_next_hops
+        self.copy_words = num_nodes * self.stride
+        # anonymous and shared, processes forked afterwards see the same pages
+        self.memory = mmap.mmap(-1, 4 * (self.HEADER_WORDS + 2 * self.copy_words))
+        self.words = memoryview(self.memory).cast('I')
+        self.publishes = 0
+
+    # control side: next_hops[dest id] is a tuple of next hop ids, or None when dest can't be reached
+    def publish(self, next_hops):
+        entries = array.array('I', bytes(4 * self.copy_words))
+        stride = self.stride
+        max_next_hops = self.max_next_hops
+        for dest_id, hops in enumerate(next_hops[:self.num_nodes]):
+            if hops is None:
+                continue
+            hops = hops[:max_next_hops]
+            offset = dest_id * stride
+            entries[offset] = len(hops)
+            entries[offset + 1:offset + 1 + len(hops)] = array.array('I', hops)
+
+        words = self.words
+        inactive = 1 - words[0]
+        start = self.HEADER_WORDS + inactive * self.copy_words
+        words[1 + inactive] += 1
+        words[start:start + self.copy_words] = memoryview(entries)
+        words[1 + inactive] += 1
+        words[0] = inactive
+        self.publishes += 1
+
+    # worker side: the next hop ids of dest, None when it can't be reached
+    def lookup(self, dest_id):
+        words = self.words
+        while True:
+            active = words[0]
+            generation = words[1 + active]
+            if generation & 1:
+                continue
+            offset = self.HEADER_WORDS + active * self.copy_words + dest_id * self.stride
+            count = words[offset]
+            if count == 0:
+                hops = None
+            elif count == 1:
+                hops = (words[offset + 1],)
+            else:
+                hops = tuple(words[offset + 1:offset + 1 + count])
+            if words[1 + active] == generation and words[0] == active:
+                return hops
+
+# the control process's socket: what the router sends goes out through a worker's socket, so it
+# leaves from the router's address, see DataPlane. packets take turns over the workers and skip one
+# whose relay is full or whose worker is gone, so one worker dying doesn't silence the router
+# sendto never raises: a packet no relay takes is dropped and counted, like a full udp socket buffer
+# would drop it, and the rest of a hello or LSP fan-out still goes out
+class RelaySocket:
+    def __init__(self, relays):
+        self.relays = relays # the DataPlane's list, a restarted worker's relay shows up in it
+        self.next_relay = 0
+        self.packed_addresses = {} # { (ip, port): packed address }
+        self.dropped = 0
+
+    def sendto(self, packet, address):
+        packed_address = self.packed_addresses.get(address)
+        if packed_address is None:
+            packed_address = self.packed_addresses[address] = pack_address(address)
+        message = packed_address + packet
+        relays = self.relays
+        for i in range(len(relays)):
+            relay = relays[self.next_relay]
+            self.next_relay = (self.next_relay + 1) % len(relays)
+            try:
+                relay.send(message)
+                return
+            except OSError:
+                continue
+        self.dropped += 1
+
+def pack_address(address):
+    return RELAYED_ADDRESS.pack(socket.inet_aton(address[0]), address[1])
+
+# receive workers forwarding routetrace packets for one router, each a process with its own
+# SO_REUSEPORT socket on the router's address, the kernel spreads senders over them. a worker drains
+# up to MAX_PACKETS_PER_BATCH packets per wakeup, forwards routetrace packets with the forwarding
+# snapshot and relays everything else, hellos and LSPs, to the control process over a unix socket
+# the control process runs the Router: it reads the relayed packets, runs SPF and publishes the
+# snapshot, so a route recompute holds up hellos and LSPs but never forwarding. it has no udp
+# socket of its own, one bound to the router's address would get its share of every sender's
+# packets; it hands what it sends to the workers instead, see RelaySocket
+# relays don't block either way, a packet that doesn't fit is dropped and counted like a full udp
+# socket buffer would drop it. once listening, the control process checks on the workers every
+# WORKER_CHECK_INTERVAL and starts a new one in place of any that died
+class DataPlane:
+    def __init__(self, my_addr, address, registry, num_workers, header_format='compact'):
+        self.my_addr = my_addr
+        self.address = address
+        self.registry = registry
+        self.num_workers = num_workers
+        self.pack_packet_header = HEADER_FORMATS[header_format]
+        self.snapshot = ForwardingSnapshot(registry.num_topology_nodes)
+        self.counters = memoryview(mmap.mmap(-1, 8 * num_workers * len(WORKER_COUNTERS))).cast('Q')
+
+        self.workers = [None] * num_workers
+        self.relays = [None] * num_workers # the control process's end of every worker's relay
+        self.control_socket = RelaySocket(self.relays)
+        self.restarts = 0
+        self.event_loop = None
+        self.handle_packet = None
+        self.check_timer = None
+        self.receive_buffer = bytearray(MAX_PACKET_SIZE)
+        self.receive_view = memoryview(self.receive_buffer)
+
+    # forks the workers, the registry and the snapshot are shared with them from here on
+    def start(self):
+        for worker_index in range(self.num_workers):
+            self.start_worker(worker_index)
+
+    # a fresh socket and relay for the worker, whatever its old ones had queued is gone with them
+    def start_worker(self, worker_index):
+        sock = reuseport_socket(self.address)
+        relay, worker_relay = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        relay.setblocking(0)
+        worker_relay.setblocking(0)
+        self.relays[worker_index] = relay
+        worker = multiprocessing.get_context('fork').Process(target=self.run_worker, args=(worker_index, sock, worker_relay, os.getpid()), daemon=True)
+        worker.start()
+        self.workers[worker_index] = worker
+        # the worker's ends are the worker's now
+        sock.close()
+        worker_relay.close()
+        if self.event_loop is not None:
+            self.event_loop.add_reader(relay, functools.partial(self.on_relay_readable, relay))
+
+    def stop(self):
+        if self.check_timer is not None:
+            self.check_timer.cancel()
+            self.check_timer = None
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+
+    # has the event loop hand relayed packets to handle_packet(packet, (ip, port)) and look after
+    # the workers
+    def listen(self, event_loop, handle_packet):
+        self.event_loop = event_loop
+        self.handle_packet = handle_packet
+        for relay in self.relays:
+            event_loop.add_reader(relay, functools.partial(self.on_relay_readable, relay))
+        self.check_timer = event_loop.call_later(WORKER_CHECK_INTERVAL, self.on_check_timer)
+
+    def on_check_timer(self):
+        self.check_timer = self.event_loop.call_later(WORKER_CHECK_INTERVAL, self.on_check_timer)
+        for worker_index, worker in enumerate(self.workers):
+            if worker.is_alive():
+                continue
+            relay = self.relays[worker_index]
+            self.event_loop.remove_reader(relay)
+            relay.close()
+            self.start_worker(worker_index)
+            self.restarts += 1
+
+    def on_relay_readable(self, relay):
+        for i in range(MAX_PACKETS_PER_BATCH):
+            try:
+                num_bytes = relay.recv_into(self.receive_buffer)
+            except BlockingIOError:
+                return
+            packed_ip, port = RELAYED_ADDRESS.unpack_from(self.receive_buffer, 0)
+            self.handle_packet(self.receive_view[RELAYED_ADDRESS.size:num_bytes], (socket.inet_ntoa(packed_ip), port))
+
+    def stats(self):
+        workers = []
+        for worker_index in range(self.num_workers):
+            offset = worker_index * len(WORKER_COUNTERS)
+            workers.append({name: self.counters[offset + i] for i, name in enumerate(WORKER_COUNTERS)})
+        return {
+            "workers": workers,
+            "restarts": self.restarts,
+            "control_send_dropped": self.control_socket.dropped,
+            "snapshot_publishes": self.snapshot.publishes,
+        }
+
+    def run_worker(self, worker_index, sock, relay, control_pid):
+        # ctrl-c is for the control process, the workers go once it is gone
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # the control process's ends of every relay aren't the worker's business
+        for control_relay in self.relays:
+            if control_relay is not None:
+                control_relay.close()
+        num_counters = len(WORKER_COUNTERS)
+        forward_packets(sock, relay, self.registry, self.snapshot, self.my_addr, self.pack_packet_header,
+                        self.counters[worker_index * num_counters:(worker_index + 1) * num_counters], control_pid)
+
+def reuseport_socket(address):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.setblocking(0)
+    return sock
+
+# a worker's loop, the same routetrace handling as Router.handle_packet with the next hops from the
+# snapshot, plus sending whatever the control process hands it on relay. counts are added to
+# counters in WORKER_COUNTERS order after every batch, so a restarted worker carries on from its
+# predecessor's. a send that fails, on a full socket buffer or an unreachable network, drops the
+# packet like the network would. returns once the control process is gone
+def forward_packets(sock, relay, registry, snapshot, my_addr, pack_packet_header, counters, control_pid):
+    receive_buffer = bytearray(MAX_PACKET_SIZE)
+    receive_view = memoryview(receive_buffer)
+    my_id = registry.ids[my_addr]
+    my_packed_node = registry.packed_nodes[my_id]
+    seed = flow_hash_seed(my_addr)
+    ids_by_packed_node = registry.ids_by_packed_node
+    addresses = registry.addresses
+    num_topology_nodes = registry.num_topology_nodes
+    packed_addresses = {} # { (ip, port): packed address }
+
+    while os.getppid() == control_pid:
+        readable, writable, failed = select.select([sock, relay], [], [], WORKER_IDLE_TIMEOUT)
+        forwarded = answered = relayed = relay_dropped = no_route = send_dropped = 0
+
+        # packets from the control process, sent as they are
+        for i in range(MAX_PACKETS_PER_BATCH):
+            try:
+                num_bytes = relay.recv_into(receive_buffer)
+            except BlockingIOError:
+                break
+            packed_ip, port = RELAYED_ADDRESS.unpack_from(receive_buffer, 0)
+            try:
+                sock.sendto(receive_view[RELAYED_ADDRESS.size:num_bytes], (socket.inet_ntoa(packed_ip), port))
+            except OSError:
+                send_dropped += 1
+
+        for i in range(MAX_PACKETS_PER_BATCH):
+            try:
+                num_bytes, sender_address = sock.recvfrom_into(receive_buffer)
+            except BlockingIOError:
+                break
+            packet = receive_view[:num_bytes]
+            try:
+                packet_type, source_node, sequence_number, time_to_live, dest_node, payload_offset = parse_header(packet)
+            except (ValueError, IndexError, KeyError, struct.error):
+                continue
+
+            if packet_type != ROUTE_TRACE:
+                packed_address = packed_addresses.get(sender_address)
+                if packed_address is None:
+                    packed_address = packed_addresses[sender_address] = pack_address(sender_address)
+                try:
+                    relay.send(packed_address + packet)
+                    relayed += 1
+                except OSError:
+                    relay_dropped += 1
+                continue
+
+            dest_id = ids_by_packed_node.get(dest_node)
+            if time_to_live == 0 or dest_id == my_id:
+                source_id = registry.id_of_packed_node(source_node)
+                try:
+                    sock.sendto(pack_packet_header(ROUTE_TRACE, my_packed_node, sequence_number, time_to_live, dest_node), addresses[source_id])
+                    answered += 1
+                except OSError:
+                    send_dropped += 1
+                continue
+
+            next_hops = None if dest_id is None or dest_id >= num_topology_nodes else snapshot.lookup(dest_id)
+            if next_hops is None:
+                no_route += 1
+                continue
+            # the same pick as shortest_path.select_next_hop
+            if len(next_hops) == 1:
+                next_hop = next_hops[0]
+            else:
+                next_hop = next_hops[flow_hash(source_node, dest_node, seed) % len(next_hops)]
+            try:
+                sock.sendto(decrement_time_to_live(packet), addresses[next_hop])
+                forwarded += 1
+            except OSError:
+                send_dropped += 1
+
+        counters[0] += forwarded
+        counters[1] += answered
+        counters[2] += relayed
+        counters[3] += relay_dropped
+        counters[4] += no_route
+        counters[5] += send_dropped
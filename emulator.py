@@ -1,570 +1,716 @@
 import argparse
-import copy
-from enum import Enum
-import pickle
+import functools
+import signal
 import socket
 import sys
-import struct
 import time
-import json
 
-class Packet_Type(Enum):
-    HELLO_MESSAGE = 'H'
-    LINK_STATE_MESSAGE = 'L'
-    ROUTE_TRACE = 'T'
-    HELLO_ACK = 'A'
+from dataplane import DataPlane
+from liveness import NeighborLiveness, read_link_timers
+from lsdb import LinkStateDatabase
+from metrics import Metrics, SampledProfiler, dump_stats_periodically, event_loop_lag, serve_stats
+from nodes import NodeRegistry
+from packet import HEADER_FORMATS, PacketCache, Packet_Type, decode_lsp_payload, decrement_time_to_live, pack_node, parse_header, send_to_nodes
+from scheduler import EventLoop, SpfThrottle
+from shortest_path import ENGINES, IncrementalSPF, find_loop_free_alternates, find_shortest_path_and_return_forwarding_table, flow_hash, flow_hash_seed
+from table_writer import OUTPUT_MODES, TableWriter
+from topology import LiveTopology, read_topology
+
+# timers, in milliseconds
+HELLO_INTERVAL = 1000
+LSP_INTERVAL = 5000
+NEIGHBOR_DEADLINE = 4000 # a neighbor is down if we haven't heard a hello from it for this long, the dead interval
+LSDB_SWEEP_INTERVAL = 1000
+
+# link costs measured from hello round trip times, in milliseconds
+RTT_SMOOTHING = 0.125 # weight of a new sample in the smoothed rtt, same as tcp's srtt
+RTT_COST_HYSTERESIS = 0.25 # the advertised cost only follows the smoothed rtt once they're 25% apart
+RTT_COST_MIN_CHANGE = 2 # and at least this far apart, so a link doesn't flap between 1 and 2
+TIMESTAMP_MODULUS = 2 ** 32 # timestamps travel in the 4 byte sequence number
+
+# the packet types as the plain values parse_header returns, going through the enum for every
+# packet costs more than the rest of parsing the header
+HELLO_MESSAGE = Packet_Type.HELLO_MESSAGE.value
+HELLO_ACK = Packet_Type.HELLO_ACK.value
+LINK_STATE_MESSAGE = Packet_Type.LINK_STATE_MESSAGE.value
+ROUTE_TRACE = Packet_Type.ROUTE_TRACE.value
+
+MAX_PACKETS_PER_WAKEUP = 64
+MAX_PACKET_SIZE = 65535 # big enough for the LSP of a node with a few thousand neighbors
 
 def parse_command_line_args():
     parser = argparse.ArgumentParser()
 
     parser.add_argument('-p', '--port', help='the port that the emulator listens to for incoming packets', required=True, type=int)
     parser.add_argument('-f', '--filename', help='the name of the topology file', required=True, type=str)
+    parser.add_argument('-e', '--engine', help='the shortest path engine used to build the forwarding table', choices=list(ENGINES), default='heap', type=str)
+    parser.add_argument('-x', '--header_format', help='header format of the packets this emulator sends, both are always accepted', choices=list(HEADER_FORMATS), default='compact', type=str)
+    parser.add_argument('-s', '--spf_initial_delay', help='milliseconds to wait after a topology change before recomputing routes', default=50, type=int)
+    parser.add_argument('-t', '--spf_hold', help='minimum milliseconds between two route recomputes, doubled on every back to back recompute', default=200, type=int)
+    parser.add_argument('-m', '--spf_max_hold', help='upper bound in milliseconds for the hold between route recomputes', default=5000, type=int)
+    parser.add_argument('-r', '--rtt_costs', help='use the measured round trip time to each neighbor as the cost of the link instead of the cost in the topology file', action='store_true')
+    parser.add_argument('-a', '--lsp_max_age', help='milliseconds an origin\'s LSP is kept without being refreshed before the origin is treated as down', default=3 * LSP_INTERVAL, type=int)
+    parser.add_argument('-S', '--stats_socket', help='unix socket path that answers every connection with the emulator\'s counters as json', type=str)
+    parser.add_argument('-D', '--stats_file', help='file the emulator\'s counters are written to as json every --stats_interval', type=str)
+    parser.add_argument('-I', '--stats_interval', help='milliseconds between writes of --stats_file and --profile_file', default=10000, type=int)
+    parser.add_argument('-P', '--profile_every', help='profile one in this many packet parses and route recomputes, 0 turns the profiler off', default=0, type=int)
+    parser.add_argument('-O', '--profile_file', help='file the sampled profile is written to in pstats format', default='emulator.prof', type=str)
+    parser.add_argument('-o', '--output_mode', help='full prints the whole topology and forwarding table on every route change, diff only the entries that changed, json the changes as json lines. kill -USR1 prints everything', choices=list(OUTPUT_MODES), default='full', type=str)
+    parser.add_argument('-i', '--output_interval', help='minimum milliseconds between two writes of the routes, changes in between are merged. defaults to 0 for full and 1000 otherwise', default=None, type=int)
+    parser.add_argument('-H', '--hello_interval', help='milliseconds between two hellos to a neighbor', default=HELLO_INTERVAL, type=int)
+    parser.add_argument('-d', '--dead_interval', help='a neighbor is down after this many milliseconds without a hello from it', default=NEIGHBOR_DEADLINE, type=int)
+    parser.add_argument('-b', '--backup_next_hops', help='precompute a loop-free alternate next hop for every dest, used the moment its next hops are found down until the routes are recomputed', action='store_true')
+    parser.add_argument('-l', '--link_timers', help='file of per link hello and dead intervals that override the two above, see liveness.read_link_timers', type=str)
+    parser.add_argument('-w', '--workers', help='receive worker processes that forward packets on their own SO_REUSEPORT sockets while this process runs hellos, LSPs and SPF, see dataplane.py. 0 does everything in this process', default=0, type=int)
 
     args = parser.parse_args()
     return args
 
-# read topology file and build the network structure in a dict
-# key: node
-# value: list of neighboring nodes
-# all nodes are in string format "ip:port"
-# {
-#   "ip:port": ["ip:port", "ip:port"]
-# }
-def read_topology(filename):
-    try:
-        file = open(filename, 'r')
-    except:
-        print('ERROR: Reading topology file')
-        return
-    
-    network_topology = {}
-    file_lines = file.readlines()
-
-    for line in file_lines:
-        nodes_in_line = line.split()
-        source_hostname = nodes_in_line[0].split(',')[0]
-        source_port = nodes_in_line[0].split(',')[1]
-        source_ip = socket.gethostbyname(source_hostname)
-        source_node = source_ip + ':' + source_port
-        network_topology[source_node] = []
-        for index in range(1, len(nodes_in_line)):
-            node_hostname = nodes_in_line[index].split(',')[0]
-            node_ip = socket.gethostbyname(node_hostname)
-            node_port = nodes_in_line[index].split(',')[1]
-            node = node_ip + ':' + node_port
-            if node not in network_topology[source_node]:
-                network_topology[source_node].append(node)
-
-    return network_topology
-
-path = []
-# prints out source and dest as well as the distance
-def print_solution(start_node, distances, parents, index_to_node_map):
-    paths = []
-    num_nodes = len(distances)
-    #print("         node\t\t\t      Distance\t\t\t Path")
-    
-    start_addr = index_to_node_map[start_node]
-    for node_index in range(num_nodes):
-        if node_index != start_node:
-            dest_addr = index_to_node_map[node_index]
-
-            #print("\n", start_addr, "->", dest_addr, "\t\t", distances[node_index], "\t\t", end="")
-            print_path(node_index, parents, index_to_node_map)
-
-            global path
-            paths.append(path)
-            path = []
-    
-    return paths
-
-NO_PARENT = -1
-# prints shortest path between source and dest node using parents array
-def print_path(current_node, parents, index_to_node_map):
-    if current_node == NO_PARENT:
-        return
-    
-    print_path(parents[current_node], parents, index_to_node_map)
-
-    curr_addr = index_to_node_map[current_node]
-    path.append(curr_addr)
-
-def construct_forwarding_table(all_paths):
-    # { dest: next_hop }
-    forwarding_table = {}
-
-    for path in all_paths:
-        dest = path[len(path) - 1]
-        next_hop = path[1]
-        forwarding_table[dest] = next_hop
-
-    return forwarding_table
-
-def link_state_algorithm(adjacency_matrix, start_node, index_to_node_map):
-    num_nodes = len(adjacency_matrix)
-
-    # min_distance[i] holds the min distance from start node to i
-    min_distance = [sys.maxsize] * num_nodes
-    visited = [False] * num_nodes
- 
-    for node_index in range(num_nodes):
-        min_distance[node_index] = sys.maxsize
-        visited[node_index] = False
-         
-    min_distance[start_node] = 0
- 
-    # parent array to store shortest path
-    parents = [-1] * num_nodes
-    parents[start_node] = NO_PARENT
- 
-    # picking the curr source node
-    for i in range(0, num_nodes - 1):
-        nearest_node = -1 # holds the index of the picked/source node
-        shortest_distance = sys.maxsize
-        for node_index in range(num_nodes):
-            if not visited[node_index] and min_distance[node_index] < shortest_distance:
-                nearest_node = node_index
-                shortest_distance = min_distance[node_index]
- 
-        visited[nearest_node] = True
-
-        # exploring and updating adjacent nodes to picked source node
-        for node_index in range(num_nodes):
-            edge_distance = adjacency_matrix[nearest_node][node_index]
-            # shortest dist refers to the shortest dist to reach the curr node at node_index from the starting node
-            if edge_distance > 0 and shortest_distance + edge_distance < min_distance[node_index]:
-                parents[node_index] = nearest_node
-                min_distance[node_index] = shortest_distance + edge_distance
- 
-    all_paths = print_solution(start_node, min_distance, parents, index_to_node_map)
-    #print('\nALL PATHS:')
-    #print(all_paths)
-
-    forwarding_table = construct_forwarding_table(all_paths)
-    return forwarding_table
-
-def construct_adjacency_matrix(network_topology):
-    # assign each ip:port node a number for the adjacency matrix
-    num_nodes = len(network_topology)
-    index_to_node_map = {}
-    node_to_index_map = {}
-    index = 0
-    for node in network_topology:
-        node_to_index_map[node] = index
-        index_to_node_map[index] = node
-        index += 1
-    
-    adjacency_matrix = [[0 for column in range(num_nodes)]
-                      for row in range(num_nodes)]
-
-    for node in network_topology:
-        node_index = node_to_index_map[node]
-        neighboring_nodes = network_topology[node]
-        for neighbor in neighboring_nodes:
-            neighbor_index = node_to_index_map[neighbor]
-            adjacency_matrix[node_index][neighbor_index] = 1
-            adjacency_matrix[neighbor_index][node_index] = 1
-
-    #print('ADJACENCY MATRIX: ')
-    #print('\n'.join(['\t'.join([str(cell) for cell in row]) for row in adjacency_matrix]))
-    #print('done with constructing adjacency matrix')
-    return adjacency_matrix, index_to_node_map, node_to_index_map
-
-def parse_packet(packet):
-    header = struct.unpack('!cIIIIIIIIIIII', packet[:49])
-    packet_type = header[0].decode('ascii')
-    source_ip = str(header[1]) + '.' + str(header[2]) + '.' + str(header[3]) + '.' + str(header[4])
-    source_port = header[5]
-    sequence_number = header[6]
-    ttl = header[7]
-    dest_ip = str(header[8]) + '.' + str(header[9]) + '.' + str(header[10]) + '.' + str(header[11])
-    dest_port = header[12]
-    data = packet[49:]
-   
-    if packet_type == Packet_Type.LINK_STATE_MESSAGE.value:
-        data = pickle.loads(data)
-    else:
-        data = data.decode()
+# the source and dest come back as node ids of registry, see nodes.py. data is the payload of LSPs
+# as a memoryview, left for the router to decode once it knows the LSP is new, the payload of the
+# other packets isn't used
+def parse_packet(packet, registry):
+    packet_type, source_node, sequence_number, ttl, dest_node, payload_offset = parse_header(packet)
+    ids_by_packed_node = registry.ids_by_packed_node
+    source_id = ids_by_packed_node.get(source_node)
+    if source_id is None:
+        source_id = registry.id_of_packed_node(source_node)
+    dest_id = ids_by_packed_node.get(dest_node)
+    if dest_id is None:
+        dest_id = registry.id_of_packed_node(dest_node)
+
+    data = None
+    if packet_type == LINK_STATE_MESSAGE:
+        data = memoryview(packet)[payload_offset:]
 
     #if packet_type != Packet_Type.HELLO_MESSAGE.value:
     #    print('-----------------------------')
     #    print('INCOMING PACKET:')
     #    print('packet type: ', packet_type)
-    #    print('source ip: ', source_ip, ', source port: ', source_port)
-    #    print('dest ip: ', dest_ip, ', dest port: ', dest_port)
+    #    print('source: ', registry.nodes[source_id])
+    #    print('dest: ', registry.nodes[dest_id])
     #    print('sequence number: ', sequence_number)
     #    print('time to live: ', ttl)
     #    print('data: ', data)
     #    print('-----------------------------')
-        
-    return packet_type, source_ip, source_port, sequence_number, ttl, dest_ip, dest_port, data
-
-def send_routetrace_packet(packet_type, source_ip, source_port, sequence_number, time_to_live, dest_ip, dest_port, data, emulator_ip, emulator_port):
-    #print('--------------------------------------')
-    #print('SENDING ROUTETRACE PACKET back to the original source addr:')
-    #print('packet type: ', packet_type)
-    #print('emulator ip: ', emulator_ip, ', emulator port: ', emulator_port)
-    #print('source ip: ', source_ip, ', source port: ', source_port)
-    #print('dest hostname: ', dest_ip, ', dest port: ', dest_port)
-    # print('sequence number: ', sequence_number) unused field in routetrace packets
-    #print('time to live: ', time_to_live)
-    #print('--------------------------------------')
-
-    emulator_ip_a = int(emulator_ip.split('.')[0])
-    emulator_ip_b = int(emulator_ip.split('.')[1])
-    emulator_ip_c = int(emulator_ip.split('.')[2])
-    emulator_ip_d = int(emulator_ip.split('.')[3])
-    
-    dest_ip_a = int(dest_ip.split('.')[0])
-    dest_ip_b = int(dest_ip.split('.')[1])
-    dest_ip_c = int(dest_ip.split('.')[2])
-    dest_ip_d = int(dest_ip.split('.')[3])
-    
-    header = struct.pack(
-        '!cIIIIIIIIIIII',
-        Packet_Type.ROUTE_TRACE.value.encode('ascii'),
-        emulator_ip_a, emulator_ip_b, emulator_ip_c, emulator_ip_d,
-        emulator_port,
-        0, # placeholder value
-        time_to_live,
-        dest_ip_a, dest_ip_b, dest_ip_c, dest_ip_d, 
-        dest_port
-    )
-    
-    data = ''.encode()
-    packet = header + data
-
-    #print('going to send packet to: ', source_ip, ':', source_port)
-    global sock
-    # send the packet back to where it came from
-    sock.sendto(packet, (source_ip, source_port))
-
-def send_hello_message_to_neighbors(my_addr, neighboring_nodes):
-    #print('SENDING HELLO MESSAGE to my neighbors: ', neighboring_nodes)
-    source_ip = my_addr.split(':')[0]
-    source_ip_a = int(source_ip.split('.')[0])
-    source_ip_b = int(source_ip.split('.')[1])
-    source_ip_c = int(source_ip.split('.')[2])
-    source_ip_d = int(source_ip.split('.')[3])
-    source_port = int(my_addr.split(':')[1])
-
-    for neighbor in neighboring_nodes:
-        #print('sending to neighbor: ', neighbor)
-        dest_ip = neighbor.split(':')[0]
-        dest_port = int(neighbor.split(':')[1])
-
-        header = struct.pack(
-            '!cIIIIIIIIIIII',
-            Packet_Type.HELLO_MESSAGE.value.encode('ascii'),
-            source_ip_a, source_ip_b, source_ip_c, source_ip_d,
-            source_port,
-            # placeholder values
-            0, # seq num
-            0, # ttl
-            0, 0, 0, 0, #dest ip 
-            0 # dest port
-        )
-        data = 'hello'.encode()
-        packet = header + data
-
-        global sock
-        sock.sendto(packet, (dest_ip, dest_port))
-
-def send_link_state_message_to_neighbors(my_addr, neighboring_nodes, sequence_number):
-    #print('SENDING LSM TO NEIGHBORS: ', neighboring_nodes, ', seq number: ', sequence_number)
-    source_ip = my_addr.split(':')[0]
-    source_ip_a = int(source_ip.split('.')[0])
-    source_ip_b = int(source_ip.split('.')[1])
-    source_ip_c = int(source_ip.split('.')[2])
-    source_ip_d = int(source_ip.split('.')[3])
-    source_port = int(my_addr.split(':')[1] )
-    time_to_live = 20
-
-    for neighbor in neighboring_nodes:
-        #print('sending link state message to neighbor: ', neighbor, ', with seq number: ', sequence_number)
-        dest_ip = neighbor.split(':')[0]
-        dest_port = int(neighbor.split(':')[1])
-
-        header = struct.pack('!cIIIIIIIIIIII', 
-        Packet_Type.LINK_STATE_MESSAGE.value.encode('ascii'),
-        source_ip_a, source_ip_b, source_ip_c, source_ip_d,
-        source_port,
-        sequence_number,
-        time_to_live,
-        0, 0, 0 , 0, 0 # placeholder values
+
+    return packet_type, source_id, sequence_number, ttl, dest_id, data
+
+# what the event loop runs on: a clock that never jumps, so setting the system time can't declare
+# every neighbor dead at once or keep a dead one up
+def monotonic_time_in_milliseconds_now():
+    return round(time.monotonic() * 1000)
+
+# one emulated router: its socket, timers, link state database, live topology and forwarding table
+# nothing is global, so any number of routers can share one interpreter and one event loop
+#
+# sock is what packets are sent with, a bound udp socket or anything else with a
+# sendto(packet, (ip, port)) method. listen() reads packets off a real socket, whatever delivers
+# packets some other way hands them to handle_packet as a writable buffer
+# event_loop is a scheduler.EventLoop, or anything with time(), call_at() and call_later() in
+# milliseconds
+# output gets the topology and forwarding table every time the routes change and log the spf
+# counters, either can be None to keep the router quiet. output_mode and output_interval pick what
+# gets written and how often, see table_writer.py
+# with engine=None the router runs hellos, LSPs and flooding but computes no routes, which is what
+# a simulation of thousands of routers needs from all but the few it checks the routes of
+# with lsp_interval=None LSPs are only sent when something changes and never age out, for
+# simulations that start from a network that has already converged
+# metrics counts what the router does, see metrics.py, routers can share one. with a
+# SampledProfiler packet parsing and route recomputes are profiled
+# registry numbers the nodes, see nodes.py, routers of the same topology in one process should
+# share one. packets are handled by node id, "ip:port" strings are only looked up, never built
+# hello_interval and dead_interval are the defaults of every neighbor, link_timers overrides them
+# for single links, see liveness.read_link_timers
+# lsp_sequence_start is the sequence number of the first LSP, see below
+# with backup_next_hops every route recompute also finds a loop-free alternate per dest, see
+# shortest_path.loop_free_alternates, at the cost of a shortest path run from every neighbor
+# with a snapshot, a dataplane.ForwardingSnapshot, the router publishes its next hops there for
+# receive workers to forward with, every time they change
+class Router:
+    def __init__(self, my_addr, original_network_topology, sock, event_loop, engine='heap', header_format='compact',
+                 spf_initial_delay=50, spf_hold=200, spf_max_hold=5000, lsp_interval=LSP_INTERVAL, lsp_max_age=3 * LSP_INTERVAL, rtt_costs=False,
+                 output=sys.stdout, output_mode='full', output_interval=0, log=sys.stderr, metrics=None, profiler=None, registry=None,
+                 hello_interval=HELLO_INTERVAL, dead_interval=NEIGHBOR_DEADLINE, link_timers=None, lsp_sequence_start=None, backup_next_hops=False, snapshot=None):
+        self.my_addr = my_addr
+        self.original_network_topology = original_network_topology
+        self.sock = sock
+        self.event_loop = event_loop
+        self.spf_engine = engine
+        self.measure_rtt = rtt_costs
+        self.lsp_interval = lsp_interval
+        self.pack_packet_header = HEADER_FORMATS[header_format]
+        self.spf_throttle = SpfThrottle(spf_initial_delay, spf_hold, spf_max_hold)
+        self.table_writer = None
+        if output is not None:
+            self.table_writer = TableWriter(output, event_loop, my_addr, output_mode, output_interval)
+        self.log = log
+        self.metrics = Metrics() if metrics is None else metrics
+        self.parse_packet = parse_packet
+        if profiler is not None:
+            self.parse_packet = profiler.wrap(parse_packet)
+            self.recompute_routes = profiler.wrap(self.recompute_routes)
+
+        self.registry = NodeRegistry(original_network_topology) if registry is None else registry
+        self.my_id = self.registry.ids[my_addr]
+        self.flow_hash_seed = flow_hash_seed(my_addr)
+
+        self.packet_cache = PacketCache(self.pack_packet_header, pack_node(my_addr))
+        self.receive_buffer = None
+        self.receive_view = None
+
+        # starts from the wall clock rather than 0 so a restarted emulator's LSPs are newer than the
+        # ones the other emulators still have from before the restart. the event loop's clock doesn't
+        # do for that when it is monotonic, its zero is wherever the machine booted
+        self.lsp_sequence_number = int(event_loop.time() // 1000) if lsp_sequence_start is None else lsp_sequence_start
+
+        # the topology file plus whichever nodes are down, all nodes start out up
+        # the availability bytes are only for building the graph, routers that don't route go without
+        self.network_topology = LiveTopology(original_network_topology, None if engine is None else self.registry)
+
+        # hello deadlines and rtts of our neighbors, see liveness.py
+        self.neighbors = NeighborLiveness()
+        time_now = event_loop.time()
+        for neighbor in original_network_topology[my_addr]:
+            timers = None if link_timers is None else link_timers.get(frozenset((my_addr, neighbor)))
+            if timers is None:
+                self.neighbors.add(neighbor, hello_interval, dead_interval, time_now)
+            else:
+                self.neighbors.add(neighbor, timers[0], timers[1], time_now)
+        # neighbors with the same hello interval share a hello timer
+        self.hello_groups = self.neighbors.hello_groups() # { hello interval: [ip:port] }
+        self.hello_timer_callbacks = {hello_interval: functools.partial(self.on_hello_timer, hello_interval) for hello_interval in self.hello_groups}
+
+        # latest LSP of every origin, see lsdb.py
+        self.lsdb = LinkStateDatabase(lsp_max_age)
+
+        # nodes whose availability and links whose cost changed since the routes were last recomputed
+        self.pending_changed_nodes = set()
+        self.pending_changed_links = set()
+
+        self.incremental_spf = None
+        if engine is None:
+            self.forwarding_table = {}
+        elif engine == 'incremental':
+            self.incremental_spf = IncrementalSPF(my_addr, self.network_topology)
+            self.forwarding_table = self.incremental_spf.forwarding_table
+        else:
+            self.forwarding_table = find_shortest_path_and_return_forwarding_table(my_addr, self.network_topology, engine)
+        # the forwarding table by node id, what packets are forwarded with, see update_next_hop_ids
+        self.next_hop_ids = None
+        self.update_next_hop_ids()
+        # backup_next_hop_ids[dest id] is the neighbor id packets to dest go to when every next hop to
+        # dest is down, None if dest has no loop-free alternate
+        self.compute_backup_next_hops = backup_next_hops and engine is not None
+        self.backup_next_hops = {} # { dest: loop-free alternate next hop }
+        self.backup_next_hop_ids = None
+        self.update_backup_next_hops()
+        # ids of the neighbors found down since the routes were last recomputed, the forwarding
+        # table may still lead through them
+        self.failed_next_hop_ids = set()
+        self.snapshot = snapshot
+        self.publish_snapshot()
+
+        self.neighbor_deadline_timer = None # set for the earliest deadline in self.neighbors
+        self.timers = {} # { callback: latest timer scheduled for it }
+
+    # the router's counters, link state database and spf throttle as a dict ready for json
+    def stats(self):
+        stats = {"router": self.my_addr}
+        stats.update(self.metrics.to_json())
+        stats["lsdb"] = {
+            "origins": len(self.lsdb),
+            "installed": self.lsdb.installed,
+            "duplicates": self.lsdb.duplicates,
+            "stale": self.lsdb.stale,
+            "expired": self.lsdb.expired,
+        }
+        stats["spf_throttle"] = {"runs": self.spf_throttle.runs, "coalesced": self.spf_throttle.coalesced}
+        stats["forwarding_table_entries"] = len(self.forwarding_table)
+        stats["backup_next_hops"] = len(self.backup_next_hops)
+        stats["nodes_down"] = len(self.network_topology.down_nodes)
+        stats["neighbors"] = {
+            "count": len(self.neighbors),
+            "up": sum(1 for neighbor in self.neighbors if self.network_topology.is_available(neighbor)),
+            "hello_intervals": sorted(self.hello_groups),
+        }
+        if self.table_writer is not None:
+            stats["output"] = {"writes": self.table_writer.writes, "bytes_written": self.table_writer.bytes_written}
+        return stats
+
+    # next_hop_ids[dest id] is the tuple of next hop ids to dest, None if it can't be reached
+    # the incremental engine numbers the nodes like the registry, nothing is down when it is created,
+    # and patches its list in place. the other engines build a new forwarding table every time
+    def update_next_hop_ids(self):
+        if self.incremental_spf is not None:
+            self.next_hop_ids = self.incremental_spf.next_hops
+            return
+        ids = self.registry.ids
+        next_hop_ids = [None] * self.registry.num_topology_nodes
+        numbered_hops = {} # { next hops: the same next hops as ids }, dests share their next hops
+        for dest, next_hops in self.forwarding_table.items():
+            hop_ids = numbered_hops.get(next_hops)
+            if hop_ids is None:
+                hop_ids = numbered_hops[next_hops] = tuple([ids[next_hop] for next_hop in next_hops])
+            next_hop_ids[ids[dest]] = hop_ids
+        self.next_hop_ids = next_hop_ids
+
+    def update_backup_next_hops(self):
+        if not self.compute_backup_next_hops:
+            return
+        self.backup_next_hops = find_loop_free_alternates(self.my_addr, self.network_topology)
+        ids = self.registry.ids
+        backup_next_hop_ids = [None] * self.registry.num_topology_nodes
+        for dest, backup in self.backup_next_hops.items():
+            backup_next_hop_ids[ids[dest]] = ids[backup]
+        self.backup_next_hop_ids = backup_next_hop_ids
+
+    # the next hops to dest that aren't known to be down, the loop-free alternate when that leaves
+    # none, None when there is no alternate either
+    def live_next_hops(self, dest_id, next_hops):
+        failed_next_hop_ids = self.failed_next_hop_ids
+        live = tuple([next_hop for next_hop in next_hops if next_hop not in failed_next_hop_ids])
+        if len(live) == len(next_hops):
+            return next_hops
+        if len(live) > 0:
+            return live
+        backup = None if self.backup_next_hop_ids is None else self.backup_next_hop_ids[dest_id]
+        if backup is None or backup in failed_next_hop_ids:
+            return None
+        return (backup,)
+
+    # the next hops receive workers forward with: the forwarding table minus the neighbors found down
+    # since it was computed, so workers go around a failed neighbor as soon as this router does
+    def publish_snapshot(self):
+        if self.snapshot is None:
+            return
+        next_hop_ids = self.next_hop_ids
+        if len(self.failed_next_hop_ids) > 0:
+            next_hop_ids = [None if next_hops is None else self.live_next_hops(dest_id, next_hops) for dest_id, next_hops in enumerate(next_hop_ids)]
+        self.snapshot.publish(next_hop_ids)
+
+    # prints the starting routes and starts sending hellos and LSPs
+    def start(self):
+        if self.table_writer is not None:
+            self.table_writer.routes_changed(self.network_topology, self.forwarding_table)
+        for hello_interval in self.hello_groups:
+            self.on_hello_timer(hello_interval)
+        if self.lsp_interval is not None:
+            self.on_lsp_timer()
+            self.on_lsdb_sweep_timer()
+        self.schedule_neighbor_deadline_timer()
+
+    # stops every timer, the router sends nothing more on its own afterwards
+    def stop(self):
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers = {}
+        self.neighbor_deadline_timer = None
+
+    # has the event loop read packets off sock, which has to be a non-blocking socket
+    def listen(self):
+        self.receive_buffer = bytearray(MAX_PACKET_SIZE)
+        self.receive_view = memoryview(self.receive_buffer)
+        self.event_loop.add_reader(self.sock, self.on_socket_readable)
+
+    # the latest timer of every callback is kept so stop() can cancel it
+    def call_at(self, deadline, callback):
+        timer = self.event_loop.call_at(deadline, callback)
+        self.timers[callback] = timer
+        return timer
+
+    def call_later(self, delay, callback):
+        return self.call_at(self.event_loop.time() + delay, callback)
+
+    # probe_id is the sequence number of the routetrace packet being answered, routetrace matches
+    # replies to the probes it sent with it. source_id and dest_id are node ids
+    def send_routetrace_packet(self, source_id, time_to_live, dest_id, probe_id):
+        #print('--------------------------------------')
+        #print('SENDING ROUTETRACE PACKET back to the original source addr:')
+        #print('emulator: ', my_addr)
+        #print('source: ', self.registry.nodes[source_id])
+        #print('dest: ', self.registry.nodes[dest_id])
+        #print('time to live: ', time_to_live)
+        #print('--------------------------------------')
+
+        header = self.pack_packet_header(
+            ROUTE_TRACE,
+            self.registry.packed_nodes[self.my_id],
+            probe_id,
+            time_to_live,
+            self.registry.packed_nodes[dest_id]
         )
-        
-        data = pickle.dumps(neighboring_nodes)
-        packet = header + data
-       
-        global sock
-        sock.sendto(packet, (dest_ip, dest_port))
-
-# finds the shortest path between all nodes from source to dest
-# and returns an updated forwarding table
-def find_shortest_path_and_return_forwarding_table(my_addr, network_topology):
-    adjacency_matrix, index_to_node_map, node_to_index_map = construct_adjacency_matrix(network_topology)
-    starting_node = node_to_index_map[my_addr] # this should be the emulator's node
-    forwarding_table = link_state_algorithm(adjacency_matrix, starting_node, index_to_node_map)
-    
-    return forwarding_table
-
-def init_available_nodes(network_topology):
-    available_nodes = {}
-    
-    for node in network_topology:
-        available_nodes[node] = True
-
-    return available_nodes
-
-def init_lsp_dict(network_topology):
-    lsp_dict = {}
-
-    for node in network_topology:
-        lsp_dict[node] = None
-
-    return lsp_dict
-
-def init_received_hello_message(list_of_neighbors):
-    received_hello_message = {}
-
-    for node in list_of_neighbors:
-        received_hello_message[node] = {}
-        received_hello_message[node]["time_received"] = None
-        received_hello_message[node]["deadline"] = epoch_time_in_milliseconds_now() + 4000
-
-    return received_hello_message 
-
-def epoch_time_in_milliseconds_now():
-    time_now_in_milliseconds = round(time.time() * 1000)
-    # print("Milliseconds since epoch:", time_now_in_milliseconds)
-    return time_now_in_milliseconds
-
-def decrement_time_to_live(packet_type, source_ip, source_port, sequence_number, time_to_live, dest_ip, dest_port, data):
-    source_ip_a = int(source_ip.split('.')[0])
-    source_ip_b = int(source_ip.split('.')[1])
-    source_ip_c = int(source_ip.split('.')[2])
-    source_ip_d = int(source_ip.split('.')[3])
-
-    dest_ip_a = int(dest_ip.split('.')[0])
-    dest_ip_b = int(dest_ip.split('.')[1])
-    dest_ip_c = int(dest_ip.split('.')[2])
-    dest_ip_d = int(dest_ip.split('.')[3])
-   
-    header = struct.pack(
-        '!cIIIIIIIIIIII',
-        packet_type.encode('ascii'),
-        source_ip_a, source_ip_b, source_ip_c, source_ip_d,
-        source_port,
-        sequence_number,
-        time_to_live - 1,
-        dest_ip_a, dest_ip_b, dest_ip_c, dest_ip_d, 
-        dest_port
-    )
-    data = ''.encode()
-    packet = header + data
-
-    return packet
-
-# key: node
-# value: list of neighboring nodes
-# all nodes are in string format "ip:port"
-# {
-#   "ip:port": ["ip:port", "ip:port"]
-# }
-def update_network_topology(original_network_topology, available_nodes):
-    updated_network_topology = copy.deepcopy(original_network_topology)
-    unavailable_nodes = []
-
-    # remove unavailable node which are keys in the dict
-    for node in available_nodes:
-        if not available_nodes[node] and node in updated_network_topology:
-            updated_network_topology.pop(node)
-            unavailable_nodes.append(node)
-    
-    for node in updated_network_topology:
-        neighbors = updated_network_topology[node]
-        for neighbor in neighbors:
-            if neighbor in unavailable_nodes:
-                neighbors.remove(neighbor)
-
-    return updated_network_topology
-
-def forward_link_state_packet_to_neighbors(packet, neighboring_nodes, original_sender):
+
+        # send the packet back to where it came from, it has no payload
+        self.metrics.packets_sent[ROUTE_TRACE] += 1
+        self.sock.sendto(header, self.registry.addresses[source_id])
+
+    def send_hello_message_to_neighbors(self, neighboring_nodes, timestamp):
+        #print('SENDING HELLO MESSAGE to my neighbors: ', neighboring_nodes)
+        packet = self.packet_cache.hello_packet(timestamp)
+        self.metrics.packets_sent[HELLO_MESSAGE] += len(neighboring_nodes)
+        send_to_nodes(self.sock, packet, neighboring_nodes)
+
+    # echoes the timestamp of a hello back to the neighbor that sent it
+    def send_hello_ack(self, neighbor, timestamp):
+        registry = self.registry
+        neighbor_id = registry.ids[neighbor]
+        header = self.pack_packet_header(HELLO_ACK, registry.packed_nodes[self.my_id], timestamp, 0, registry.packed_nodes[neighbor_id])
+        self.sock.sendto(header, registry.addresses[neighbor_id])
+        self.metrics.packets_sent[HELLO_ACK] += 1
+
+    def send_link_state_message_to_neighbors(self, neighboring_nodes, sequence_number):
+        #print('SENDING LSM TO NEIGHBORS: ', neighboring_nodes, ', seq number: ', sequence_number)
+        time_to_live = 20
+        packet = self.packet_cache.link_state_packet(sequence_number, time_to_live, neighboring_nodes)
+        self.metrics.packets_sent[LINK_STATE_MESSAGE] += len(neighboring_nodes)
+        send_to_nodes(self.sock, packet, neighboring_nodes)
+
     # we are forwarding the LSM as is that we received from a neighbor
-    #print('FORWARDING LSM TO NEIGHBORS: ', neighboring_nodes)
-    
-    for neighbor in neighboring_nodes:
-        if neighbor == original_sender:
-            continue
-        dest_ip = neighbor.split(':')[0]
-        dest_port = int(neighbor.split(':')[1])
-        
-        global sock
-        sock.sendto(packet, (dest_ip, dest_port))
-
-def get_ip_and_port_from_full_addr(full_addr):
-    ip = full_addr.split(':')[0]
-    port = full_addr.split(':')[1]
-    return ip, port
-
-def print_topology_and_forwarding_table(network_topology, forwarding_table):
-    print('Topology:')
-    print()
-    for node in network_topology:
-        ip, port = get_ip_and_port_from_full_addr(node)
-        print(ip, ',', port, sep='', end=" ")
-        for neighbor in network_topology[node]:
-            ip, port = get_ip_and_port_from_full_addr(neighbor)
-            print(ip, ',', port, sep='', end=" ")
-        print()
-   
-    print() 
-    print('Forwarding table:')
-    print()
-    for node in forwarding_table:
-        ip, port = get_ip_and_port_from_full_addr(node)
-        print(ip, ',', port, sep='', end=" ")
-
-        next_hop = forwarding_table[node]
-        ip, port = get_ip_and_port_from_full_addr(next_hop)
-        print(ip, ',', port, sep='')
-    print()
-
-args = parse_command_line_args()
-emulator_port = args.port
-topology_filename = args.filename
-
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-emulator_hostname = socket.gethostname()
-emulator_ip = socket.gethostbyname(emulator_hostname)
-sock.bind((emulator_hostname, emulator_port))
-sock.setblocking(0) # receive packets in a non-blocking way
-
-my_addr = emulator_ip + ':' + str(emulator_port)
-
-original_network_topology = read_topology(topology_filename)
-lsp_sequence_number = 0
-
-# active_neighbors = { ip:port : True/ False }
-# we will init all neighbors to be active initially
-# received_hello_message = { ip:port : False }
-available_nodes = init_available_nodes(original_network_topology)
-
-send_hello_message_timer_deadline = None
-send_lsp_timer_deadline = None
-
-received_hello_message = init_received_hello_message(original_network_topology[my_addr])
-
-#{
-# ip:port : latest_seq_number
-#}
-lsp_dict = init_lsp_dict(original_network_topology[my_addr])
-
-network_topology = copy.deepcopy(original_network_topology)
-forwarding_table = find_shortest_path_and_return_forwarding_table(my_addr, network_topology)
-
-print_topology_and_forwarding_table(original_network_topology, forwarding_table)
-
-while True:
-    try:
-        time_now = epoch_time_in_milliseconds_now()
-
-        # send hello message to neighbors every second
-        if send_hello_message_timer_deadline == None or time_now > send_hello_message_timer_deadline:
-            neighboring_nodes = network_topology[my_addr]
-            send_hello_message_to_neighbors(my_addr, neighboring_nodes)
-            send_hello_message_timer_deadline = time_now + 1000
-
-        if send_lsp_timer_deadline == None or time_now > send_lsp_timer_deadline:
-            neighboring_nodes = network_topology[my_addr]
-            send_link_state_message_to_neighbors(my_addr, neighboring_nodes, lsp_sequence_number)
-            lsp_sequence_number += 1  
-            send_lsp_timer_deadline = time_now + 5000
-             
-        # update neighboring node statuses based on hello message
-        neighbor_node_went_down = False
-        for node in received_hello_message:
-            if time_now > received_hello_message[node]["deadline"] and available_nodes[node]:
-                neighbor_node_went_down = True
-                available_nodes[node] = False
-                received_hello_message[node]["deadline"] = time_now + 4000 
- 
-        if neighbor_node_went_down:
-            network_topology = update_network_topology(original_network_topology, available_nodes)
-            forwarding_table = find_shortest_path_and_return_forwarding_table(my_addr, network_topology)
-            neighboring_nodes = network_topology[my_addr]
-            
-            print_topology_and_forwarding_table(network_topology, forwarding_table) 
-            
-            send_link_state_message_to_neighbors(my_addr, neighboring_nodes, lsp_sequence_number)
-            lsp_sequence_number += 1
-        
-        packet, sender_address = sock.recvfrom(8192) # Buffer size is 8192. Change as needed
-        sender_full_address = str(sender_address[0]) + ':' + str(sender_address[1])
-
-        if packet:
-            packet_type, source_ip, source_port, sequence_number, time_to_live, dest_ip, dest_port, data = parse_packet(packet)
-               
-            if packet_type == Packet_Type.HELLO_MESSAGE.value:
-                
-                # change in status of machine so we do an update
-                if not available_nodes[sender_full_address]:
-                    available_nodes[sender_full_address] = True
-                    
-                    network_topology = update_network_topology(original_network_topology, available_nodes)
-                    forwarding_table = find_shortest_path_and_return_forwarding_table(my_addr, network_topology)
-              
-                    print_topology_and_forwarding_table(network_topology, forwarding_table)
-                    
-                    neighboring_nodes = network_topology[my_addr]
-                    send_link_state_message_to_neighbors(my_addr, neighboring_nodes, lsp_sequence_number)
-                    lsp_sequence_number += 1 
-
-                received_hello_message[sender_full_address]["deadline"] = time_now + 4000
-
-        if packet_type == Packet_Type.LINK_STATE_MESSAGE.value:
-            curr_node = source_ip + ':' + str(source_port)
-            curr_seq_number_for_this_source = lsp_dict[curr_node]
-
-            if time_to_live == 0:
-                lsp_dict[curr_node] = None
-
-            if curr_seq_number_for_this_source == None or sequence_number > curr_seq_number_for_this_source:
-                lsp_dict[curr_node] = curr_seq_number_for_this_source
-                senders_available_neighboring_nodes = data
-                original_senders_available_nodes = original_network_topology[curr_node]
-
-                nodes_that_went_down = [node for node in original_senders_available_nodes if node not in senders_available_neighboring_nodes]
-                for node in nodes_that_went_down:
-                    available_nodes[node] = False
-
-                nodes_that_came_alive = [node for node in senders_available_neighboring_nodes if not available_nodes[node]] 
-                for node in nodes_that_came_alive:
-                    available_nodes[node] = True
-
-                if len(nodes_that_went_down) > 0 or len(nodes_that_came_alive) > 0:
-                    network_topology = update_network_topology(original_network_topology, available_nodes)
-                    forwarding_table = find_shortest_path_and_return_forwarding_table(my_addr, network_topology)
-
-                    print_topology_and_forwarding_table(network_topology, forwarding_table)
-    
-                neighboring_nodes = original_network_topology[my_addr]
-                packet = decrement_time_to_live(packet_type, source_ip, source_port, sequence_number, time_to_live, dest_ip, dest_port, data)
-                original_sender = source_ip + ':' + str(source_port)
-                forward_link_state_packet_to_neighbors(packet, neighboring_nodes, original_sender)
-
-        if packet_type == Packet_Type.ROUTE_TRACE.value:
-            if time_to_live == 0:
-                send_routetrace_packet(packet_type, source_ip, source_port, sequence_number, time_to_live, dest_ip, dest_port, data, emulator_ip, emulator_port)
+    # it goes to every neighbor except the one we got it from and the node that originated it, they
+    # already have it
+    def forward_link_state_packet_to_neighbors(self, packet, neighboring_nodes, received_from, original_sender):
+        #print('FORWARDING LSM TO NEIGHBORS: ', neighboring_nodes)
+        forward_to = [neighbor for neighbor in neighboring_nodes if neighbor != received_from and neighbor != original_sender]
+        self.metrics.lsps_forwarded += 1
+        self.metrics.packets_sent[LINK_STATE_MESSAGE] += len(forward_to)
+        send_to_nodes(self.sock, packet, forward_to)
+
+    # returns the forwarding table after the nodes in changed_nodes went up or down and the links in
+    # changed_links changed cost
+    # with the incremental engine only the forwarding table entries that changed get patched
+    def recompute_routes(self, changed_nodes, changed_links):
+        if self.spf_engine is None:
+            return self.forwarding_table
+        if self.incremental_spf is None:
+            return find_shortest_path_and_return_forwarding_table(self.my_addr, self.network_topology, self.spf_engine)
+
+        for node in changed_nodes:
+            self.incremental_spf.set_node_available(node, self.network_topology.is_available(node))
+        for node_a, node_b in changed_links:
+            self.incremental_spf.set_link_cost(node_a, node_b, self.network_topology.link_cost(node_a, node_b))
+        return self.incremental_spf.forwarding_table
+
+    def get_available_neighbors(self, node):
+        return list(self.network_topology[node])
+
+    # { neighbor: cost } for our available neighbors, with the cost we advertise for each link
+    def get_own_link_costs(self):
+        return {neighbor: self.network_topology.directed_link_cost(self.my_addr, neighbor) for neighbor in self.network_topology[self.my_addr]}
+
+    # nodes in changed_nodes went up or down and links in changed_links changed cost, the routes get
+    # recomputed once the spf throttle is due
+    def schedule_recompute(self, changed_nodes, time_now, changed_links=()):
+        self.pending_changed_nodes.update(changed_nodes)
+        self.pending_changed_links.update(changed_links)
+        recompute_already_pending = self.spf_throttle.deadline is not None
+        self.spf_throttle.request(time_now)
+        if not recompute_already_pending:
+            self.call_at(self.spf_throttle.deadline, self.on_spf_timer)
+
+    def send_own_link_state_message(self, neighboring_nodes):
+        self.send_link_state_message_to_neighbors(neighboring_nodes, self.lsp_sequence_number)
+        self.lsp_sequence_number += 1
+
+    # origins we haven't had an LSP from within lsp_max_age are gone, our own neighbors are left to
+    # the hello deadline
+    def on_lsdb_sweep_timer(self):
+        self.call_later(LSDB_SWEEP_INTERVAL, self.on_lsdb_sweep_timer)
+        time_now = self.event_loop.time()
+        nodes_that_went_down = []
+        for node in map(self.registry.nodes.__getitem__, self.lsdb.sweep(time_now)):
+            if node in self.network_topology and node not in self.neighbors:
+                self.network_topology.set_node_available(node, False)
+                nodes_that_went_down.append(node)
+
+        if len(nodes_that_went_down) > 0:
+            self.schedule_recompute(nodes_that_went_down, time_now)
+
+    # send hello message to the neighbors with this hello interval
+    def on_hello_timer(self, hello_interval):
+        self.call_later(hello_interval, self.hello_timer_callbacks[hello_interval])
+        if len(self.hello_groups) == 1:
+            neighboring_nodes = self.get_available_neighbors(self.my_addr)
+        else:
+            neighboring_nodes = [neighbor for neighbor in self.hello_groups[hello_interval] if self.network_topology.link_is_up(self.my_addr, neighbor)]
+        timestamp = self.event_loop.time() % TIMESTAMP_MODULUS if self.measure_rtt else 0
+        self.send_hello_message_to_neighbors(neighboring_nodes, timestamp)
+
+    def on_lsp_timer(self):
+        self.call_later(self.lsp_interval, self.on_lsp_timer)
+        self.send_own_link_state_message(self.get_own_link_costs())
+
+    # a neighbor echoed one of our hello timestamps back
+    # the rtt is smoothed and the link cost only follows it once it moved far enough, so routes
+    # don't flap on jitter
+    def update_rtt_cost(self, neighbor, timestamp, time_now):
+        rtt = (time_now - timestamp) % TIMESTAMP_MODULUS
+        hello = self.neighbors[neighbor]
+        if hello.smoothed_rtt is None:
+            hello.smoothed_rtt = rtt
+        else:
+            hello.smoothed_rtt += RTT_SMOOTHING * (rtt - hello.smoothed_rtt)
+
+        cost = max(1, round(hello.smoothed_rtt))
+        current_cost = self.network_topology.directed_link_cost(self.my_addr, neighbor)
+        if abs(cost - current_cost) < max(RTT_COST_MIN_CHANGE, RTT_COST_HYSTERESIS * current_cost):
+            return
+
+        if self.network_topology.set_link_cost(self.my_addr, neighbor, cost):
+            self.schedule_recompute([], time_now, [(self.my_addr, neighbor)])
+        self.send_own_link_state_message(self.get_own_link_costs())
+
+    # wakes up just after the earliest deadline in the heap, unless the timer already wakes up
+    # before that. the deadline may have moved since, then the timer finds nothing due and goes back
+    # to sleep until the next one
+    def schedule_neighbor_deadline_timer(self):
+        deadline = self.neighbors.next_deadline()
+        if deadline is None:
+            return
+        timer = self.neighbor_deadline_timer
+        if timer is not None:
+            if timer.deadline <= deadline + 1:
+                return
+            timer.cancel()
+        self.neighbor_deadline_timer = self.call_at(deadline + 1, self.on_neighbor_deadline_timer)
+
+    # neighbors we haven't had a hello from within their dead interval are down, only the ones whose
+    # deadline is due are looked at
+    def on_neighbor_deadline_timer(self):
+        self.neighbor_deadline_timer = None
+        time_now = self.event_loop.time()
+        neighbor_nodes_that_went_down = []
+        for node in self.neighbors.expire(time_now):
+            if self.network_topology.is_available(node):
+                neighbor_nodes_that_went_down.append(node)
+                self.network_topology.set_node_available(node, False)
+                self.failed_next_hop_ids.add(self.registry.ids[node])
+        self.schedule_neighbor_deadline_timer()
+
+        if len(neighbor_nodes_that_went_down) > 0:
+            self.publish_snapshot()
+            self.schedule_recompute(neighbor_nodes_that_went_down, time_now)
+            self.send_own_link_state_message(self.get_own_link_costs())
+
+    # every change since the last recompute is handled in one go
+    def on_spf_timer(self):
+        changed_nodes = list(self.pending_changed_nodes)
+        changed_links = list(self.pending_changed_links)
+        self.pending_changed_nodes.clear()
+        self.pending_changed_links.clear()
+        self.spf_throttle.ran(self.event_loop.time())
+        start = time.perf_counter()
+        self.forwarding_table = self.recompute_routes(changed_nodes, changed_links)
+        self.update_next_hop_ids()
+        self.update_backup_next_hops()
+        self.metrics.record_spf_run(time.perf_counter() - start)
+        # the new routes go around every neighbor that is down
+        self.failed_next_hop_ids.clear()
+        self.publish_snapshot()
+
+        if self.table_writer is not None:
+            self.table_writer.routes_changed(self.network_topology, self.forwarding_table)
+        if self.log is not None:
+            print('spf runs:', self.spf_throttle.runs, ', changes coalesced:', self.spf_throttle.coalesced, file=self.log)
+
+    # drains the socket, a bounded number of packets at a time so timers don't starve under load
+    # packets are received into one reusable buffer and handed on as a memoryview of it, so a
+    # forwarded packet goes back out without ever being copied
+    def on_socket_readable(self):
+        for i in range(MAX_PACKETS_PER_WAKEUP):
+            try:
+                num_bytes, sender_address = self.sock.recvfrom_into(self.receive_buffer)
+            except BlockingIOError:
+                return
+
+            self.handle_packet(self.receive_view[:num_bytes], sender_address)
+
+    # packet is a bytearray or a writable memoryview, packets that are forwarded are changed in place
+    # sender_address is the (ip, port) it came from
+    def handle_packet(self, packet, sender_address):
+        time_now = self.event_loop.time()
+        registry = self.registry
+        packet_type, source_id, sequence_number, time_to_live, dest_id, data = self.parse_packet(packet, registry)
+        sender_id = registry.ids_by_address.get(sender_address)
+        sender_full_address = None if sender_id is None else registry.nodes[sender_id]
+        network_topology = self.network_topology
+        metrics = self.metrics
+        metrics.packets_received[packet_type] += 1
+
+        if packet_type == HELLO_MESSAGE:
+            if sender_full_address not in self.neighbors:
+                metrics.packets_dropped["hello_from_non_neighbor"] += 1
+                return
+
+            if self.neighbors.heard_from(sender_full_address, time_now):
+                self.schedule_neighbor_deadline_timer()
+
+            # change in status of machine so we do an update
+            if not network_topology.is_available(sender_full_address):
+                network_topology.set_node_available(sender_full_address, True)
+                self.failed_next_hop_ids.discard(sender_id)
+                self.publish_snapshot()
+                self.schedule_recompute([sender_full_address], time_now)
+                self.send_own_link_state_message(self.get_own_link_costs())
+
+            if sequence_number != 0:
+                self.send_hello_ack(sender_full_address, sequence_number)
+
+        if packet_type == HELLO_ACK and sender_full_address in self.neighbors:
+            self.update_rtt_cost(sender_full_address, sequence_number, time_now)
+
+        if packet_type == LINK_STATE_MESSAGE:
+            curr_node = registry.nodes[source_id]
+            original_network_topology = self.original_network_topology
+
+            # our own LSP coming back around, or one we already have, or an older one that got
+            # overtaken: nothing to recompute and nothing to flood
+            if source_id == self.my_id:
+                metrics.packets_dropped["own_lsp"] += 1
+                return
+            if not registry.in_topology(source_id):
+                metrics.packets_dropped["lsp_from_unknown_origin"] += 1
+                return
+            if not self.lsdb.install(source_id, sequence_number, time_now):
+                metrics.packets_dropped["lsp_not_newer"] += 1
+                return
+
+            # decoded only now that the LSP is known to be new, the copies flooding brings in again
+            # never are. nodes the registry doesn't know aren't in the topology and change nothing
+            ids_by_packed_node = registry.ids_by_packed_node
+            senders_available_neighboring_nodes = {}
+            for packed_node, cost in decode_lsp_payload(data, registry.packed_nodes[source_id], sequence_number).items():
+                node_id = ids_by_packed_node.get(packed_node)
+                if node_id is not None:
+                    senders_available_neighboring_nodes[registry.nodes[node_id]] = cost
+            original_senders_available_nodes = original_network_topology[curr_node]
+
+            nodes_that_went_down = [node for node in original_senders_available_nodes if node not in senders_available_neighboring_nodes and network_topology.is_available(node)]
+            for node in nodes_that_went_down:
+                network_topology.set_node_available(node, False)
+
+            # the origin itself is alive too, it may have been aged out before
+            nodes_that_came_alive = [node for node in senders_available_neighboring_nodes if node in original_network_topology and not network_topology.is_available(node)]
+            if not network_topology.is_available(curr_node) and curr_node not in nodes_that_came_alive:
+                nodes_that_came_alive.append(curr_node)
+            for node in nodes_that_came_alive:
+                network_topology.set_node_available(node, True)
+                # a neighbor the origin brought back up has a dead interval to send us a hello
+                if node in self.neighbors and self.neighbors.watch(node, time_now):
+                    self.schedule_neighbor_deadline_timer()
+
+            # the costs the origin advertises for its links, only links that are in the topology count
+            links_that_changed_cost = []
+            for node, cost in senders_available_neighboring_nodes.items():
+                if (node in original_senders_available_nodes or network_topology.link_cost(curr_node, node) is not None) and network_topology.set_link_cost(curr_node, node, cost):
+                    links_that_changed_cost.append((curr_node, node))
+
+            if len(nodes_that_went_down) > 0 or len(nodes_that_came_alive) > 0 or len(links_that_changed_cost) > 0:
+                self.schedule_recompute(nodes_that_went_down + nodes_that_came_alive, time_now, links_that_changed_cost)
+
+            if time_to_live > 0:
+                neighboring_nodes = self.get_available_neighbors(self.my_addr)
+                self.forward_link_state_packet_to_neighbors(decrement_time_to_live(packet), neighboring_nodes, sender_full_address, curr_node)
+            else:
+                metrics.packets_dropped["lsp_time_to_live_expired"] += 1
+
+        if packet_type == ROUTE_TRACE:
+            # probes sent with more hops than the path has are answered by the dest, so routetrace
+            # can send all of them at once without knowing how long the path is
+            if time_to_live == 0 or dest_id == self.my_id:
+                self.send_routetrace_packet(source_id, time_to_live, dest_id, sequence_number)
             else:
-                packet = decrement_time_to_live(packet_type, source_ip, source_port, sequence_number, time_to_live, dest_ip, dest_port, data)
-                dest_addr = dest_ip + ':' + str(dest_port)
-                next_hop = forwarding_table[dest_addr]
-                next_hop_ip = next_hop.split(':')[0]
-                next_hop_port = int(next_hop.split(':')[1])
-                
-                sock.sendto(packet, (next_hop_ip, next_hop_port))
-
-    except:
-        pass
+                next_hops = self.next_hop_ids[dest_id] if registry.in_topology(dest_id) else None
+                if next_hops is None:
+                    metrics.packets_dropped["no_route"] += 1
+                    return
+                # a neighbor found down is skipped right away instead of once the routes are
+                # recomputed, see live_next_hops
+                if len(self.failed_next_hop_ids) > 0:
+                    live_next_hops = self.live_next_hops(dest_id, next_hops)
+                    if live_next_hops is None:
+                        metrics.packets_dropped["next_hop_down"] += 1
+                        return
+                    if live_next_hops[0] not in next_hops:
+                        metrics.backup_forwards += 1
+                    next_hops = live_next_hops
+                # the same pick as shortest_path.select_next_hop
+                if len(next_hops) == 1:
+                    next_hop = next_hops[0]
+                else:
+                    next_hop = next_hops[flow_hash(registry.packed_nodes[source_id], registry.packed_nodes[dest_id], self.flow_hash_seed) % len(next_hops)]
+                metrics.packets_sent[ROUTE_TRACE] += 1
+                self.sock.sendto(decrement_time_to_live(packet), registry.addresses[next_hop])
+
+def main():
+    args = parse_command_line_args()
+
+    emulator_hostname = socket.gethostname()
+    emulator_ip = socket.gethostbyname(emulator_hostname)
+    my_addr = emulator_ip + ':' + str(args.port)
+    original_network_topology = read_topology(args.filename)
+    link_timers = None if args.link_timers is None else read_link_timers(args.link_timers)
+    registry = NodeRegistry(original_network_topology)
+
+    # with workers the packets come in on their sockets and this process only sees hellos and LSPs
+    dataplane = None
+    if args.workers > 0:
+        dataplane = DataPlane(my_addr, (emulator_hostname, args.port), registry, args.workers, args.header_format)
+        sock = dataplane.control_socket
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((emulator_hostname, args.port))
+        sock.setblocking(0) # receive packets in a non-blocking way
+
+    # a bad packet or a failed recompute never takes the emulator down, it is counted by exception
+    # class in the stats
+    metrics = Metrics()
+    event_loop = EventLoop(monotonic_time_in_milliseconds_now, metrics.record_exception)
+    profiler = SampledProfiler(args.profile_every) if args.profile_every > 0 else None
+    output_interval = args.output_interval
+    if output_interval is None:
+        output_interval = 0 if args.output_mode == 'full' else 1000
+    router = Router(my_addr, original_network_topology, sock, event_loop,
+                    engine=args.engine,
+                    header_format=args.header_format,
+                    spf_initial_delay=args.spf_initial_delay,
+                    spf_hold=args.spf_hold,
+                    spf_max_hold=args.spf_max_hold,
+                    lsp_max_age=args.lsp_max_age,
+                    rtt_costs=args.rtt_costs,
+                    output_mode=args.output_mode,
+                    output_interval=output_interval,
+                    metrics=metrics,
+                    profiler=profiler,
+                    registry=registry,
+                    hello_interval=args.hello_interval,
+                    dead_interval=args.dead_interval,
+                    link_timers=link_timers,
+                    lsp_sequence_start=int(time.time()),
+                    backup_next_hops=args.backup_next_hops,
+                    snapshot=None if dataplane is None else dataplane.snapshot)
+    if dataplane is None:
+        router.listen()
+    else:
+        dataplane.start()
+        dataplane.listen(event_loop, router.handle_packet)
+    router.start()
+    event_loop.add_signal_handler(signal.SIGUSR1, router.table_writer.write_full)
+
+    def get_stats():
+        stats = router.stats()
+        stats["event_loop"] = event_loop_lag(event_loop)
+        if dataplane is not None:
+            stats["dataplane"] = dataplane.stats()
+        return stats
+
+    if args.stats_socket is not None:
+        serve_stats(event_loop, args.stats_socket, get_stats)
+    if args.stats_file is not None:
+        dump_stats_periodically(event_loop, args.stats_file, args.stats_interval, get_stats)
+    if profiler is not None:
+        profiler.dump_periodically(event_loop, args.profile_file, args.stats_interval)
+    event_loop.run_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import argparse
+import collections
+import functools
+import multiprocessing
+import os
+import resource
+import signal
+import socket
+import sys
+import time
+
+from emulator import Router, monotonic_time_in_milliseconds_now
+from liveness import read_link_timers
+from metrics import Metrics, dump_stats_periodically, event_loop_lag, serve_stats
+from nodes import NodeRegistry
+from packet import HEADER_FORMATS, socket_addresses
+from scheduler import EventLoop
+from shortest_path import ENGINES
+from topology import read_topology
+
+MAX_LOCAL_PACKETS_PER_WAKEUP = 256
+
+# a router's socket in host mode: packets to a router in the same worker are put on the worker's
+# in-memory queue and never touch the kernel, everything else goes out on the router's udp socket
+# reading works as on the plain socket, the event loop selects on it through fileno()
+class HostSocket:
+    def __init__(self, worker, node, sock):
+        self.worker = worker
+        self.address = socket_addresses[node]
+        self.sock = sock
+
+    def sendto(self, packet, address):
+        router = self.worker.routers.get(address)
+        if router is None:
+            self.worker.udp_packets_sent += 1
+            self.sock.sendto(packet, address)
+        else:
+            self.worker.queue_local_packet(router, packet, self.address)
+
+    def recvfrom_into(self, buffer):
+        result = self.sock.recvfrom_into(buffer)
+        self.worker.udp_packets_received += 1
+        return result
+
+    def fileno(self):
+        return self.sock.fileno()
+
+# the routers of one shard, all on one event loop
+class HostWorker:
+    def __init__(self, worker_index, event_loop, original_network_topology, metrics=None):
+        self.worker_index = worker_index
+        self.event_loop = event_loop
+        # what the event loop counts for the worker as a whole, the exceptions of every router's
+        # callbacks among them. each router keeps its own packet counters
+        self.metrics = Metrics() if metrics is None else metrics
+        self.registry = NodeRegistry(original_network_topology) # shared by the worker's routers
+        self.routers = {} # { (ip, port): router }
+        self.local_packets = collections.deque() # (router, packet, sender address)
+        self.local_timer = None
+
+        self.local_packets_delivered = 0
+        self.udp_packets_sent = 0
+        self.udp_packets_received = 0
+
+    def add_router(self, node, original_network_topology, options, link_timers=None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(socket_addresses[node])
+        sock.setblocking(0)
+        output = sys.stdout if options.verbose else None
+        router = Router(node, original_network_topology, HostSocket(self, node, sock), self.event_loop,
+                        engine=options.engine, header_format=options.header_format, rtt_costs=options.rtt_costs,
+                        output=output, log=None, registry=self.registry, link_timers=link_timers, lsp_sequence_start=int(time.time()))
+        self.routers[socket_addresses[node]] = router
+        return router
+
+    # the sender may reuse its buffer right away, forwarded packets are changed in place, so the
+    # queue keeps a copy
+    def queue_local_packet(self, router, packet, sender_address):
+        self.local_packets.append((router, bytearray(packet), sender_address))
+        if self.local_timer is None:
+            self.local_timer = self.event_loop.call_later(0, self.deliver_local_packets)
+
+    # a bounded number of packets at a time so timers and sockets get their turn
+    def deliver_local_packets(self):
+        self.local_timer = None
+        for i in range(min(len(self.local_packets), MAX_LOCAL_PACKETS_PER_WAKEUP)):
+            router, packet, sender_address = self.local_packets.popleft()
+            self.local_packets_delivered += 1
+            self.event_loop.run_callback(functools.partial(router.handle_packet, packet, sender_address))
+        if len(self.local_packets) > 0:
+            self.local_timer = self.event_loop.call_later(0, self.deliver_local_packets)
+
+    def packets_handled(self):
+        return self.local_packets_delivered + self.udp_packets_received
+
+    # the worker's counters and every router's stats as a dict ready for json
+    def stats(self):
+        return {
+            "worker": self.worker_index,
+            "exceptions": dict(self.metrics.exceptions),
+            "local_packets_delivered": self.local_packets_delivered,
+            "udp_packets_sent": self.udp_packets_sent,
+            "udp_packets_received": self.udp_packets_received,
+            "event_loop": event_loop_lag(self.event_loop),
+            "routers": [router.stats() for router in self.routers.values()],
+        }
+
+# groups nodes that are close in the topology into the same shard, so most packets between routers
+# stay inside a worker. nodes are taken in breadth first order and cut into num_shards runs
+def shard_nodes(network_topology, nodes, num_shards):
+    local_nodes = set(nodes)
+    order = []
+    visited = set()
+    for start_node in nodes:
+        if start_node in visited:
+            continue
+        visited.add(start_node)
+        queue = collections.deque([start_node])
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for neighbor in network_topology[node]:
+                if neighbor in local_nodes and neighbor not in visited:
+                    visited.add(neighbor)
+                    queue.append(neighbor)
+
+    shard_size = -(-len(order) // num_shards)
+    return [order[start:start + shard_size] for start in range(0, len(order), shard_size)]
+
+def max_rss_in_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# the stats socket or file of one worker: the path itself with a single worker, the path with the
+# worker index appended with several
+def worker_stats_path(path, worker_index, num_workers):
+    return path if num_workers == 1 else path + '.' + str(worker_index)
+
+# runs the routers of one shard until the process is killed, printing the worker's packet
+# throughput per cpu second and memory per router every report_interval seconds
+def run_worker(worker_index, nodes, original_network_topology, options, link_timers=None, num_workers=1):
+    # a bad packet or a failed recompute never takes the worker down, it is counted by exception
+    # class in the stats
+    metrics = Metrics()
+    event_loop = EventLoop(monotonic_time_in_milliseconds_now, metrics.record_exception)
+    worker = HostWorker(worker_index, event_loop, original_network_topology, metrics)
+
+    rss_before_routers = max_rss_in_bytes()
+    for node in nodes:
+        router = worker.add_router(node, original_network_topology, options, link_timers)
+        router.listen()
+        router.start()
+    bytes_per_router = (max_rss_in_bytes() - rss_before_routers) / max(1, len(nodes))
+
+    last_report = [time.process_time(), worker.packets_handled()]
+
+    def report():
+        event_loop.call_later(options.report_interval * 1000, report)
+        cpu_time = time.process_time()
+        packets = worker.packets_handled()
+        packets_per_cpu_second = (packets - last_report[1]) / max(cpu_time - last_report[0], 1e-6)
+        last_report[0] = cpu_time
+        last_report[1] = packets
+        print('worker', worker_index, ':', len(nodes), 'routers,', '%.0f' % packets_per_cpu_second, 'packets per cpu second,',
+              'local', worker.local_packets_delivered, ', udp in', worker.udp_packets_received, ', udp out', worker.udp_packets_sent, ',',
+              'exceptions', sum(metrics.exceptions.values()), ',',
+              '%.1f' % (bytes_per_router / 1024), 'KiB per router,', '%.1f' % (max_rss_in_bytes() / 2 ** 20), 'MiB total', file=sys.stderr)
+
+    event_loop.call_later(options.report_interval * 1000, report)
+    if options.stats_socket is not None:
+        serve_stats(event_loop, worker_stats_path(options.stats_socket, worker_index, num_workers), worker.stats)
+    if options.stats_file is not None:
+        dump_stats_periodically(event_loop, worker_stats_path(options.stats_file, worker_index, num_workers), options.stats_interval, worker.stats)
+    event_loop.run_forever()
+
+# the ips this machine's hostname resolves to
+def local_ips(hostname):
+    return set(socket.gethostbyname_ex(hostname)[2])
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-f', '--filename', help='the name of the topology file', required=True, type=str)
+    parser.add_argument('-H', '--hostname', help='run the routers of this host instead of the local machine', default=socket.gethostname(), type=str)
+    parser.add_argument('-j', '--processes', help='number of worker processes, defaults to one per core', default=None, type=int)
+    parser.add_argument('-e', '--engine', help='the shortest path engine used to build the forwarding tables', choices=list(ENGINES), default='heap', type=str)
+    parser.add_argument('-x', '--header_format', help='header format of the packets the routers send, both are always accepted', choices=list(HEADER_FORMATS), default='compact', type=str)
+    parser.add_argument('-r', '--rtt_costs', help='use the measured round trip time to each neighbor as the cost of the link', action='store_true')
+    parser.add_argument('-i', '--report_interval', help='seconds between throughput and memory reports on stderr', default=10, type=float)
+    parser.add_argument('-l', '--link_timers', help='file of per link hello and dead intervals, see liveness.read_link_timers', type=str)
+    parser.add_argument('-S', '--stats_socket', help='unix socket path that answers every connection with the worker\'s and its routers\' counters as json, with several workers each gets the path with .<worker index> appended', type=str)
+    parser.add_argument('-D', '--stats_file', help='file the worker\'s and its routers\' counters are written to as json every --stats_interval, named like --stats_socket', type=str)
+    parser.add_argument('-I', '--stats_interval', help='milliseconds between writes of --stats_file', default=10000, type=int)
+    parser.add_argument('-v', '--verbose', help='print every router\'s topology and forwarding table when its routes change', action='store_true')
+
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_command_line_args()
+    original_network_topology = read_topology(args.filename)
+    link_timers = None if args.link_timers is None else read_link_timers(args.link_timers)
+    ips = local_ips(args.hostname)
+    nodes = [node for node in original_network_topology if node.split(':')[0] in ips]
+    if len(nodes) == 0:
+        print('no routers in', args.filename, 'for', args.hostname, file=sys.stderr)
+        return
+
+    processes = args.processes or os.cpu_count() or 1
+    shards = shard_nodes(original_network_topology, nodes, processes)
+    print('running', len(nodes), 'routers in', len(shards), 'worker processes', file=sys.stderr)
+    if len(shards) == 1:
+        run_worker(0, shards[0], original_network_topology, args, link_timers)
+        return
+
+    workers = [multiprocessing.Process(target=run_worker, args=(worker_index, shard, original_network_topology, args, link_timers, len(shards)))
+               for worker_index, shard in enumerate(shards)]
+    # a kill of the host takes the workers down with it
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import heapq
+import socket
+
+from topology import RESOLVE_TIMEOUT, RESOLVE_WORKERS, resolve_hostnames
+
+# what a router keeps about one neighbor, times in milliseconds
+# deadline is when the neighbor is down unless a hello comes in first, watched is whether it has an
+# entry in the deadline heap
+class Neighbor:
+    __slots__ = ('node', 'hello_interval', 'dead_interval', 'deadline', 'smoothed_rtt', 'watched')
+
+    def __init__(self, node, hello_interval, dead_interval):
+        self.node = node
+        self.hello_interval = hello_interval
+        self.dead_interval = dead_interval
+        self.deadline = None
+        self.smoothed_rtt = None
+        self.watched = False
+
+# the hello deadlines of a router's neighbors, on a monotonic clock
+# a hello only moves its neighbor's deadline, the heap isn't touched. the heap has one entry per
+# watched neighbor, with the deadline the neighbor had when it was pushed; when an entry comes due
+# and the neighbor was heard from since, it goes back in with the new deadline, otherwise the
+# neighbor expired. so a timer that fires only ever looks at entries that are due, never at every
+# neighbor, and a fast neighbor with a 150 ms dead interval costs the others nothing
+# entries of neighbors that were heard from since they were pushed are moved along up to horizon
+# milliseconds early, so the entries coming due one after the other don't each wake the timer up.
+# half the shortest gap between a hello interval and its dead interval keeps a live neighbor's
+# entry from ever being looked at more than twice per dead interval
+# expired neighbors are unwatched until they're heard from or watched again
+class NeighborLiveness:
+    def __init__(self):
+        self.neighbors = {} # { ip:port : Neighbor }
+        self.deadlines = [] # heap of (deadline, ip:port)
+        self.horizon = None
+
+    def add(self, node, hello_interval, dead_interval, time_now):
+        neighbor = self.neighbors[node] = Neighbor(node, hello_interval, dead_interval)
+        horizon = max(0, dead_interval - hello_interval) // 2
+        if self.horizon is None or horizon < self.horizon:
+            self.horizon = horizon
+        self.watch(node, time_now)
+        return neighbor
+
+    # gives an unwatched neighbor a full dead interval from now, returns whether it wasn't watched
+    def watch(self, node, time_now):
+        neighbor = self.neighbors[node]
+        if neighbor.watched:
+            return False
+        neighbor.deadline = time_now + neighbor.dead_interval
+        neighbor.watched = True
+        heapq.heappush(self.deadlines, (neighbor.deadline, node))
+        return True
+
+    # a hello came in, returns whether the neighbor wasn't watched before
+    def heard_from(self, node, time_now):
+        neighbor = self.neighbors[node]
+        if neighbor.watched:
+            neighbor.deadline = time_now + neighbor.dead_interval
+            return False
+        return self.watch(node, time_now)
+
+    # the earliest deadline in the heap, it may have moved since, None if nothing is watched
+    def next_deadline(self):
+        return self.deadlines[0][0] if len(self.deadlines) > 0 else None
+
+    # the neighbors whose deadline is before time_now
+    def expire(self, time_now):
+        deadlines = self.deadlines
+        neighbors = self.neighbors
+        expired = []
+        not_due = [] # not heard from since pushed, but not expired either
+        horizon = time_now + self.horizon
+        while len(deadlines) > 0 and deadlines[0][0] < horizon:
+            entry = heapq.heappop(deadlines)
+            neighbor = neighbors[entry[1]]
+            if neighbor.deadline < time_now:
+                neighbor.watched = False
+                expired.append(entry[1])
+            elif neighbor.deadline == entry[0]:
+                not_due.append(entry)
+            else:
+                heapq.heappush(deadlines, (neighbor.deadline, entry[1]))
+        for entry in not_due:
+            heapq.heappush(deadlines, entry)
+        return expired
+
+    # the neighbors grouped by hello interval, { hello interval: [ip:port] }
+    def hello_groups(self):
+        groups = {}
+        for node, neighbor in self.neighbors.items():
+            groups.setdefault(neighbor.hello_interval, []).append(node)
+        return groups
+
+    def __contains__(self, node):
+        return node in self.neighbors
+
+    def __getitem__(self, node):
+        return self.neighbors[node]
+
+    def __iter__(self):
+        return iter(self.neighbors)
+
+    def __len__(self):
+        return len(self.neighbors)
+
+# hello and dead intervals of single links, for BFD-like fast failure detection on the links that
+# need it while the rest keep the defaults. every line is
+#
+#     hostname,port hostname,port hello_interval dead_interval
+#
+# in milliseconds, blank lines and lines starting with # are skipped. both ends of a link should
+# read the same file, a link is only as fast as its slower end's hellos
+# returns { frozenset of the two ip:port nodes: (hello interval, dead interval) }
+def read_link_timers(filename, resolve=socket.gethostbyname, resolve_workers=RESOLVE_WORKERS, resolve_timeout=RESOLVE_TIMEOUT):
+    links = []
+    with open(filename, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith('#'):
+                continue
+            if len(fields) != 4:
+                raise ValueError('link timers need two nodes, a hello interval and a dead interval: ' + line.strip())
+            ends = [field.split(',') for field in fields[:2]]
+            hello_interval = int(fields[2])
+            dead_interval = int(fields[3])
+            if hello_interval <= 0 or dead_interval <= hello_interval:
+                raise ValueError('the dead interval has to be longer than the hello interval: ' + line.strip())
+            links.append((ends, hello_interval, dead_interval))
+
+    hostnames = list(dict.fromkeys(hostname for ends, hello_interval, dead_interval in links for hostname, port in ends))
+    ips = resolve_hostnames(hostnames, resolve, resolve_workers, resolve_timeout)
+    link_timers = {}
+    for ends, hello_interval, dead_interval in links:
+        link = frozenset(ips[hostname] + ':' + port for hostname, port in ends)
+        link_timers[link] = (hello_interval, dead_interval)
+    return link_timers
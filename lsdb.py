@@ -0,0 +1,57 @@
+# link state database
+# keeps the sequence number of the latest LSP of every origin node we have heard from
+# {
+#   origin: (latest sequence number, time the latest LSP was installed, in milliseconds)
+# }
+# the origin is whatever the caller names nodes by, the emulator uses node ids, see nodes.py. the
+# neighbors an LSP lists go straight into the live topology and aren't kept here, every router
+# has an entry for every node so it is kept as small as it goes
+# an LSP is only installed, and only worth recomputing routes for or flooding, when its sequence
+# number is newer than the one we have. entries that aren't refreshed within max_age are dropped
+class LinkStateDatabase:
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.entries = {}
+
+        self.installed = 0
+        self.duplicates = 0 # same sequence number as the one we have
+        self.stale = 0 # older sequence number than the one we have
+        self.expired = 0
+
+    # returns True if the LSP is new and was installed, False if it is a duplicate or stale
+    def install(self, origin, sequence_number, time_now):
+        entry = self.entries.get(origin)
+        if entry is not None:
+            if sequence_number == entry[0]:
+                self.duplicates += 1
+                return False
+            if sequence_number < entry[0]:
+                self.stale += 1
+                return False
+
+        self.entries[origin] = (sequence_number, time_now)
+        self.installed += 1
+        return True
+
+    def sequence_number(self, origin):
+        entry = self.entries.get(origin)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def age(self, origin, time_now):
+        return time_now - self.entries[origin][1]
+
+    # drops every entry older than max_age and returns their origins
+    def sweep(self, time_now):
+        expired_origins = [origin for origin, entry in self.entries.items() if time_now - entry[1] > self.max_age]
+        for origin in expired_origins:
+            del self.entries[origin]
+        self.expired += len(expired_origins)
+        return expired_origins
+
+    def __contains__(self, origin):
+        return origin in self.entries
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,161 @@
+import collections
+import cProfile
+import json
+import os
+import socket
+
+from packet import Packet_Type
+
+PACKET_TYPE_NAMES = {packet_type.value: packet_type.name.lower() for packet_type in Packet_Type}
+STATS_CLIENT_TIMEOUT = 1000 # milliseconds a stats client gets to read its reply
+
+# counters a router bumps as it goes, plain dict increments so they can stay on in production
+# packets are counted by packet type, drops by reason and exceptions by class name
+# durations are in seconds
+class Metrics:
+    def __init__(self):
+        self.packets_received = collections.Counter()
+        self.packets_sent = collections.Counter()
+        self.packets_dropped = collections.Counter()
+        self.lsps_forwarded = 0
+        self.backup_forwards = 0 # packets sent to a loop-free alternate because their next hops were down
+        self.exceptions = collections.Counter()
+
+        self.spf_runs = 0
+        self.spf_total_duration = 0
+        self.spf_max_duration = 0
+
+    def record_spf_run(self, duration):
+        self.spf_runs += 1
+        self.spf_total_duration += duration
+        self.spf_max_duration = max(self.spf_max_duration, duration)
+
+    # used as the event loop's error handler: a callback that raised is counted instead of being
+    # silently ignored, and the loop carries on
+    def record_exception(self, error):
+        self.exceptions[type(error).__name__] += 1
+
+    def to_json(self):
+        return {
+            "packets_received": {PACKET_TYPE_NAMES.get(packet_type, packet_type): count for packet_type, count in self.packets_received.items()},
+            "packets_sent": {PACKET_TYPE_NAMES.get(packet_type, packet_type): count for packet_type, count in self.packets_sent.items()},
+            "packets_dropped": dict(self.packets_dropped),
+            "lsps_forwarded": self.lsps_forwarded,
+            "backup_forwards": self.backup_forwards,
+            "exceptions": dict(self.exceptions),
+            "spf_runs": self.spf_runs,
+            "spf_mean_ms": round(1000 * self.spf_total_duration / self.spf_runs, 3) if self.spf_runs > 0 else None,
+            "spf_max_ms": round(1000 * self.spf_max_duration, 3),
+        }
+
+# event loop timer lateness, how far behind its deadlines the loop is running
+def event_loop_lag(event_loop):
+    return {
+        "timers_fired": event_loop.timers_fired,
+        "mean_timer_lateness_ms": round(event_loop.total_timer_lateness / event_loop.timers_fired, 3) if event_loop.timers_fired > 0 else None,
+        "max_timer_lateness_ms": event_loop.max_timer_lateness,
+    }
+
+# profiles one call in every sample_every of the functions it wraps with cProfile, the rest run
+# untouched, so it is cheap enough to turn on in a busy emulator
+class SampledProfiler:
+    def __init__(self, sample_every):
+        self.sample_every = sample_every
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.samples = 0
+
+    # every wrapped function is sampled on its own count, so rare calls like a route recompute get
+    # profiled too
+    def wrap(self, function):
+        calls = [0]
+
+        def sampled(*args, **kwargs):
+            calls[0] += 1
+            self.calls += 1
+            if calls[0] % self.sample_every != 0:
+                return function(*args, **kwargs)
+            self.samples += 1
+            self.profile.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.profile.disable()
+        return sampled
+
+    # pstats format, python -m pstats filename reads it
+    def dump(self, filename):
+        self.profile.dump_stats(filename)
+
+    def dump_periodically(self, event_loop, filename, interval):
+        def on_dump_timer():
+            event_loop.call_later(interval, on_dump_timer)
+            self.dump(filename)
+
+        event_loop.call_later(interval, on_dump_timer)
+
+# every interval milliseconds writes get_stats() as json to filename, replacing the file in one
+# rename so a reader never sees half of it
+def dump_stats_periodically(event_loop, filename, interval, get_stats):
+    def on_dump_timer():
+        event_loop.call_later(interval, on_dump_timer)
+        temporary_filename = filename + '.tmp'
+        with open(temporary_filename, 'w') as file:
+            json.dump(get_stats(), file, indent=2)
+        os.replace(temporary_filename, filename)
+
+    event_loop.call_later(interval, on_dump_timer)
+
+# a stats reply, written as the client reads it from the event loop, which never waits on the client.
+# the connection is closed once the reply is written, or after STATS_CLIENT_TIMEOUT milliseconds
+# if the client is too slow to read it all
+class StatsReply:
+    def __init__(self, event_loop, connection, reply):
+        self.event_loop = event_loop
+        self.connection = connection
+        self.reply = memoryview(reply)
+        self.closed = False
+        connection.setblocking(0)
+        event_loop.add_writer(connection, self.on_writable)
+        self.timer = event_loop.call_later(STATS_CLIENT_TIMEOUT, self.close)
+
+    def on_writable(self):
+        try:
+            sent = self.connection.send(self.reply)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.close()
+            return
+        self.reply = self.reply[sent:]
+        if len(self.reply) == 0:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.timer.cancel()
+        self.event_loop.remove_writer(self.connection)
+        self.connection.close()
+
+# unix socket that answers every connection with get_stats() as json and closes it, served from the
+# event loop so the stats are never read halfway through a packet
+# nc -U path reads it
+def serve_stats(event_loop, path, get_stats):
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(8)
+    server.setblocking(0)
+
+    def on_connection():
+        try:
+            connection, address = server.accept()
+        except BlockingIOError:
+            return
+        StatsReply(event_loop, connection, json.dumps(get_stats(), indent=2).encode() + b'\n')
+
+    event_loop.add_reader(server, on_connection)
+    return server
@@ -0,0 +1,312 @@
+import argparse
+import http.server
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from packet import pack_node, unpack_node
+from routetrace import Tracer, max_hops_argument, milliseconds_now, read_batch
+from scheduler import EventLoop
+
+# latency histogram with hdr histogram style buckets: exact below 2^SUB_BUCKET_BITS, above that
+# every power of two is split into 2^(SUB_BUCKET_BITS - 1) equal buckets, so any recorded value is
+# off by less than 1 part in 64 whatever its size. values are whole microseconds, the counts are
+# kept sparse as { bucket index: count }
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+
+def histogram_bucket(value):
+    if value < SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKET_COUNT + (shift - 1) * SUB_BUCKET_HALF + (value >> shift) - SUB_BUCKET_HALF
+
+# the highest value that falls in the bucket
+def histogram_bucket_value(bucket):
+    if bucket < SUB_BUCKET_COUNT:
+        return bucket
+    shift = (bucket - SUB_BUCKET_COUNT) // SUB_BUCKET_HALF + 1
+    sub_bucket = (bucket - SUB_BUCKET_COUNT) % SUB_BUCKET_HALF + SUB_BUCKET_HALF
+    return ((sub_bucket + 1) << shift) - 1
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, microseconds):
+        microseconds = max(0, int(microseconds))
+        bucket = histogram_bucket(microseconds)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += microseconds
+        self.min = microseconds if self.min is None else min(self.min, microseconds)
+        self.max = microseconds if self.max is None else max(self.max, microseconds)
+
+    # the value at or below which percentile percent of the recorded values are
+    def percentile(self, percentile):
+        if self.count == 0:
+            return None
+        rank = max(1, -(-self.count * percentile // 100))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(histogram_bucket_value(bucket), self.max)
+        return self.max
+
+    def to_json(self):
+        return {
+            "count": self.count,
+            "min_us": self.min,
+            "mean_us": None if self.count == 0 else round(self.total / self.count),
+            "p50_us": self.percentile(50),
+            "p90_us": self.percentile(90),
+            "p99_us": self.percentile(99),
+            "p999_us": self.percentile(99.9),
+            "max_us": self.max,
+        }
+
+# binary log record, one per finished trace - struct !QB6s6sBB then !6sI per hop
+# 1) record version - 1 byte
+# 2) wall clock time the trace finished, milliseconds since the epoch - 8 bytes
+# 3) source and dest - packed ip and port, 6 bytes each
+# 4) flags - 1 byte, RECORD_REACHED and RECORD_PATH_CHANGED
+# 5) number of hops - 1 byte
+# 6) per hop, the packed ip and port and the round trip time in microseconds, all zeros and
+#    NO_ROUND_TRIP_TIME for a hop that didn't answer
+RECORD_VERSION = 1
+RECORD_HEADER = struct.Struct('!BQ6s6sBB')
+RECORD_HOP = struct.Struct('!6sI')
+RECORD_REACHED = 1
+RECORD_PATH_CHANGED = 2
+NO_HOP = bytes(6)
+NO_ROUND_TRIP_TIME = 0xFFFFFFFF
+
+def encode_record(time_now, source, dest, reached, path_changed, hops, round_trip_times):
+    flags = (RECORD_REACHED if reached else 0) | (RECORD_PATH_CHANGED if path_changed else 0)
+    record = RECORD_HEADER.pack(RECORD_VERSION, time_now, pack_node(source), pack_node(dest), flags, len(hops))
+    for hop, round_trip_time in zip(hops, round_trip_times):
+        if hop is None or round_trip_time is None:
+            record += RECORD_HOP.pack(NO_HOP, NO_ROUND_TRIP_TIME)
+        else:
+            record += RECORD_HOP.pack(pack_node(hop), min(round(round_trip_time * 1000), NO_ROUND_TRIP_TIME - 1))
+    return record
+
+# yields every record of a log file as a dict
+def read_records(filename):
+    with open(filename, 'rb') as file:
+        data = file.read()
+    offset = 0
+    while offset < len(data):
+        version, time_now, source, dest, flags, num_hops = RECORD_HEADER.unpack_from(data, offset)
+        if version != RECORD_VERSION:
+            raise ValueError('unsupported monitor log record version ' + str(version))
+        offset += RECORD_HEADER.size
+        hops = []
+        round_trip_times = []
+        for i in range(num_hops):
+            hop, round_trip_time = RECORD_HOP.unpack_from(data, offset)
+            offset += RECORD_HOP.size
+            hops.append(None if hop == NO_HOP else unpack_node(hop))
+            round_trip_times.append(None if round_trip_time == NO_ROUND_TRIP_TIME else round_trip_time / 1000)
+        yield {
+            "time": time_now,
+            "source": unpack_node(source),
+            "dest": unpack_node(dest),
+            "reached": bool(flags & RECORD_REACHED),
+            "path_changed": bool(flags & RECORD_PATH_CHANGED),
+            "hops": hops,
+            "round_trip_times": round_trip_times,
+        }
+
+# appends records to filename, once it would grow past max_bytes it is renamed to filename.1, the
+# older ones move up to filename.2 and so on, and filename.<backup_count> is dropped
+class RotatingLog:
+    def __init__(self, filename, max_bytes, backup_count):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = open(filename, 'ab')
+        self.size = self.file.tell()
+
+    def write(self, record):
+        if self.size > 0 and self.size + len(record) > self.max_bytes:
+            self.rotate()
+        self.file.write(record)
+        self.file.flush()
+        self.size += len(record)
+
+    def rotate(self):
+        self.file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            older = self.filename + '.' + str(index)
+            if os.path.exists(older):
+                os.replace(older, self.filename + '.' + str(index + 1))
+        if self.backup_count > 0:
+            os.replace(self.filename, self.filename + '.1')
+        else:
+            os.remove(self.filename)
+        self.file = open(self.filename, 'ab')
+        self.size = 0
+
+# what is known about one (source, dest) pair across all of its traces
+class PathStats:
+    def __init__(self, source, dest):
+        self.source = source
+        self.dest = dest
+        self.histogram = LatencyHistogram() # round trip time to the dest
+        self.hops = None # latest complete path
+        self.traces = 0
+        self.unreached = 0
+        self.path_changes = 0
+        self.last_change = None
+
+    def to_json(self):
+        return {
+            "source": self.source,
+            "dest": self.dest,
+            "traces": self.traces,
+            "unreached": self.unreached,
+            "path_changes": self.path_changes,
+            "last_change": self.last_change,
+            "hops": self.hops,
+            "round_trip_time": self.histogram.to_json(),
+        }
+
+# traces every pair every interval milliseconds for as long as the event loop runs
+# a path only counts as changed when two traces that reached the dest with every hop answering
+# went different ways, a lost probe isn't a path change
+class PathMonitor:
+    def __init__(self, tracer, pairs, interval, log=None):
+        self.tracer = tracer
+        self.pairs = pairs
+        self.interval = interval
+        self.log = log
+        self.paths = {}
+        for source_ip, source_port, dest_ip, dest_port in pairs:
+            key = (source_ip + ':' + str(source_port), dest_ip + ':' + str(dest_port))
+            self.paths[key] = PathStats(key[0], key[1])
+        self.rounds = 0
+        self.stats_json = self.render_stats()
+        tracer.on_trace_finished = self.on_trace_finished
+
+    def start(self):
+        self.on_round_timer()
+
+    def on_round_timer(self):
+        self.tracer.event_loop.call_later(self.interval, self.on_round_timer)
+        self.rounds += 1
+        for source_ip, source_port, dest_ip, dest_port in self.pairs:
+            self.tracer.trace(source_ip, source_port, dest_ip, dest_port)
+
+    def on_trace_finished(self, trace):
+        self.tracer.traces.remove(trace)
+        source = trace.source_ip + ':' + str(trace.source_port)
+        dest = trace.dest_ip + ':' + str(trace.dest_port)
+        path = self.paths[(source, dest)]
+        hops = trace.hops()
+        round_trip_times = trace.hop_round_trip_times()
+        reached = trace.dest_time_to_live is not None
+        time_now = round(time.time() * 1000)
+
+        path.traces += 1
+        path_changed = False
+        if not reached:
+            path.unreached += 1
+        else:
+            path.histogram.record(round_trip_times[-1] * 1000)
+            if None not in hops:
+                if path.hops is not None and hops != path.hops:
+                    path_changed = True
+                    path.path_changes += 1
+                    path.last_change = time_now
+                    print('path change', source, '->', dest, ':', ' '.join(path.hops), '=>', ' '.join(hops), file=sys.stderr)
+                path.hops = hops
+
+        if self.log is not None:
+            self.log.write(encode_record(time_now, source, dest, reached, path_changed, hops, round_trip_times))
+        # the http thread only ever reads the latest rendering
+        self.stats_json = self.render_stats()
+
+    def render_stats(self):
+        return json.dumps({"rounds": self.rounds, "exceptions": dict(self.tracer.exceptions), "paths": [path.to_json() for path in self.paths.values()]}, indent=2).encode()
+
+# serves the monitor's latest stats as json on 127.0.0.1:port from a background thread
+def serve_stats(monitor, port):
+    class StatsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = monitor.stats_json
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), StatsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-a', '--routetrace_port', help='port the monitor sends probes from and listens on for replies', type=int)
+    parser.add_argument('-B', '--batch', help='file with a "hostname,port hostname,port" source and dest pair per line to monitor', type=str)
+    parser.add_argument('-i', '--interval', help='seconds between traces of every pair', default=10, type=float)
+    parser.add_argument('-w', '--window', help='probes of a trace that are out at the same time', default=16, type=int)
+    parser.add_argument('-m', '--max_hops', help='give up on reaching the dest after this many hops, at most 255', default=30, type=max_hops_argument)
+    parser.add_argument('-t', '--timeout', help='milliseconds to wait for the reply to a probe before sending it again', default=1000, type=int)
+    parser.add_argument('-r', '--retries', help='times a probe is sent again before its hop is given up on', default=2, type=int)
+    parser.add_argument('-l', '--log', help='binary log every trace is appended to', type=str)
+    parser.add_argument('-s', '--log_size', help='bytes the log grows to before it is rotated', default=10 * 2 ** 20, type=int)
+    parser.add_argument('-k', '--log_backups', help='number of rotated logs kept', default=5, type=int)
+    parser.add_argument('-p', '--http_port', help='serve the stats as json on this port of 127.0.0.1', type=int)
+    parser.add_argument('-d', '--dump', help='print the records of a binary log as json lines and exit', type=str)
+
+    args = parser.parse_args()
+    if args.dump is None and (args.routetrace_port is None or args.batch is None):
+        parser.error('-a and -B are required without -d/--dump')
+    return args
+
+def main():
+    args = parse_command_line_args()
+    if args.dump is not None:
+        for record in read_records(args.dump):
+            print(json.dumps(record))
+        return
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    routetrace_hostname = socket.gethostname()
+    routetrace_ip = socket.gethostbyname(routetrace_hostname)
+    sock.bind((routetrace_hostname, args.routetrace_port))
+    sock.setblocking(0)
+
+    event_loop = EventLoop(milliseconds_now)
+    tracer = Tracer(sock, routetrace_ip, args.routetrace_port, event_loop, args.window, args.max_hops, args.timeout, args.retries)
+    # a stray datagram on the monitor's port or a bug in a callback is counted, not the end of the daemon
+    event_loop.error_handler = tracer.record_exception
+    event_loop.add_reader(sock, tracer.on_socket_readable)
+
+    log = None
+    if args.log is not None:
+        log = RotatingLog(args.log, args.log_size, args.log_backups)
+    monitor = PathMonitor(tracer, read_batch(args.batch), args.interval * 1000, log)
+    if args.http_port is not None:
+        serve_stats(monitor, args.http_port)
+    monitor.start()
+    event_loop.run_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import array
+
+from packet import packed_nodes, socket_addresses, unpacked_nodes
+from topology import CompiledTopology
+
+# every node a router knows about gets a dense integer id, handed out once when the topology is
+# loaded, so the packet path looks nodes up by the packed node in the header or the address a
+# packet came from and never builds or splits an "ip:port" string
+# the nodes of the topology get ids 0 to num_topology_nodes - 1 in topology order, the same order
+# the shortest path engines number them in. nodes that only show up in packets, like a routetrace
+# tool, are added after them the first time they are seen
+# the topology's links are kept as CSR arrays: the neighbors of node id i are
+# neighbor_ids[offsets[i]:offsets[i + 1]], with the costs the topology file gives them in costs
+# a topology.CompiledTopology already has them, its node ids and arrays are used as they are, in the
+# memory the file is mapped into
+# one registry is meant to be shared by every router of a process that runs the same topology
+class NodeRegistry:
+    def __init__(self, network_topology):
+        self.nodes = [] # id -> "ip:port"
+        self.packed_nodes = [] # id -> packed ip and port, see packet.pack_node
+        self.addresses = [] # id -> (ip, port) for sendto
+        self.ids = {} # { "ip:port": id }
+        self.ids_by_packed_node = {} # { packed node: id }
+        self.ids_by_address = {} # { (ip, port): id }
+        for node in network_topology:
+            self.add(node)
+        self.num_topology_nodes = len(self.nodes)
+
+        if isinstance(network_topology, CompiledTopology):
+            self.offsets = network_topology.offsets
+            self.neighbor_ids = network_topology.neighbors
+            self.costs = network_topology.costs
+            return
+
+        ids = self.ids
+        self.offsets = array.array('I', [0])
+        self.neighbor_ids = array.array('I')
+        self.costs = array.array('I')
+        for node in network_topology:
+            for neighbor, cost in network_topology[node].items():
+                self.neighbor_ids.append(ids[neighbor])
+                self.costs.append(cost)
+            self.offsets.append(len(self.neighbor_ids))
+
+    # the packed node and the socket address are the ones packet.py caches, so they aren't kept twice
+    def add(self, node):
+        node_id = len(self.nodes)
+        packed_node = packed_nodes[node]
+        address = socket_addresses[node]
+        self.nodes.append(node)
+        self.packed_nodes.append(packed_node)
+        self.addresses.append(address)
+        self.ids[node] = node_id
+        self.ids_by_packed_node[packed_node] = node_id
+        self.ids_by_address[address] = node_id
+        return node_id
+
+    def id_of_packed_node(self, packed_node):
+        node_id = self.ids_by_packed_node.get(packed_node)
+        if node_id is None:
+            node_id = self.add(unpacked_nodes[packed_node])
+        return node_id
+
+    def in_topology(self, node_id):
+        return node_id < self.num_topology_nodes
+
+    # the neighbor ids of a node in the topology file
+    def neighbors(self, node_id):
+        return self.neighbor_ids[self.offsets[node_id]:self.offsets[node_id + 1]]
+
+    def __len__(self):
+        return len(self.nodes)
@@ -0,0 +1,271 @@
+from enum import Enum
+import functools
+import io
+import pickle
+import socket
+import struct
+
+class Packet_Type(Enum):
+    HELLO_MESSAGE = 'H'
+    LINK_STATE_MESSAGE = 'L'
+    ROUTE_TRACE = 'T'
+    HELLO_ACK = 'A'
+
+# packet header - struct !Bc6sIB6s, 19 bytes
+# 1) header version - 1 byte
+# 2) packet type - 1 byte
+# 3) source node - ip (4 bytes) and port (2 bytes)
+# 4) sequence number - 4 bytes
+# 5) time to live - 1 byte
+# 6) dest node - ip (4 bytes) and port (2 bytes)
+#
+# the legacy header is struct !cIIIIIIIIIIII, 49 bytes, with a 4 byte int per ip octet and no
+# version byte. it starts with the packet type, an ascii letter, which the version byte is never
+# equal to, so both can be told apart from the first byte while emulators get upgraded
+HEADER_VERSION = 2
+HEADER = struct.Struct('!Bc6sIB6s')
+LEGACY_HEADER = struct.Struct('!cIIIIIIIIIIII')
+LEGACY_PACKET_TYPES = {ord(packet_type.value): packet_type.value for packet_type in Packet_Type}
+
+# where the time to live sits in each header
+TTL_OFFSET = 12
+LEGACY_TTL_OFFSET = 25
+LEGACY_TTL = struct.Struct('!I')
+
+# placeholder for the dest of packets that don't have one
+NO_NODE = bytes(6)
+
+PACKET_TYPE_BYTES = {packet_type.value: packet_type.value.encode('ascii') for packet_type in Packet_Type}
+
+# link state message payload
+# 1) version - 1 byte
+# 2) number of neighbors - 2 bytes
+# 3) one entry per neighbor
+# - neighbor ip (4 bytes)
+# - neighbor port (2 bytes)
+# - cost of the link to the neighbor (4 bytes)
+LSP_PAYLOAD_VERSION = 1
+LSP_PAYLOAD_HEADER = struct.Struct('!BH')
+LSP_ENTRY = struct.Struct('!6sI')
+LSP_MAX_LINK_COST = 2 ** 32 - 1 # the most the 4 byte cost field holds
+
+# LSPs are mostly refreshes listing the same neighbors as the origin's last one, so a payload is
+# encoded once per distinct neighbor list and the result is kept, for this many lists
+LSP_PAYLOAD_CACHE_SIZE = 4096
+
+# the old payload was a pickled list of "ip:port" strings, every pickle starts with this byte
+PICKLE_PROTOCOL_MARKER = 0x80
+
+# "ip:port" <-> 6 bytes of packed ip and port
+# nodes are packed over and over so both directions are cached, a lookup of a node that isn't
+# cached yet converts it and fills in both caches
+class PackedNodes(dict):
+    def __missing__(self, node):
+        ip, port = node.split(':')
+        packed_node = socket.inet_aton(ip) + struct.pack('!H', int(port))
+        self[node] = packed_node
+        unpacked_nodes[packed_node] = node
+        return packed_node
+
+class UnpackedNodes(dict):
+    def __missing__(self, packed_node):
+        packed_node = bytes(packed_node)
+        node = socket.inet_ntoa(packed_node[:4]) + ':' + str(struct.unpack('!H', packed_node[4:])[0])
+        self[packed_node] = node
+        packed_nodes[node] = packed_node
+        return node
+
+packed_nodes = PackedNodes()
+unpacked_nodes = UnpackedNodes()
+
+# "ip:port" -> ("ip", port) for sendto
+class SocketAddresses(dict):
+    def __missing__(self, node):
+        ip, port = node.split(':')
+        self[node] = (ip, int(port))
+        return self[node]
+
+socket_addresses = SocketAddresses()
+
+def pack_node(node):
+    return packed_nodes[node]
+
+def unpack_node(packed_node):
+    return unpacked_nodes[packed_node]
+
+# source_node and dest_node are packed nodes, see pack_node
+def pack_header(packet_type, source_node, sequence_number, time_to_live, dest_node):
+    return HEADER.pack(HEADER_VERSION, PACKET_TYPE_BYTES[packet_type], source_node, sequence_number, time_to_live, dest_node)
+
+def pack_legacy_header(packet_type, source_node, sequence_number, time_to_live, dest_node):
+    source_ip_a, source_ip_b, source_ip_c, source_ip_d, source_port = struct.unpack('!BBBBH', source_node)
+    dest_ip_a, dest_ip_b, dest_ip_c, dest_ip_d, dest_port = struct.unpack('!BBBBH', dest_node)
+    return LEGACY_HEADER.pack(
+        PACKET_TYPE_BYTES[packet_type],
+        source_ip_a, source_ip_b, source_ip_c, source_ip_d,
+        source_port,
+        sequence_number,
+        time_to_live,
+        dest_ip_a, dest_ip_b, dest_ip_c, dest_ip_d,
+        dest_port
+    )
+
+# forwarding fast path: decrements the time to live of a received packet in place and returns it
+# packet is a bytearray or a writable memoryview, nothing else in it is touched, payload included
+# a packet with no hops left isn't forwarded, it raises ValueError and is left as it is
+def decrement_time_to_live(packet):
+    if packet[0] == HEADER_VERSION:
+        packet[TTL_OFFSET] -= 1
+    else:
+        time_to_live, = LEGACY_TTL.unpack_from(packet, LEGACY_TTL_OFFSET)
+        if time_to_live == 0:
+            raise ValueError('packet has no hops left to be forwarded')
+        LEGACY_TTL.pack_into(packet, LEGACY_TTL_OFFSET, time_to_live - 1)
+    return packet
+
+HEADER_FORMATS = {
+    'compact': pack_header,
+    'legacy': pack_legacy_header,
+}
+
+# returns packet type, source node, sequence number, time to live, dest node and the offset the
+# payload starts at, the nodes are packed nodes
+def parse_header(packet):
+    if packet[0] == HEADER_VERSION:
+        version, packet_type, source_node, sequence_number, time_to_live, dest_node = HEADER.unpack_from(packet, 0)
+        return chr(packet_type[0]), source_node, sequence_number, time_to_live, dest_node, HEADER.size
+
+    if packet[0] in LEGACY_PACKET_TYPES:
+        header = LEGACY_HEADER.unpack_from(packet, 0)
+        source_node = struct.pack('!BBBBH', header[1], header[2], header[3], header[4], header[5])
+        dest_node = struct.pack('!BBBBH', header[8], header[9], header[10], header[11], header[12])
+        return LEGACY_PACKET_TYPES[packet[0]], source_node, header[6], header[7], dest_node, LEGACY_HEADER.size
+
+    raise ValueError('unknown packet header version ' + str(packet[0]))
+
+# just the packet type, for counting packets without parsing the rest of the header
+def peek_packet_type(packet):
+    if packet[0] == HEADER_VERSION:
+        return chr(packet[1])
+    return chr(packet[0])
+
+# one precompiled Struct per neighbor count covering every entry of the payload, so a whole
+# payload is packed or unpacked in a single call
+# each entry is '6sI', the packed ip and port followed by the link cost
+@functools.lru_cache(maxsize=256)
+def lsp_entries_struct(num_neighbors):
+    return struct.Struct('!' + '6sI' * num_neighbors)
+
+# neighboring_nodes is a list of "ip:port" nodes, or a dict of { "ip:port": link cost }
+# a plain list gets a cost of 1 for every link
+def encode_lsp_payload(neighboring_nodes):
+    if isinstance(neighboring_nodes, dict):
+        return encode_lsp_entries(tuple(neighboring_nodes.items()), True)
+    return encode_lsp_entries(tuple(neighboring_nodes), False)
+
+# entries is a tuple of (node, cost) pairs when with_costs, of nodes otherwise
+@functools.lru_cache(maxsize=LSP_PAYLOAD_CACHE_SIZE)
+def encode_lsp_entries(entries, with_costs):
+    num_neighbors = len(entries)
+    fields = [None] * (2 * num_neighbors)
+    if with_costs:
+        fields[0::2] = [packed_nodes[node] for node, cost in entries]
+        fields[1::2] = [cost for node, cost in entries]
+    else:
+        fields[0::2] = map(packed_nodes.__getitem__, entries)
+        fields[1::2] = [1] * num_neighbors
+
+    return LSP_PAYLOAD_HEADER.pack(LSP_PAYLOAD_VERSION, num_neighbors) + lsp_entries_struct(num_neighbors).pack(*fields)
+
+# only lets lists of strings through, anything that needs a class to be loaded is refused
+class LegacyLspUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError('LSP payload tried to load ' + module + '.' + name)
+
+def decode_legacy_lsp_payload(data):
+    neighboring_nodes = LegacyLspUnpickler(io.BytesIO(data)).load()
+    if not isinstance(neighboring_nodes, list) or not all(isinstance(node, str) for node in neighboring_nodes):
+        raise ValueError('legacy LSP payload is not a list of nodes')
+    return {packed_nodes[node]: 1 for node in neighboring_nodes}
+
+# returns { packed node: link cost } for the neighbors listed in the payload, see pack_node
+# data can be bytes, a bytearray or a memoryview, it is read where it is without being copied
+# an LSP is told apart by its origin and sequence number, the way the link state database tells
+# them apart. given both, the result is kept as the origin's latest in decoded_lsps and the same LSP
+# isn't decoded again, which is what the other routers of a process that runs many of them (host
+# mode, the simulator) get when it reaches them. the dict handed back must not be changed
+def decode_lsp_payload(data, origin=None, sequence_number=None):
+    if origin is not None:
+        decoded = decoded_lsps.get(origin)
+        if decoded is not None and decoded[0] == sequence_number:
+            return decoded[1]
+
+    view = memoryview(data)
+    if len(view) > 0 and view[0] == PICKLE_PROTOCOL_MARKER:
+        entries = decode_legacy_lsp_payload(view)
+    else:
+        entries = decode_lsp_entries(view)
+    if origin is not None:
+        decoded_lsps[origin] = (sequence_number, entries)
+    return entries
+
+# { packed origin: (sequence number, { packed node: link cost }) }, see decode_lsp_payload
+decoded_lsps = {}
+
+def decode_lsp_entries(view):
+    version, num_neighbors = LSP_PAYLOAD_HEADER.unpack_from(view, 0)
+    if version != LSP_PAYLOAD_VERSION:
+        raise ValueError('unsupported LSP payload version ' + str(version))
+    entries_end = LSP_PAYLOAD_HEADER.size + num_neighbors * LSP_ENTRY.size
+    if len(view) < entries_end:
+        raise ValueError('LSP payload is shorter than its ' + str(num_neighbors) + ' neighbors')
+    return dict(LSP_ENTRY.iter_unpack(view[LSP_PAYLOAD_HEADER.size:entries_end]))
+
+# builds each outgoing packet once and hands out the same bytes until something that goes into it
+# changes: the hello packet never does, the LSP is rebuilt for a new sequence number or a new set
+# of neighbors
+class PacketCache:
+    def __init__(self, pack_packet_header, source_node):
+        self.pack_packet_header = pack_packet_header
+        self.source_node = source_node
+        self.packets = {} # { packet type: (key, packet) }
+        self.builds = 0
+
+    def get(self, packet_type, key, build):
+        cached = self.packets.get(packet_type)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        packet = build()
+        self.builds += 1
+        self.packets[packet_type] = (key, packet)
+        return packet
+
+    # timestamp goes in the sequence number, a neighbor that gets a hello with one echoes it back
+    # in a HELLO_ACK so the round trip time can be measured, 0 means no ack is wanted
+    def hello_packet(self, timestamp=0):
+        return self.get(Packet_Type.HELLO_MESSAGE.value, timestamp, lambda: self.build_hello_packet(timestamp))
+
+    def build_hello_packet(self, timestamp):
+        # ttl and dest are unused in hello messages
+        header = self.pack_packet_header(Packet_Type.HELLO_MESSAGE.value, self.source_node, timestamp, 0, NO_NODE)
+        return header + 'hello'.encode()
+
+    def link_state_packet(self, sequence_number, time_to_live, neighboring_nodes):
+        if isinstance(neighboring_nodes, dict):
+            neighbors_key = tuple(neighboring_nodes.items())
+        else:
+            neighbors_key = tuple(neighboring_nodes)
+        key = (sequence_number, time_to_live, neighbors_key)
+        return self.get(Packet_Type.LINK_STATE_MESSAGE.value, key,
+                        lambda: self.build_link_state_packet(sequence_number, time_to_live, neighboring_nodes))
+
+    def build_link_state_packet(self, sequence_number, time_to_live, neighboring_nodes):
+        header = self.pack_packet_header(Packet_Type.LINK_STATE_MESSAGE.value, self.source_node, sequence_number, time_to_live, NO_NODE)
+        return header + encode_lsp_payload(neighboring_nodes)
+
+# sends the same packet to every node in nodes
+# python has no sendmmsg, so this is a tight sendto loop with the lookups hoisted out of it
+def send_to_nodes(sock, packet, nodes):
+    sendto = sock.sendto
+    for address in map(socket_addresses.__getitem__, nodes):
+        sendto(packet, address)
@@ -1,27 +1,50 @@
 import argparse
-from enum import Enum
+import collections
+import itertools
+import json
 import socket
 import struct
+import sys
+import time
 
-class Packet_Type(Enum):
-    HELLO_MESSAGE = 'H'
-    LINK_STATE_MESSAGE = 'L'
-    ROUTE_TRACE = 'T'
+from packet import Packet_Type, pack_header, pack_node, parse_header, unpack_node
+from scheduler import EventLoop
+
+PROBE_ID_MODULUS = 2 ** 32 # probe ids travel in the 4 byte sequence number
+MAX_HOPS = 255 # a probe's hop travels in the 1 byte time to live
+
+# what parsing a datagram that isn't a routetrace reply, or is cut short, raises
+MALFORMED_PACKET_ERRORS = (IndexError, ValueError, struct.error)
+
+# argparse type of -m/--max_hops
+def max_hops_argument(value):
+    max_hops = int(value)
+    if max_hops < 1 or max_hops > MAX_HOPS:
+        raise argparse.ArgumentTypeError('max hops has to be from 1 to ' + str(MAX_HOPS))
+    return max_hops
 
 def parse_command_line_args():
     parser = argparse.ArgumentParser()
-    
+
     parser.add_argument('-a', '--routetrace_port', help='port on which the routetrace listens on for packets', required=True, type=int)
-    parser.add_argument('-b', '--source_hostname', help='source hostname', required=True, type=str)
-    parser.add_argument('-c', '--source_port', help='source port number', required=True, type=int)
-    parser.add_argument('-d', '--dest_hostname', help='destination hostname', required=True, type=str)
-    parser.add_argument('-e', '--dest_port', help='destination port number', required=True, type=int)
-    parser.add_argument('-f', '--debug_option', help="when the debug option is 1, the application will print out the following information about the packets that it sends and receives: TTL of the packet and the src. and dst. IP and port numbers. It will not do so when this option is 0", required=True, type=int)
+    parser.add_argument('-b', '--source_hostname', help='source hostname', type=str)
+    parser.add_argument('-c', '--source_port', help='source port number', type=int)
+    parser.add_argument('-d', '--dest_hostname', help='destination hostname', type=str)
+    parser.add_argument('-e', '--dest_port', help='destination port number', type=int)
+    parser.add_argument('-f', '--debug_option', help="when the debug option is 1, the application will print out the following information about the packets that it sends and receives: TTL of the packet and the src. and dst. IP and port numbers. It will not do so when this option is 0", default=0, type=int)
+    parser.add_argument('-w', '--window', help='probes of a trace that are out at the same time, a path up to this long is traced in one round trip', default=16, type=int)
+    parser.add_argument('-m', '--max_hops', help='give up on reaching the dest after this many hops, at most 255', default=30, type=max_hops_argument)
+    parser.add_argument('-t', '--timeout', help='milliseconds to wait for the reply to a probe before sending it again', default=1000, type=int)
+    parser.add_argument('-r', '--retries', help='times a probe is sent again before its hop is given up on', default=2, type=int)
+    parser.add_argument('-B', '--batch', help='file with a "hostname,port hostname,port" source and dest pair per line, all of them are traced at once and the routes written as json', type=str)
+    parser.add_argument('-o', '--output', help='file the json routes of a batch are written to instead of stdout', type=str)
 
     args = parser.parse_args()
+    if args.batch is None and None in (args.source_hostname, args.source_port, args.dest_hostname, args.dest_port):
+        parser.error('-b, -c, -d and -e are required without -B/--batch')
     return args
 
-def send_packet(source_ip, source_port, time_to_live, routetrace_ip, routetrace_port, dest_ip, dest_port, debug_option):
+def send_packet(sock, source_ip, source_port, time_to_live, routetrace_ip, routetrace_port, dest_ip, dest_port, debug_option, probe_id=0):
     #print('--------------------------------------')
     #print('SENDING ROUTETRACE PACKET to:', source_ip, ':', str(source_port))
     #print('routetrace ip: ', routetrace_ip, ', routetrace port: ', routetrace_port)
@@ -29,101 +52,277 @@ def send_packet(source_ip, source_port, time_to_live, routetrace_ip, routetrace_
     #print('time to live: ', time_to_live)
     #print('debug option: ', debug_option)
     #print('--------------------------------------')
-    routetrace_ip_a = int(routetrace_ip.split('.')[0])
-    routetrace_ip_b = int(routetrace_ip.split('.')[1])
-    routetrace_ip_c = int(routetrace_ip.split('.')[2])
-    routetrace_ip_d = int(routetrace_ip.split('.')[3])
-
-    dest_ip_a = int(dest_ip.split('.')[0])
-    dest_ip_b = int(dest_ip.split('.')[1])
-    dest_ip_c = int(dest_ip.split('.')[2])
-    dest_ip_d = int(dest_ip.split('.')[3])
-   
-    header = struct.pack(
-        '!cIIIIIIIIIIII',
-        Packet_Type.ROUTE_TRACE.value.encode('ascii'),
-        routetrace_ip_a, routetrace_ip_b, routetrace_ip_c, routetrace_ip_d,
-        routetrace_port,
-        0, # placeholder values,
+    header = pack_header(
+        Packet_Type.ROUTE_TRACE.value,
+        pack_node(routetrace_ip + ':' + str(routetrace_port)),
+        probe_id,
         time_to_live,
-        dest_ip_a, dest_ip_b, dest_ip_c, dest_ip_d, 
-        dest_port
+        pack_node(dest_ip + ':' + str(dest_port))
     )
     data = ''.encode()
     packet = header + data
 
-    global sock
-    sock.sendto(packet, (source_ip, source_port))
+    if debug_option == 1:
+        print('sent: ttl', time_to_live, ', src', routetrace_ip + ':' + str(routetrace_port), ', dst', dest_ip + ':' + str(dest_port))
 
-def parse_packet(packet):
-    header = struct.unpack('!cIIIIIIIIIIII', packet[:50])
-    packet_type = header[0].decode('ascii')
-    source_ip = str(header[1]) + '.' + str(header[2]) + '.' + str(header[3]) + '.' + str(header[4])
-    source_port = header[5]
-    sequence_number = header[6]
-    ttl = header[7]
-
-    dest_ip = str(header[8]) + '.' + str(header[9]) + '.' + str(header[10]) + '.' + str(header[11])
-    dest_port = header[12]
+    sock.sendto(packet, (source_ip, source_port))
 
-    data = packet[50:].decode()
+# returns the ip and port of the emulator that answered and the probe id it echoed back
+def parse_packet(packet, debug_option=0):
+    packet_type, source_node, sequence_number, ttl, dest_node, payload_offset = parse_header(packet)
+    source_ip, source_port = unpack_node(source_node).split(':')
+    source_port = int(source_port)
+    dest_ip, dest_port = unpack_node(dest_node).split(':')
 
     #print('-----------------------------')
     #print('INCOMING PACKET:')
     #print('packet type: ', packet_type)
     #print('source ip: ', source_ip, ', source port: ', source_port)
     #print('dest ip: ', dest_ip, ', dest port: ', dest_port)
-    #print('sequence number: ', sequence_number) this field is unused in a routetrace packet
+    #print('sequence number: ', sequence_number)
     #print('time to live: ', ttl)
-    #print('data: ', data)
     #print('-----------------------------')
-    
-    return source_ip, source_port
+
+    if debug_option == 1:
+        print('received: ttl', ttl, ', src', source_ip + ':' + str(source_port), ', dst', dest_ip + ':' + dest_port)
+
+    return source_ip, source_port, sequence_number
 
 def print_route(route_taken):
     print("Hop#\t IP,Port")
     num_hops = len(route_taken)
     for i in range(0, num_hops):
         hop_number = i + 1
-        addr = route_taken[hop_number]["ip"] + ',' + str(route_taken[hop_number]["port"])
+        if route_taken[hop_number] is None:
+            # no reply from this hop after every retry
+            addr = '*'
+        else:
+            addr = route_taken[hop_number]["ip"] + ',' + str(route_taken[hop_number]["port"])
         print(hop_number, "\t", addr)
 
-args = parse_command_line_args()
-routetrace_port = args.routetrace_port
-source_hostname = args.source_hostname
-source_ip = socket.gethostbyname(source_hostname)
-source_port = args.source_port
-dest_hostname = args.dest_hostname
-dest_ip = socket.gethostbyname(dest_hostname)
-dest_port = args.dest_port
-debug_option = args.debug_option
-
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-routetrace_hostname = socket.gethostname()
-routetrace_ip = socket.gethostbyname(routetrace_hostname)
-sock.bind((routetrace_hostname, routetrace_port))
-#print('MY ADDRESS IS: ', routetrace_hostname, ':', routetrace_port)
-
-hop_number = 1
-route_taken = {}
-
-time_to_live = 0
-while True:
-    send_packet(source_ip, source_port, time_to_live, routetrace_ip, routetrace_port, dest_ip, dest_port, debug_option)
-
-    packet_with_header, sender_address = sock.recvfrom(1024)
-
-    responder_ip, responder_port = parse_packet(packet_with_header)
-    
-    route_taken[hop_number] = {}
-    route_taken[hop_number]["ip"] = responder_ip
-    route_taken[hop_number]["port"] = responder_port
-
-    hop_number += 1
-
-    if responder_ip == dest_ip and responder_port == dest_port:
-        break
+def milliseconds_now():
+    return time.monotonic() * 1000
+
+# one (source, dest) trace. the probe sent with time to live t is answered by hop t + 1, replies
+# holds the answer for every time to live that was answered or given up on, None for the latter
+class Trace:
+    def __init__(self, source_ip, source_port, dest_ip, dest_port, time_now):
+        self.source_ip = source_ip
+        self.source_port = source_port
+        self.dest_ip = dest_ip
+        self.dest_port = dest_port
+        self.replies = {} # { time to live: (ip, port) or None }
+        self.round_trip_times = {} # { time to live: milliseconds from sending the probe to its reply }
+        self.probe_ids = [] # every probe sent for the trace, answered or not
+        self.outstanding = {} # { time to live: timer of the probe waiting for a reply }
+        self.next_time_to_live = 0
+        self.dest_time_to_live = None # smallest time to live the dest answered
+        self.started = time_now
+        self.finished = None
+
+    # hop number -> { "ip", "port" } the way print_route wants it, None for hops that never answered
+    def route_taken(self):
+        last_time_to_live = self.dest_time_to_live if self.dest_time_to_live is not None else max(self.replies, default=-1)
+        route_taken = {}
+        for time_to_live in range(last_time_to_live + 1):
+            reply = self.replies.get(time_to_live)
+            route_taken[time_to_live + 1] = None if reply is None else {"ip": reply[0], "port": reply[1]}
+        return route_taken
+
+    # "ip:port" of every hop, None for hops that never answered
+    def hops(self):
+        return [None if hop is None else hop["ip"] + ':' + str(hop["port"]) for hop in self.route_taken().values()]
+
+    # round trip time in milliseconds to every hop, None for hops that never answered
+    def hop_round_trip_times(self):
+        return [self.round_trip_times.get(time_to_live) for time_to_live in range(len(self.route_taken()))]
+
+    def to_json(self):
+        return {
+            "source": self.source_ip + ':' + str(self.source_port),
+            "dest": self.dest_ip + ':' + str(self.dest_port),
+            "reached": self.dest_time_to_live is not None,
+            "hops": self.hops(),
+            "round_trip_times": [None if rtt is None else round(rtt, 3) for rtt in self.hop_round_trip_times()],
+            "milliseconds": round(self.finished - self.started, 3),
+        }
+
+# runs traces over one socket without waiting a round trip per hop: up to window probes of every
+# trace are out at the same time, each with its own timeout and retries, and replies are matched to
+# their probe by the probe id the emulators echo back in the sequence number
+# on_trace_finished is called with every trace once it is done, run() traces until all are done
+# a datagram that can't be parsed is counted in exceptions and skipped, record_exception is meant to
+# be the event loop's error handler too so nothing else ends the tracer either
+class Tracer:
+    def __init__(self, sock, routetrace_ip, routetrace_port, event_loop, window=16, max_hops=30, timeout=1000, retries=2, debug_option=0,
+                 on_trace_finished=None):
+        self.sock = sock
+        self.routetrace_ip = routetrace_ip
+        self.routetrace_port = routetrace_port
+        self.event_loop = event_loop
+        self.window = window
+        self.max_hops = max_hops
+        self.timeout = timeout
+        self.retries = retries
+        self.debug_option = debug_option
+        self.on_trace_finished = on_trace_finished
+        self.stop_when_done = False
+
+        self.probe_ids = itertools.count(1)
+        self.probes = {} # { probe id: (trace, time to live, time sent) }
+        self.traces = []
+        self.unfinished = 0
+
+        self.probes_sent = 0
+        self.probes_timed_out = 0
+        self.exceptions = collections.Counter() # { exception type name: count }
+
+    def record_exception(self, error):
+        self.exceptions[type(error).__name__] += 1
+
+    def trace(self, source_ip, source_port, dest_ip, dest_port):
+        trace = Trace(source_ip, source_port, dest_ip, dest_port, self.event_loop.time())
+        self.traces.append(trace)
+        self.unfinished += 1
+        self.send_more_probes(trace)
+        return trace
+
+    # fills the trace's window with probes for the next hops, up to the dest once a reply from it
+    # showed how long the path is
+    def send_more_probes(self, trace):
+        last_time_to_live = self.max_hops - 1 if trace.dest_time_to_live is None else trace.dest_time_to_live
+        while len(trace.outstanding) < self.window and trace.next_time_to_live <= last_time_to_live:
+            self.send_probe(trace, trace.next_time_to_live, 0)
+            trace.next_time_to_live += 1
+
+    def send_probe(self, trace, time_to_live, attempt):
+        probe_id = next(self.probe_ids) % PROBE_ID_MODULUS
+        self.probes[probe_id] = (trace, time_to_live, self.event_loop.time())
+        trace.probe_ids.append(probe_id)
+        trace.outstanding[time_to_live] = self.event_loop.call_later(self.timeout, lambda: self.on_probe_timeout(trace, time_to_live, attempt))
+        self.probes_sent += 1
+        send_packet(self.sock, trace.source_ip, trace.source_port, time_to_live, self.routetrace_ip, self.routetrace_port,
+                    trace.dest_ip, trace.dest_port, self.debug_option, probe_id)
+
+    def on_probe_timeout(self, trace, time_to_live, attempt):
+        self.probes_timed_out += 1
+        del trace.outstanding[time_to_live]
+        if attempt < self.retries:
+            self.send_probe(trace, time_to_live, attempt + 1)
+            return
+        trace.replies[time_to_live] = None
+        self.send_more_probes(trace)
+        self.finish_if_done(trace)
+
+    def on_socket_readable(self):
+        while True:
+            try:
+                packet_with_header, sender_address = self.sock.recvfrom(1024)
+            except BlockingIOError:
+                return
+            try:
+                self.handle_reply(packet_with_header)
+            except MALFORMED_PACKET_ERRORS as error:
+                self.record_exception(error)
+
+    def handle_reply(self, packet_with_header):
+        responder_ip, responder_port, probe_id = parse_packet(packet_with_header, self.debug_option)
+        probe = self.probes.pop(probe_id, None)
+        if probe is None:
+            return
+        trace, time_to_live, time_sent = probe
+        if trace.finished is not None or time_to_live in trace.replies:
+            # a late reply to a probe that was already sent again and answered
+            return
+
+        timer = trace.outstanding.pop(time_to_live, None)
+        if timer is not None:
+            timer.cancel()
+        trace.replies[time_to_live] = (responder_ip, responder_port)
+        trace.round_trip_times[time_to_live] = self.event_loop.time() - time_sent
+
+        if responder_ip == trace.dest_ip and responder_port == trace.dest_port:
+            if trace.dest_time_to_live is None or time_to_live < trace.dest_time_to_live:
+                trace.dest_time_to_live = time_to_live
+            # probes past the dest would only be answered by the dest again
+            for other_time_to_live in [other for other in trace.outstanding if other > time_to_live]:
+                trace.outstanding.pop(other_time_to_live).cancel()
+
+        self.send_more_probes(trace)
+        self.finish_if_done(trace)
+
+    # done once every hop up to the dest, or up to max_hops without it, has an answer or was
+    # given up on
+    def finish_if_done(self, trace):
+        if trace.finished is not None or len(trace.outstanding) > 0:
+            return
+        last_time_to_live = self.max_hops - 1 if trace.dest_time_to_live is None else trace.dest_time_to_live
+        if any(time_to_live not in trace.replies for time_to_live in range(last_time_to_live + 1)):
+            return
+
+        trace.finished = self.event_loop.time()
+        self.unfinished -= 1
+        for probe_id in trace.probe_ids:
+            self.probes.pop(probe_id, None)
+        if self.on_trace_finished is not None:
+            self.on_trace_finished(trace)
+        if self.unfinished == 0 and self.stop_when_done:
+            self.event_loop.stop()
+
+    def run(self):
+        if self.unfinished > 0:
+            self.stop_when_done = True
+            self.event_loop.run_forever()
+
+# "hostname,port hostname,port" per line, the source emulator and the dest of each trace
+def read_batch(filename):
+    pairs = []
+    with open(filename, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) == 0:
+                continue
+            source_hostname, source_port = fields[0].split(',')
+            dest_hostname, dest_port = fields[1].split(',')
+            pairs.append((socket.gethostbyname(source_hostname), int(source_port), socket.gethostbyname(dest_hostname), int(dest_port)))
+    return pairs
+
+def main():
+    args = parse_command_line_args()
+    routetrace_port = args.routetrace_port
+    debug_option = args.debug_option
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    routetrace_hostname = socket.gethostname()
+    routetrace_ip = socket.gethostbyname(routetrace_hostname)
+    sock.bind((routetrace_hostname, routetrace_port))
+    sock.setblocking(0)
+    #print('MY ADDRESS IS: ', routetrace_hostname, ':', routetrace_port)
+
+    event_loop = EventLoop(milliseconds_now)
+    tracer = Tracer(sock, routetrace_ip, routetrace_port, event_loop, args.window, args.max_hops, args.timeout, args.retries, debug_option)
+    event_loop.error_handler = tracer.record_exception
+    event_loop.add_reader(sock, tracer.on_socket_readable)
+
+    if args.batch is None:
+        source_ip = socket.gethostbyname(args.source_hostname)
+        dest_ip = socket.gethostbyname(args.dest_hostname)
+        trace = tracer.trace(source_ip, args.source_port, dest_ip, args.dest_port)
+        tracer.run()
+        print_route(trace.route_taken())
+        return
+
+    for source_ip, source_port, dest_ip, dest_port in read_batch(args.batch):
+        tracer.trace(source_ip, source_port, dest_ip, dest_port)
+    tracer.run()
+    routes = [trace.to_json() for trace in tracer.traces]
+    if args.output is None:
+        json.dump(routes, sys.stdout, indent=2)
+        print()
     else:
-        time_to_live += 1
+        with open(args.output, 'w') as file:
+            json.dump(routes, file, indent=2)
+    print('probes sent:', tracer.probes_sent, ', timed out:', tracer.probes_timed_out, ', exceptions:', dict(tracer.exceptions), file=sys.stderr)
 
-print_route(route_taken)
+if __name__ == '__main__':
+    main()
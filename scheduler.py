@@ -0,0 +1,168 @@
+import heapq
+import itertools
+import selectors
+import signal
+import socket
+
+# SPF throttling the way OSPF does it
+# the first change after a quiet period is recomputed after initial_delay, every change that
+# arrives while a recompute is pending is merged into it, and back to back recomputes are kept
+# at least hold apart, doubling hold each time up to max_hold
+# all times are in milliseconds
+class SpfThrottle:
+    def __init__(self, initial_delay, hold, max_hold):
+        self.initial_delay = initial_delay
+        self.hold = hold
+        self.max_hold = max_hold
+        self.current_hold = hold
+
+        self.deadline = None # set while a recompute is pending
+        self.last_run = None
+
+        self.runs = 0
+        self.coalesced = 0
+
+    # something changed that needs a recompute
+    def request(self, time_now):
+        if self.deadline is not None:
+            self.coalesced += 1
+            return
+
+        if self.last_run is None or time_now - self.last_run > self.max_hold:
+            # quiet for a while, start backing off from scratch again
+            self.current_hold = self.hold
+            self.deadline = time_now + self.initial_delay
+        else:
+            self.deadline = max(time_now + self.initial_delay, self.last_run + self.current_hold)
+            self.current_hold = min(self.current_hold * 2, self.max_hold)
+
+    def is_due(self, time_now):
+        return self.deadline is not None and time_now >= self.deadline
+
+    def ran(self, time_now):
+        self.deadline = None
+        self.last_run = time_now
+        self.runs += 1
+
+# a timer that was handed out by EventLoop.call_at, cancel() keeps it from firing
+class Timer:
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+# single threaded event loop: sockets are waited on with a selector and timers are kept in a
+# heap, so the loop sleeps in select() until a packet arrives or the next timer is due
+# clock returns the current time in milliseconds
+# error_handler is called with any exception a callback raises, without one the exception
+# propagates out of the loop
+class EventLoop:
+    def __init__(self, clock, error_handler=None):
+        self.clock = clock
+        self.error_handler = error_handler
+        self.selector = selectors.DefaultSelector()
+        self.timers = []
+        self.timer_sequence = itertools.count() # keeps timers with the same deadline in order
+        self.running = False
+        self.signal_handlers = {} # { signal number: callback }
+        self.signal_sockets = None
+
+        # how late timers fire compared to their deadline, in milliseconds
+        self.timers_fired = 0
+        self.total_timer_lateness = 0
+        self.max_timer_lateness = 0
+
+    def time(self):
+        return self.clock()
+
+    # callback is called with no arguments whenever sock has something to read
+    def add_reader(self, sock, callback):
+        self.selector.register(sock, selectors.EVENT_READ, callback)
+
+    def remove_reader(self, sock):
+        self.selector.unregister(sock)
+
+    # callback is called with no arguments whenever sock can be written to. a socket is either read
+    # from or written to by the loop, not both
+    def add_writer(self, sock, callback):
+        self.selector.register(sock, selectors.EVENT_WRITE, callback)
+
+    def remove_writer(self, sock):
+        self.selector.unregister(sock)
+
+    # callback is called with no arguments from the loop, not from inside the signal handler, every
+    # time signal_number arrives. the signal wakes select() up through a socket pair the
+    # interpreter writes the signal number to
+    def add_signal_handler(self, signal_number, callback):
+        if self.signal_sockets is None:
+            self.signal_sockets = socket.socketpair()
+            for sock in self.signal_sockets:
+                sock.setblocking(0)
+            signal.set_wakeup_fd(self.signal_sockets[1].fileno())
+            self.add_reader(self.signal_sockets[0], self.on_signal_socket_readable)
+        self.signal_handlers[signal_number] = callback
+        signal.signal(signal_number, lambda signal_number, frame: None)
+
+    def on_signal_socket_readable(self):
+        try:
+            signal_numbers = self.signal_sockets[0].recv(256)
+        except BlockingIOError:
+            return
+        for signal_number in signal_numbers:
+            callback = self.signal_handlers.get(signal_number)
+            if callback is not None:
+                self.run_callback(callback)
+
+    def call_at(self, deadline, callback):
+        timer = Timer(deadline, callback)
+        heapq.heappush(self.timers, (deadline, next(self.timer_sequence), timer))
+        return timer
+
+    def call_later(self, delay, callback):
+        return self.call_at(self.clock() + delay, callback)
+
+    # milliseconds until the next timer is due, None if there are no timers
+    def next_timeout(self, time_now):
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if not self.timers:
+            return None
+        return max(0, self.timers[0][0] - time_now)
+
+    def run_due_timers(self, time_now):
+        while self.timers and self.timers[0][0] <= time_now:
+            deadline, sequence, timer = heapq.heappop(self.timers)
+            if timer.cancelled:
+                continue
+            lateness = time_now - deadline
+            self.timers_fired += 1
+            self.total_timer_lateness += lateness
+            self.max_timer_lateness = max(self.max_timer_lateness, lateness)
+            self.run_callback(timer.callback)
+
+    def run_callback(self, callback):
+        if self.error_handler is None:
+            callback()
+            return
+        try:
+            callback()
+        except Exception as error:
+            self.error_handler(error)
+
+    def run_once(self):
+        timeout = self.next_timeout(self.clock())
+        events = self.selector.select(None if timeout is None else timeout / 1000)
+        for key, mask in events:
+            self.run_callback(key.data)
+        self.run_due_timers(self.clock())
+
+    def run_forever(self):
+        self.running = True
+        while self.running:
+            self.run_once()
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,526 @@
+import heapq
+import sys
+import zlib
+
+from packet import pack_node
+
+NO_PARENT = -1
+
+# the start node's neighbors that lie on a shortest path to node_index, as a sorted tuple of indexes
+# every predecessor of node_index on a shortest path hands down its own next hops, or node_index
+# itself when the predecessor is the start node
+# neighbors is an iterable of (neighbor_index, edge_distance)
+def equal_cost_next_hops(node_index, start_node, min_distance, neighbors, next_hops):
+    distance = min_distance[node_index]
+    if distance == sys.maxsize:
+        return None
+
+    # most nodes have a single predecessor, their next hops are that predecessor's tuple as is
+    hops = None
+    for neighbor_index, edge_distance in neighbors:
+        if min_distance[neighbor_index] + edge_distance == distance:
+            predecessor_hops = (node_index,) if neighbor_index == start_node else next_hops[neighbor_index]
+            if hops is None:
+                hops = predecessor_hops
+            elif hops != predecessor_hops:
+                hops = tuple(sorted(set(hops).union(predecessor_hops)))
+    return hops
+
+# next hops of every node, worked out in the order the nodes were settled so predecessors are
+# always done first
+# neighbors_of(node_index) returns the (neighbor_index, edge_distance) pairs of a node
+def construct_next_hops(start_node, min_distance, settled_order, neighbors_of):
+    next_hops = [None] * len(min_distance)
+    for node_index in settled_order:
+        if node_index != start_node:
+            next_hops[node_index] = equal_cost_next_hops(node_index, start_node, min_distance, neighbors_of(node_index), next_hops)
+    return next_hops
+
+# { dest: (next_hop, next_hop) }, every next hop that is on a shortest path to dest
+# nodes that can't be reached from the start node are left out of the table
+# most dests share their next hops with many others, they share the tuple too
+def construct_forwarding_table(start_node, next_hops, index_to_node_map):
+    forwarding_table = {}
+    named_hops = {} # { hops: the same next hops as nodes }
+    for node_index, hops in enumerate(next_hops):
+        if hops is not None and node_index != start_node:
+            names = named_hops.get(hops)
+            if names is None:
+                names = named_hops[hops] = tuple(index_to_node_map[hop] for hop in hops)
+            forwarding_table[index_to_node_map[node_index]] = names
+
+    return forwarding_table
+
+# picks the next hop of a flow among equal cost next hops
+# the hash is over the source and dest of the packet so a flow always takes the same path, and is
+# seeded with the node doing the picking so the nodes along a path don't all pick the same way
+def select_next_hop(next_hops, source_addr, dest_addr, my_addr):
+    if len(next_hops) == 1:
+        return next_hops[0]
+    return next_hops[flow_hash(pack_node(source_addr), pack_node(dest_addr), flow_hash_seed(my_addr)) % len(next_hops)]
+
+# the hash is over the packed nodes, see packet.pack_node, the way they are in the packet header,
+# so a router can pick without turning them into strings
+# crc32 is linear in its input bits, which made the low bits follow the similar addresses of
+# neighboring nodes, so it is multiplied out (fibonacci hashing) and the high bits are used
+def flow_hash(packed_source_node, packed_dest_node, seed):
+    return (zlib.crc32(packed_dest_node, zlib.crc32(packed_source_node, seed)) * 2654435761 & 0xffffffff) >> 16
+
+def flow_hash_seed(my_addr):
+    return zlib.crc32(pack_node(my_addr))
+
+def link_state_algorithm(adjacency_matrix, start_node, index_to_node_map):
+    num_nodes = len(adjacency_matrix)
+
+    # min_distance[i] holds the min distance from start node to i
+    min_distance = [sys.maxsize] * num_nodes
+    visited = [False] * num_nodes
+
+    for node_index in range(num_nodes):
+        min_distance[node_index] = sys.maxsize
+        visited[node_index] = False
+
+    min_distance[start_node] = 0
+
+    # parent array to store shortest path
+    parents = [-1] * num_nodes
+    parents[start_node] = NO_PARENT
+
+    settled_order = []
+
+    # picking the curr source node
+    for i in range(0, num_nodes):
+        nearest_node = -1 # holds the index of the picked/source node
+        shortest_distance = sys.maxsize
+        for node_index in range(num_nodes):
+            if not visited[node_index] and min_distance[node_index] < shortest_distance:
+                nearest_node = node_index
+                shortest_distance = min_distance[node_index]
+
+        if nearest_node == -1:
+            break # everything left is unreachable
+
+        visited[nearest_node] = True
+        settled_order.append(nearest_node)
+
+        # exploring and updating adjacent nodes to picked source node
+        for node_index in range(num_nodes):
+            edge_distance = adjacency_matrix[nearest_node][node_index]
+            # shortest dist refers to the shortest dist to reach the curr node at node_index from the starting node
+            if edge_distance > 0 and shortest_distance + edge_distance < min_distance[node_index]:
+                parents[node_index] = nearest_node
+                min_distance[node_index] = shortest_distance + edge_distance
+
+    neighbors_of = lambda node_index: [(neighbor_index, edge_distance) for neighbor_index, edge_distance in enumerate(adjacency_matrix[node_index]) if edge_distance > 0]
+    next_hops = construct_next_hops(start_node, min_distance, settled_order, neighbors_of)
+
+    forwarding_table = construct_forwarding_table(start_node, next_hops, index_to_node_map)
+    return forwarding_table
+
+# assign each ip:port node a number, the same way construct_adjacency_matrix does,
+# so both engines break ties between equal cost paths identically
+def index_nodes(network_topology):
+    index_to_node_map = {}
+    node_to_index_map = {}
+    index = 0
+    for node in network_topology:
+        node_to_index_map[node] = index
+        index_to_node_map[index] = node
+        index += 1
+
+    return index_to_node_map, node_to_index_map
+
+def construct_adjacency_matrix(network_topology):
+    num_nodes = len(network_topology)
+    index_to_node_map, node_to_index_map = index_nodes(network_topology)
+
+    adjacency_matrix = [[0 for column in range(num_nodes)]
+                      for row in range(num_nodes)]
+
+    for node in network_topology:
+        node_index = node_to_index_map[node]
+        neighboring_nodes = network_topology[node]
+        for neighbor, edge_distance in neighboring_nodes.items():
+            neighbor_index = node_to_index_map[neighbor]
+            # both ends can list the link with their own cost, the higher one is used
+            edge_distance = max(edge_distance, adjacency_matrix[node_index][neighbor_index])
+            adjacency_matrix[node_index][neighbor_index] = edge_distance
+            adjacency_matrix[neighbor_index][node_index] = edge_distance
+
+    #print('ADJACENCY MATRIX: ')
+    #print('\n'.join(['\t'.join([str(cell) for cell in row]) for row in adjacency_matrix]))
+    #print('done with constructing adjacency matrix')
+    return adjacency_matrix, index_to_node_map, node_to_index_map
+
+# adjacency_list[i] = { neighbor_index: edge_distance }
+# links are treated as bidirectional with the higher cost of both ends, same as in the adjacency matrix
+def construct_adjacency_list(network_topology):
+    graph = construct_adjacency_list_from_registry(network_topology)
+    if graph is not None:
+        return graph
+
+    index_to_node_map, node_to_index_map = index_nodes(network_topology)
+    adjacency_list = [{} for node_index in range(len(network_topology))]
+
+    for node in network_topology:
+        node_index = node_to_index_map[node]
+        for neighbor, edge_distance in network_topology[node].items():
+            neighbor_index = node_to_index_map[neighbor]
+            edge_distance = max(edge_distance, adjacency_list[node_index].get(neighbor_index, 0))
+            adjacency_list[node_index][neighbor_index] = edge_distance
+            adjacency_list[neighbor_index][node_index] = edge_distance
+
+    return adjacency_list, index_to_node_map, node_to_index_map
+
+# construct_adjacency_list of a LiveTopology straight from its registry's CSR arrays and availability
+# bytes, None when links are down or costs differ from the file and the live topology has to be
+# walked instead. every node keeps its registry id as its index, nodes that are down are left
+# without links, which numbers the nodes that are up in the same order index_nodes does
+def construct_adjacency_list_from_registry(live_topology):
+    registry = getattr(live_topology, 'registry', None)
+    if registry is None or len(live_topology.down_links) > 0 or len(live_topology.advertised_costs) > 0:
+        return None
+
+    available = live_topology.available
+    offsets = registry.offsets
+    neighbor_ids = registry.neighbor_ids
+    costs = registry.costs
+    adjacency_list = [{} for node_id in range(registry.num_topology_nodes)]
+    for node_id, neighbors in enumerate(adjacency_list):
+        if not available[node_id]:
+            continue
+        for link in range(offsets[node_id], offsets[node_id + 1]):
+            neighbor_id = neighbor_ids[link]
+            edge_distance = costs[link]
+            if available[neighbor_id] and edge_distance > neighbors.get(neighbor_id, 0):
+                neighbors[neighbor_id] = edge_distance
+                adjacency_list[neighbor_id][node_id] = edge_distance
+
+    return adjacency_list, registry.nodes, registry.ids
+
+# dijkstra over the adjacency list with a binary heap, O(E log V)
+# returns the distances, the parents and the order in which nodes were settled
+def heap_dijkstra(adjacency_list, start_node):
+    num_nodes = len(adjacency_list)
+    min_distance = [sys.maxsize] * num_nodes
+    parents = [NO_PARENT] * num_nodes
+    visited = [False] * num_nodes
+    settled_order = []
+
+    min_distance[start_node] = 0
+    # the heap is ordered by (distance, index) which is the same order the matrix
+    # engine picks the nearest node in, so ties resolve to the same parent
+    heap = [(0, start_node)]
+
+    while heap:
+        shortest_distance, nearest_node = heapq.heappop(heap)
+        if visited[nearest_node]:
+            continue
+        visited[nearest_node] = True
+        settled_order.append(nearest_node)
+
+        for node_index, edge_distance in adjacency_list[nearest_node].items():
+            distance = shortest_distance + edge_distance
+            if distance < min_distance[node_index]:
+                parents[node_index] = nearest_node
+                min_distance[node_index] = distance
+                heapq.heappush(heap, (distance, node_index))
+
+    return min_distance, parents, settled_order
+
+def heap_link_state_algorithm(adjacency_list, start_node, index_to_node_map):
+    min_distance, parents, settled_order = heap_dijkstra(adjacency_list, start_node)
+    next_hops = construct_next_hops(start_node, min_distance, settled_order, lambda node_index: adjacency_list[node_index].items())
+    return construct_forwarding_table(start_node, next_hops, index_to_node_map)
+
+# shortest path engines the emulator can be started with
+# each entry is (graph builder, algorithm) where the algorithm takes the output of the builder
+# 'incremental' computes from scratch like 'heap', the emulator then keeps an IncrementalSPF
+# around and patches the forwarding table from it on every change
+ENGINES = {
+    'matrix': (construct_adjacency_matrix, link_state_algorithm),
+    'heap': (construct_adjacency_list, heap_link_state_algorithm),
+    'incremental': (construct_adjacency_list, heap_link_state_algorithm),
+}
+
+# finds the shortest path between all nodes from source to dest
+# and returns an updated forwarding table
+def find_shortest_path_and_return_forwarding_table(my_addr, network_topology, engine='heap'):
+    construct_graph, algorithm = ENGINES[engine]
+    graph, index_to_node_map, node_to_index_map = construct_graph(network_topology)
+    starting_node = node_to_index_map[my_addr] # this should be the emulator's node
+    forwarding_table = algorithm(graph, starting_node, index_to_node_map)
+
+    return forwarding_table
+
+# loop-free alternates (rfc 5286): for every dest, a neighbor of the start node that isn't one of its
+# next hops and whose own shortest path to the dest doesn't lead back through the start node, so
+# packets can be handed to it the moment every next hop to the dest is down, before the routes are
+# recomputed. neighbor n is loop-free for dest d when dist(n, d) < dist(n, start) + dist(start, d)
+# and also gets around the next hop node p failing, not just the link to it, when
+# dist(n, d) < dist(n, p) + dist(p, d) for every next hop p. alternates that get around the node
+# are preferred, then the cheapest path through the alternate, then the lowest index
+# costs one shortest path run from every neighbor on top of the start node's own
+# returns backups[node index] = index of the alternate, None where there is none
+def loop_free_alternates(adjacency_list, start_node, min_distance, next_hops):
+    neighbors = adjacency_list[start_node]
+    distances_from = {neighbor: heap_dijkstra(adjacency_list, neighbor)[0] for neighbor in neighbors}
+    backups = [None] * len(adjacency_list)
+    for dest, hops in enumerate(next_hops):
+        if hops is None:
+            continue
+        best = None
+        for neighbor, edge_distance in neighbors.items():
+            if neighbor in hops:
+                continue
+            distance = distances_from[neighbor]
+            if distance[dest] >= distance[start_node] + min_distance[dest]:
+                continue
+            protects_node = all(distance[dest] < distance[hop] + distances_from[hop][dest] for hop in hops)
+            candidate = (not protects_node, edge_distance + distance[dest], neighbor)
+            if best is None or candidate < best:
+                best = candidate
+        if best is not None:
+            backups[dest] = best[2]
+    return backups
+
+# { dest: loop-free alternate next hop } for every dest that has one, see loop_free_alternates
+def find_loop_free_alternates(my_addr, network_topology):
+    adjacency_list, index_to_node_map, node_to_index_map = construct_adjacency_list(network_topology)
+    start_node = node_to_index_map[my_addr]
+    min_distance, parents, settled_order = heap_dijkstra(adjacency_list, start_node)
+    next_hops = construct_next_hops(start_node, min_distance, settled_order, lambda node_index: adjacency_list[node_index].items())
+    backups = loop_free_alternates(adjacency_list, start_node, min_distance, next_hops)
+    return {index_to_node_map[dest]: index_to_node_map[backup] for dest, backup in enumerate(backups) if backup is not None}
+
+# keeps the shortest path tree of the start node between topology changes
+# when a link or node goes down or comes back only the part of the tree that it touches is
+# recomputed, and only the forwarding table entries whose next hops changed are patched
+#
+# the tree is kept canonical: the parent of a node is always the predecessor on a shortest
+# path with the smallest (distance, index), which is exactly the parent heap_dijkstra picks.
+# the tree tells which nodes lose their distance when a link goes, the next hops come from all
+# equal cost predecessors like in a full run, so the table always matches a full recompute on the
+# same topology
+class IncrementalSPF:
+    def __init__(self, my_addr, network_topology):
+        adjacency_list, self.index_to_node_map, self.node_to_index_map = construct_adjacency_list(network_topology)
+        self.original_adjacency_list = adjacency_list
+        self.adjacency_list = [dict(neighbors) for neighbors in adjacency_list]
+        self.start_node = self.node_to_index_map[my_addr]
+        self.down_nodes = set()
+        self.down_links = set()
+
+        self.min_distance, self.parents, settled_order = heap_dijkstra(self.adjacency_list, self.start_node)
+        self.children = [set() for node_index in range(len(self.adjacency_list))]
+        for node_index, parent in enumerate(self.parents):
+            if parent != NO_PARENT:
+                self.children[parent].add(node_index)
+
+        self.next_hops = construct_next_hops(self.start_node, self.min_distance, settled_order, lambda node_index: self.adjacency_list[node_index].items())
+        # same entry order as a full run, later patches append to the end
+        self.forwarding_table = construct_forwarding_table(self.start_node, self.next_hops, self.index_to_node_map)
+
+    # marks a node as up or down and returns the forwarding table entries that changed
+    # { dest: (next_hop, next_hop) }, None when dest can no longer be reached
+    def set_node_available(self, node, available):
+        node_index = self.node_to_index_map[node]
+        if available == (node_index not in self.down_nodes):
+            return {}
+
+        if available:
+            self.down_nodes.discard(node_index)
+        else:
+            self.down_nodes.add(node_index)
+
+        stale_nodes = set()
+        for neighbor_index, edge_distance in self.original_adjacency_list[node_index].items():
+            if available and self.link_is_up(node_index, neighbor_index):
+                stale_nodes |= self.add_link(node_index, neighbor_index, edge_distance)
+            elif not available and neighbor_index in self.adjacency_list[node_index]:
+                stale_nodes |= self.remove_link(node_index, neighbor_index)
+
+        return self.update_next_hops(stale_nodes)
+
+    # marks a single link as up or down and returns the forwarding table entries that changed
+    # a link that comes back up keeps the cost it had unless edge_distance is given
+    def set_link_available(self, node_a, node_b, available, edge_distance=None):
+        a = self.node_to_index_map[node_a]
+        b = self.node_to_index_map[node_b]
+        link = frozenset((a, b))
+
+        if available:
+            self.down_links.discard(link)
+            if edge_distance is None:
+                edge_distance = self.original_adjacency_list[a].get(b, 1)
+            return self.set_link_cost(node_a, node_b, edge_distance)
+
+        self.down_links.add(link)
+        if b not in self.adjacency_list[a]:
+            return {}
+        return self.update_next_hops(self.remove_link(a, b))
+
+    # changes the cost of a link and returns the forwarding table entries that changed
+    # a link that is down only gets its cost remembered for when it comes back
+    def set_link_cost(self, node_a, node_b, edge_distance):
+        a = self.node_to_index_map[node_a]
+        b = self.node_to_index_map[node_b]
+        self.original_adjacency_list[a][b] = edge_distance
+        self.original_adjacency_list[b][a] = edge_distance
+        if not self.link_is_up(a, b) or self.adjacency_list[a].get(b) == edge_distance:
+            return {}
+
+        stale_nodes = set()
+        if b in self.adjacency_list[a]:
+            stale_nodes = self.remove_link(a, b)
+        stale_nodes |= self.add_link(a, b, edge_distance)
+        return self.update_next_hops(stale_nodes)
+
+    def link_is_up(self, a, b):
+        return a not in self.down_nodes and b not in self.down_nodes and frozenset((a, b)) not in self.down_links
+
+    # removes a link and returns the nodes whose next hop needs to be recomputed
+    def remove_link(self, a, b):
+        del self.adjacency_list[a][b]
+        del self.adjacency_list[b][a]
+
+        if self.parents[b] == a:
+            subtree_root = b
+        elif self.parents[a] == b:
+            subtree_root = a
+        else:
+            # not a tree link, no distance or parent changes, but both ends lost a path
+            return {a, b}
+
+        # everything below the link lost its path, detach it from the tree
+        affected_nodes = set()
+        stack = [subtree_root]
+        while stack:
+            node_index = stack.pop()
+            affected_nodes.add(node_index)
+            stack.extend(self.children[node_index])
+
+        for node_index in affected_nodes:
+            self.set_parent(node_index, NO_PARENT)
+            self.min_distance[node_index] = sys.maxsize
+
+        # reattach the detached nodes through whatever is left of the tree
+        heap = []
+        for node_index in affected_nodes:
+            for neighbor_index, edge_distance in self.adjacency_list[node_index].items():
+                if neighbor_index not in affected_nodes and self.min_distance[neighbor_index] != sys.maxsize:
+                    distance = self.min_distance[neighbor_index] + edge_distance
+                    if distance < self.min_distance[node_index]:
+                        self.min_distance[node_index] = distance
+            if self.min_distance[node_index] != sys.maxsize:
+                heap.append((self.min_distance[node_index], node_index))
+        heapq.heapify(heap)
+        self.propagate(heap, affected_nodes)
+
+        self.repair_parents(affected_nodes)
+        return affected_nodes | {a, b}
+
+    # adds a link and returns the nodes whose next hop needs to be recomputed
+    def add_link(self, a, b, edge_distance):
+        self.adjacency_list[a][b] = edge_distance
+        self.adjacency_list[b][a] = edge_distance
+
+        heap = []
+        for x, y in ((a, b), (b, a)):
+            if self.min_distance[x] != sys.maxsize and self.min_distance[x] + edge_distance < self.min_distance[y]:
+                self.min_distance[y] = self.min_distance[x] + edge_distance
+                heapq.heappush(heap, (self.min_distance[y], y))
+        decreased_nodes = self.propagate(heap, None)
+
+        # a node that got closer can become the preferred parent of any of its neighbors,
+        # and the new link itself can win a tie for a or b
+        candidates = {a, b}
+        for node_index in decreased_nodes:
+            candidates.add(node_index)
+            candidates.update(self.adjacency_list[node_index])
+
+        return self.repair_parents(candidates) | decreased_nodes | {a, b}
+
+    # dijkstra from the seeded heap, only lowering distances of nodes in allowed_nodes
+    # (or of any node when allowed_nodes is None), returns the nodes that were lowered
+    def propagate(self, heap, allowed_nodes):
+        lowered_nodes = set()
+        while heap:
+            distance, node_index = heapq.heappop(heap)
+            if distance > self.min_distance[node_index]:
+                continue
+            lowered_nodes.add(node_index)
+            for neighbor_index, edge_distance in self.adjacency_list[node_index].items():
+                if allowed_nodes is not None and neighbor_index not in allowed_nodes:
+                    continue
+                if distance + edge_distance < self.min_distance[neighbor_index]:
+                    self.min_distance[neighbor_index] = distance + edge_distance
+                    heapq.heappush(heap, (distance + edge_distance, neighbor_index))
+        return lowered_nodes
+
+    # picks the canonical parent of each candidate, returns the ones whose parent changed
+    def repair_parents(self, candidates):
+        changed_nodes = set()
+        for node_index in candidates:
+            if node_index == self.start_node:
+                continue
+            parent = NO_PARENT
+            distance = self.min_distance[node_index]
+            if distance != sys.maxsize:
+                for neighbor_index, edge_distance in self.adjacency_list[node_index].items():
+                    if self.min_distance[neighbor_index] + edge_distance == distance:
+                        if parent == NO_PARENT or (self.min_distance[neighbor_index], neighbor_index) < (self.min_distance[parent], parent):
+                            parent = neighbor_index
+            if parent != self.parents[node_index] or parent == NO_PARENT:
+                self.set_parent(node_index, parent)
+                changed_nodes.add(node_index)
+        return changed_nodes
+
+    def set_parent(self, node_index, parent):
+        old_parent = self.parents[node_index]
+        if old_parent != NO_PARENT:
+            self.children[old_parent].discard(node_index)
+        self.parents[node_index] = parent
+        if parent != NO_PARENT:
+            self.children[parent].add(node_index)
+
+    # recomputes the next hops of the given nodes and of their neighbors, which may have had them
+    # as a predecessor, then of every node further down a shortest path whose predecessor's next
+    # hops changed, and patches the forwarding table. returns the entries that changed
+    def update_next_hops(self, stale_nodes):
+        changed_entries = {}
+        queued = set(stale_nodes)
+        for node_index in stale_nodes:
+            queued.update(self.adjacency_list[node_index])
+
+        # predecessors are closer than the nodes after them, so they are done first
+        heap = [(self.min_distance[node_index], node_index) for node_index in queued]
+        heapq.heapify(heap)
+        while heap:
+            distance, node_index = heapq.heappop(heap)
+            if node_index == self.start_node:
+                continue
+            next_hops = equal_cost_next_hops(node_index, self.start_node, self.min_distance, self.adjacency_list[node_index].items(), self.next_hops)
+            if not self.set_next_hops(node_index, next_hops, changed_entries) or distance == sys.maxsize:
+                continue
+
+            for neighbor_index, edge_distance in self.adjacency_list[node_index].items():
+                if neighbor_index not in queued and self.min_distance[neighbor_index] == distance + edge_distance:
+                    queued.add(neighbor_index)
+                    heapq.heappush(heap, (self.min_distance[neighbor_index], neighbor_index))
+
+        return changed_entries
+
+    # returns True if the next hops of the node changed
+    def set_next_hops(self, node_index, next_hops, changed_entries):
+        dest = self.index_to_node_map[node_index]
+        if self.next_hops[node_index] == next_hops and (next_hops is None or dest in self.forwarding_table):
+            return False
+        self.next_hops[node_index] = next_hops
+        if next_hops is None:
+            self.forwarding_table.pop(dest, None)
+            changed_entries[dest] = None
+        else:
+            self.forwarding_table[dest] = tuple(self.index_to_node_map[hop] for hop in next_hops)
+            changed_entries[dest] = self.forwarding_table[dest]
+        return True
@@ -0,0 +1,434 @@
+import argparse
+import collections
+import functools
+import heapq
+import itertools
+import random
+import socket
+import time
+
+from emulator import HELLO_INTERVAL, LSP_INTERVAL, NEIGHBOR_DEADLINE, Router
+from liveness import read_link_timers
+from nodes import NodeRegistry
+from packet import Packet_Type, pack_header, pack_node, parse_header, peek_packet_type, socket_addresses
+from scheduler import Timer
+from shortest_path import ENGINES, find_shortest_path_and_return_forwarding_table
+from topology import LiveTopology, read_topology, synthetic_topology
+
+PACKET_TYPE_NAMES = {packet_type.value: packet_type.name.lower() for packet_type in Packet_Type}
+
+# same interface as scheduler.EventLoop, but time only moves when the next timer fires, so hours
+# of hellos and LSPs run as fast as the callbacks do
+# an exception in a callback goes straight out of run_until, a simulation shouldn't hide bugs
+class SimulatedEventLoop:
+    def __init__(self, start_time=0):
+        self.now = start_time
+        self.timers = []
+        self.timer_sequence = itertools.count() # keeps timers with the same deadline in order
+        self.events_run = 0
+
+    def time(self):
+        return self.now
+
+    def call_at(self, deadline, callback):
+        timer = Timer(deadline, callback)
+        heapq.heappush(self.timers, (deadline, next(self.timer_sequence), timer))
+        return timer
+
+    def call_later(self, delay, callback):
+        return self.call_at(self.now + delay, callback)
+
+    # runs every timer due up to end_time, the clock ends up at end_time
+    def run_until(self, end_time):
+        timers = self.timers
+        while timers and timers[0][0] <= end_time:
+            deadline, sequence, timer = heapq.heappop(timers)
+            if timer.cancelled:
+                continue
+            self.now = max(self.now, deadline)
+            self.events_run += 1
+            timer.callback()
+        self.now = max(self.now, end_time)
+
+# the routetrace tool Traffic probes from, an address no topology has
+TRAFFIC_NODE = '192.0.2.1:9'
+TRAFFIC_TIME_TO_LIVE = 64
+TRAFFIC_DRAIN_TIME = 1000 # milliseconds between the last probe and the end of the simulation
+ROUTE_TRACE = Packet_Type.ROUTE_TRACE.value
+
+# hostnames in a topology file are given made up addresses instead of being resolved, the packets
+# never leave the process. ips are kept as they are
+class VirtualAddresses(dict):
+    def __missing__(self, hostname):
+        try:
+            socket.inet_aton(hostname)
+            ip = hostname
+        except OSError:
+            index = len(self) + 1
+            ip = '172.' + str(16 + (index >> 16)) + '.' + str((index >> 8) & 255) + '.' + str(index & 255)
+        self[hostname] = ip
+        return ip
+
+# what a router sends on, everything goes through the fabric
+class FabricSocket:
+    def __init__(self, fabric, node):
+        self.fabric = fabric
+        self.node = node
+        self.address = socket_addresses[node]
+
+    def sendto(self, packet, address):
+        self.fabric.send(self, packet, address)
+
+# a udp network between the routers of a simulation: every packet arrives latency ms after it was
+# sent, give or take up to jitter ms, unless it is lost, which happens with probability loss
+# packets to a node that isn't attached, because it failed, are counted and dropped
+class Fabric:
+    def __init__(self, event_loop, latency=1, jitter=0, loss=0.0, seed=0):
+        self.event_loop = event_loop
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.routers = {} # { (ip, port): router }
+
+        # by packet type
+        self.sent = collections.Counter()
+        self.lost = collections.Counter()
+        self.undeliverable = collections.Counter()
+
+    def attach(self, node, router):
+        self.routers[socket_addresses[node]] = router
+
+    def detach(self, node):
+        self.routers.pop(socket_addresses[node], None)
+
+    def socket(self, node):
+        return FabricSocket(self, node)
+
+    def send(self, sock, packet, address):
+        packet_type = peek_packet_type(packet)
+        self.sent[packet_type] += 1
+        if self.loss > 0 and self.rng.random() < self.loss:
+            self.lost[packet_type] += 1
+            return
+
+        delay = self.latency
+        if self.jitter > 0:
+            delay += self.rng.uniform(0, self.jitter)
+        # the sender may change its buffer as soon as sendto returns, forwarded packets are
+        # decremented in place, so what goes on the wire is a copy
+        self.event_loop.call_later(delay, functools.partial(self.deliver, bytes(packet), sock.address, address, packet_type))
+
+    def deliver(self, packet, sender_address, address, packet_type):
+        router = self.routers.get(address)
+        if router is None:
+            self.undeliverable[packet_type] += 1
+            return
+        router.handle_packet(bytearray(packet), sender_address)
+
+# a routetrace tool on the fabric that sends a probe down every (ingress, dest) flow every interval
+# ms, what data traffic sees of a failure. a probe has time to live to spare and is answered by its
+# dest, or by the router its time to live ran out at if it got caught in a loop. a probe that is
+# never answered was lost on the way
+class Traffic:
+    def __init__(self, fabric, event_loop, flows, interval, node=TRAFFIC_NODE):
+        self.fabric = fabric
+        self.event_loop = event_loop
+        self.flows = [(socket_addresses[ingress], pack_node(dest)) for ingress, dest in flows]
+        self.interval = interval
+        self.packed_node = pack_node(node)
+        self.sock = fabric.socket(node)
+        fabric.attach(node, self)
+        self.timer = None
+
+        self.sent = 0
+        self.delivered = 0
+        self.looped = 0
+
+    def start(self):
+        self.on_traffic_timer()
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def on_traffic_timer(self):
+        self.timer = self.event_loop.call_later(self.interval, self.on_traffic_timer)
+        for ingress_address, packed_dest in self.flows:
+            self.sock.sendto(pack_header(ROUTE_TRACE, self.packed_node, self.sent, TRAFFIC_TIME_TO_LIVE, packed_dest), ingress_address)
+            self.sent += 1
+
+    # the answer to a probe comes from the router that answered it, with the probe's dest
+    def handle_packet(self, packet, sender_address):
+        packet_type, source_node, sequence_number, time_to_live, dest_node, header_size = parse_header(packet)
+        if source_node == dest_node:
+            self.delivered += 1
+        else:
+            self.looped += 1
+
+    def lost(self):
+        return self.sent - self.delivered - self.looped
+
+# every node of a topology as a Router on one fabric and one simulated clock
+# routers in route_nodes compute routes with engine, the others only run hellos, LSPs and flooding,
+# None means every router computes routes
+# with periodic_lsps=False routers only send LSPs when something changes, see Router
+# hello_interval, dead_interval and link_timers are the hello timers of every router, see Router
+# backup_next_hops has the routers precompute loop-free alternates and spf_initial_delay is how long
+# they wait before recomputing routes, see Router. recomputes take no simulated time, a bigger delay
+# stands in for a slow one too
+# with rtt_costs routers measure their links' round trip times and route with them, see Router. the
+# routes then follow the fabric's latency and jitter rather than the topology's costs, so they
+# aren't checked against a full recompute
+class Simulation:
+    def __init__(self, original_network_topology, engine='heap', route_nodes=None, periodic_lsps=True,
+                 latency=1, jitter=0, loss=0.0, seed=0, hello_interval=HELLO_INTERVAL, dead_interval=NEIGHBOR_DEADLINE, link_timers=None,
+                 backup_next_hops=False, spf_initial_delay=50, rtt_costs=False):
+        self.original_network_topology = original_network_topology
+        self.engine = engine
+        self.route_nodes = set(original_network_topology) if route_nodes is None else set(route_nodes)
+        self.lsp_interval = LSP_INTERVAL if periodic_lsps else None
+        self.hello_interval = hello_interval
+        self.dead_interval = dead_interval
+        self.link_timers = link_timers
+        self.backup_next_hops = backup_next_hops
+        self.spf_initial_delay = spf_initial_delay
+        self.rtt_costs = rtt_costs
+        self.rng = random.Random(seed)
+        self.event_loop = SimulatedEventLoop()
+        self.fabric = Fabric(self.event_loop, latency, jitter, loss, seed)
+        self.routers = {}
+        self.registry = NodeRegistry(original_network_topology)
+
+        # the nodes that are really up, what the routers' routes are checked against
+        self.network_topology = LiveTopology(original_network_topology)
+        self.last_event_time = 0
+        self.traffic = None
+
+    def create_router(self, node):
+        engine = self.engine if node in self.route_nodes else None
+        router = Router(node, self.original_network_topology, self.fabric.socket(node), self.event_loop, engine=engine,
+                        lsp_interval=self.lsp_interval, output=None, log=None, registry=self.registry,
+                        hello_interval=self.hello_interval, dead_interval=self.dead_interval, link_timers=self.link_timers,
+                        backup_next_hops=self.backup_next_hops, spf_initial_delay=self.spf_initial_delay, rtt_costs=self.rtt_costs)
+        self.routers[node] = router
+        self.fabric.attach(node, router)
+        return router
+
+    # routers start at random times within a hello interval, like emulators started by hand would
+    def start(self):
+        for node in self.original_network_topology:
+            router = self.create_router(node)
+            self.event_loop.call_at(self.rng.randrange(self.hello_interval), router.start)
+
+    def fail_node(self, node):
+        router = self.routers.pop(node, None)
+        if router is None:
+            return
+        router.stop()
+        self.fabric.detach(node)
+        self.network_topology.set_node_available(node, False)
+
+    # the node comes back with a fresh router, like a restarted emulator
+    def recover_node(self, node):
+        if node in self.routers:
+            return
+        self.network_topology.set_node_available(node, True)
+        self.create_router(node).start()
+
+    # probes flows, a list of (ingress, dest), every interval ms from start_time to stop_time, see Traffic
+    def add_traffic(self, flows, interval, start_time, stop_time):
+        self.traffic = Traffic(self.fabric, self.event_loop, flows, interval)
+        self.event_loop.call_at(start_time, self.traffic.start)
+        self.event_loop.call_at(stop_time, self.traffic.stop)
+
+    # script is a list of (time, action, node), action is 'fail' or 'recover'
+    def schedule(self, script):
+        actions = {'fail': self.fail_node, 'recover': self.recover_node}
+        for event_time, action, node in script:
+            self.event_loop.call_at(event_time, functools.partial(actions[action], node))
+            self.last_event_time = max(self.last_event_time, event_time)
+
+    def run_until(self, end_time):
+        self.event_loop.run_until(end_time)
+
+    # virtual time the last router recomputed its routes, None if no router ever had to
+    def last_route_change(self):
+        runs = [router.spf_throttle.last_run for router in self.routers.values() if router.spf_throttle.last_run is not None]
+        if len(runs) == 0:
+            return None
+        return max(runs)
+
+    # routers that compute routes and whose forwarding table differs from a full recompute over the
+    # nodes that are really up
+    def wrong_forwarding_tables(self):
+        wrong = []
+        for node, router in self.routers.items():
+            if node in self.route_nodes:
+                if router.forwarding_table != find_shortest_path_and_return_forwarding_table(node, self.network_topology, 'heap'):
+                    wrong.append(node)
+        return wrong
+
+    # (neighbors with a measured round trip time, neighbors) over every running router
+    def rtts_measured(self):
+        measured = 0
+        neighbors = 0
+        for router in self.routers.values():
+            for node in router.neighbors:
+                neighbors += 1
+                if router.neighbors[node].smoothed_rtt is not None:
+                    measured += 1
+        return measured, neighbors
+
+    def forwarding_tables(self):
+        return {node: router.forwarding_table for node, router in self.routers.items() if node in self.route_nodes}
+
+    def report(self):
+        last_route_change = self.last_route_change()
+        if last_route_change is None or last_route_change < self.last_event_time:
+            convergence_time = None
+        else:
+            convergence_time = last_route_change - self.last_event_time
+        return {
+            "time": self.event_loop.time(),
+            "events": self.event_loop.events_run,
+            "last_route_change": last_route_change,
+            "convergence_time": convergence_time,
+            "sent": {PACKET_TYPE_NAMES[packet_type]: count for packet_type, count in self.fabric.sent.items()},
+            "lost": sum(self.fabric.lost.values()),
+            "undeliverable": sum(self.fabric.undeliverable.values()),
+            "wrong_forwarding_tables": None if self.rtt_costs else len(self.wrong_forwarding_tables()),
+            "rtts_measured": self.rtts_measured(),
+            "backup_forwards": sum(router.metrics.backup_forwards for router in self.routers.values()),
+            "traffic": None if self.traffic is None else {
+                "sent": self.traffic.sent,
+                "delivered": self.traffic.delivered,
+                "looped": self.traffic.looped,
+                "lost": self.traffic.lost(),
+            },
+        }
+
+# a scenario file has one event per line: time in milliseconds, fail or recover, and the node the
+# way the topology file writes it, "hostname,port". lines starting with # are comments
+# 10000 fail snares-03,3000
+# 20000 recover snares-03,3000
+def read_script(filename, resolve):
+    script = []
+    with open(filename, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith('#'):
+                continue
+            hostname, port = fields[2].split(',')[:2]
+            script.append((int(fields[0]), fields[1], resolve(hostname) + ':' + port))
+    return script
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-f', '--filename', help='the name of the topology file', type=str)
+    parser.add_argument('-g', '--generate', help='simulate a random topology with this many nodes instead of a topology file', type=int)
+    parser.add_argument('-d', '--degree', help='average number of neighbors per node of the random topology', default=4, type=int)
+    parser.add_argument('-s', '--script', help='scenario file of node failures and recoveries, see read_script', type=str)
+    parser.add_argument('-k', '--kill', help='number of random nodes to fail at --fail_at', default=0, type=int)
+    parser.add_argument('-t', '--fail_at', help='milliseconds into the simulation the random nodes fail', default=5000, type=int)
+    parser.add_argument('-u', '--duration', help='milliseconds to keep simulating after the last scripted event', default=10000, type=int)
+    parser.add_argument('-e', '--engine', help='the shortest path engine routers compute routes with', choices=list(ENGINES), default='heap', type=str)
+    parser.add_argument('-w', '--watch', help='only this many random routers compute routes, the rest run the protocol without', default=None, type=int)
+    parser.add_argument('-p', '--no_periodic_lsps', help='routers only send LSPs on changes, needed for topologies of thousands of nodes', action='store_true')
+    parser.add_argument('-l', '--latency', help='milliseconds a packet takes from one router to the next', default=1, type=float)
+    parser.add_argument('-j', '--jitter', help='up to this many milliseconds are added to the latency of each packet', default=0, type=float)
+    parser.add_argument('-x', '--loss', help='probability a packet is lost', default=0.0, type=float)
+    parser.add_argument('-r', '--seed', help='random seed for the topology, failures and the fabric', default=1, type=int)
+    parser.add_argument('-o', '--output', help='write the final forwarding tables of the routers that compute routes to this file', type=str)
+    parser.add_argument('-H', '--hello_interval', help='milliseconds between two hellos to a neighbor', default=HELLO_INTERVAL, type=int)
+    parser.add_argument('-D', '--dead_interval', help='a neighbor is down after this many milliseconds without a hello from it', default=NEIGHBOR_DEADLINE, type=int)
+    parser.add_argument('-b', '--backup_next_hops', help='routers precompute loop-free alternates and switch to them as soon as a next hop is found down', action='store_true')
+    parser.add_argument('-S', '--spf_initial_delay', help='milliseconds routers wait after a topology change before recomputing routes, recomputes take no simulated time so this stands in for a slow one too', default=50, type=int)
+    parser.add_argument('-n', '--flows', help='random flows between nodes that never fail to send probes down, to count the packets failures lose', default=0, type=int)
+    parser.add_argument('-i', '--traffic_interval', help='milliseconds between two probes of a flow', default=10, type=int)
+    parser.add_argument('-R', '--rtt_costs', help='routers use the measured round trip time to each neighbor as the link cost', action='store_true')
+    parser.add_argument('-L', '--link_timers', help='file of per link hello and dead intervals, see liveness.read_link_timers', type=str)
+
+    args = parser.parse_args()
+    if (args.filename is None) == (args.generate is None):
+        parser.error('one of -f/--filename or -g/--generate is required')
+    return args
+
+def write_forwarding_tables(forwarding_tables, file):
+    for node, forwarding_table in forwarding_tables.items():
+        print(node, file=file)
+        for dest, next_hops in forwarding_table.items():
+            print('   ', dest, ' '.join(next_hops), file=file)
+
+def main():
+    args = parse_command_line_args()
+    rng = random.Random(args.seed)
+    resolve = VirtualAddresses().__getitem__
+    if args.filename is not None:
+        original_network_topology = read_topology(args.filename, resolve=resolve, resolve_workers=1)
+    else:
+        original_network_topology = synthetic_topology(args.generate, args.degree, args.seed)
+    nodes = list(original_network_topology)
+
+    script = []
+    if args.script is not None:
+        script += read_script(args.script, resolve)
+    link_timers = None
+    if args.link_timers is not None:
+        link_timers = read_link_timers(args.link_timers, resolve=resolve, resolve_workers=1)
+    script += [(args.fail_at, 'fail', node) for node in rng.sample(nodes, args.kill)]
+
+    route_nodes = None
+    if args.watch is not None:
+        route_nodes = rng.sample(nodes, min(args.watch, len(nodes)))
+    # flows only run between routers that route and never fail, what they lose is lost on the way
+    scripted_nodes = set(node for event_time, action, node in script)
+    flow_nodes = [node for node in nodes if node not in scripted_nodes and (route_nodes is None or node in route_nodes)]
+    flows = []
+    if len(flow_nodes) >= 2:
+        flows = [tuple(rng.sample(flow_nodes, 2)) for i in range(args.flows)]
+
+    start = time.perf_counter()
+    simulation = Simulation(original_network_topology, args.engine, route_nodes, not args.no_periodic_lsps,
+                            args.latency, args.jitter, args.loss, args.seed, args.hello_interval, args.dead_interval, link_timers,
+                            args.backup_next_hops, args.spf_initial_delay, args.rtt_costs)
+    simulation.start()
+    simulation.schedule(script)
+    end_time = simulation.last_event_time + args.duration
+    if len(flows) > 0:
+        # from when every router has started until the last probes have had time to arrive
+        simulation.add_traffic(flows, args.traffic_interval, HELLO_INTERVAL, end_time - TRAFFIC_DRAIN_TIME)
+    simulation.run_until(end_time)
+    report = simulation.report()
+    wall_time = time.perf_counter() - start
+
+    print('nodes:', len(nodes), ', routers computing routes:', len(simulation.route_nodes), ', scripted events:', len(script))
+    print('simulated', '%.0f' % report["time"], 'ms in', '%.1f' % wall_time, 's of wall time,', report["events"], 'events')
+    if report["convergence_time"] is None:
+        print('no routes changed after the last scripted event')
+    else:
+        print('converged', '%.0f' % report["convergence_time"], 'ms after the last scripted event, at', '%.0f' % report["last_route_change"], 'ms')
+    print('packets sent:', ', '.join(name + ' ' + str(count) for name, count in sorted(report["sent"].items())))
+    print('packets lost:', report["lost"], ', to failed nodes:', report["undeliverable"])
+    if report["wrong_forwarding_tables"] is None:
+        print('forwarding tables not checked, routes follow the measured round trip times')
+    else:
+        print('forwarding tables that differ from a full recompute:', report["wrong_forwarding_tables"])
+    if args.rtt_costs:
+        measured, neighbors = report["rtts_measured"]
+        print('neighbors with a measured round trip time:', measured, 'of', neighbors)
+    traffic = report["traffic"]
+    if traffic is not None:
+        failures = sum(1 for event_time, action, node in script if action == 'fail')
+        print('probes sent:', traffic["sent"], ', delivered:', traffic["delivered"], ', caught in loops:', traffic["looped"],
+              ', lost:', traffic["lost"], ', lost per failure:', '%.1f' % (traffic["lost"] / failures) if failures > 0 else '-',
+              ', sent to backup next hops:', report["backup_forwards"])
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            write_forwarding_tables(simulation.forwarding_tables(), file)
+
+if __name__ == '__main__':
+    main()
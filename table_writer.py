@@ -0,0 +1,134 @@
+import json
+import time
+
+OUTPUT_MODES = ('full', 'diff', 'json')
+
+def get_ip_and_port_from_full_addr(full_addr):
+    ip = full_addr.split(':')[0]
+    port = full_addr.split(':')[1]
+    return ip, port
+
+def wall_time_in_milliseconds_now():
+    return round(time.time() * 1000)
+
+# "ip,port" the way the topology file writes a node
+def format_node(node):
+    ip, port = get_ip_and_port_from_full_addr(node)
+    return ip + ',' + port
+
+# the topology and forwarding table as one string, so it goes out in a single write
+def format_topology_and_forwarding_table(network_topology, forwarding_table):
+    lines = ['Topology:', '']
+    for node in network_topology:
+        fields = [format_node(node)]
+        for neighbor, cost in network_topology[node].items():
+            if cost == 1:
+                fields.append(format_node(neighbor))
+            else:
+                fields.append(format_node(neighbor) + ',' + str(cost))
+        lines.append(' '.join(fields) + ' ')
+
+    lines += ['', 'Forwarding table:', '']
+    for node, next_hops in forwarding_table.items():
+        # every equal cost next hop
+        lines.append(' '.join([format_node(node)] + [format_node(next_hop) for next_hop in next_hops]) + ' ')
+    lines.append('')
+    return '\n'.join(lines) + '\n'
+
+# only the entries that changed, a dest that can't be reached anymore gets a -
+def format_forwarding_table_changes(changed_entries, removed_dests):
+    lines = ['Forwarding table changes:', '']
+    for node, next_hops in changed_entries.items():
+        lines.append(' '.join([format_node(node)] + [format_node(next_hop) for next_hop in next_hops]) + ' ')
+    for node in removed_dests:
+        lines.append(format_node(node) + ' - ')
+    lines.append('')
+    return '\n'.join(lines) + '\n'
+
+# writes a router's topology and forwarding table to file whenever its routes change
+# - full: the whole topology and forwarding table every time, what the emulator always printed
+# - diff: the whole thing once, then only the forwarding table entries that changed since the
+#   last write
+# - json: like diff, as one json object per line
+# writes are at least interval milliseconds apart, changes in between are merged into the next
+# write, so a route that flapped and came back isn't written at all. write_full() writes
+# everything right away whatever the mode
+# json records carry the wall clock time in milliseconds since the epoch, the event loop's clock
+# may be monotonic and mean nothing outside the process
+class TableWriter:
+    def __init__(self, file, event_loop, my_addr, mode='full', interval=0):
+        self.file = file
+        self.event_loop = event_loop
+        self.my_addr = my_addr
+        self.mode = mode
+        self.interval = interval
+
+        self.network_topology = None
+        self.forwarding_table = None
+        self.written_forwarding_table = None # a copy of the table as it was last written
+        self.last_write = None
+        self.timer = None
+
+        self.writes = 0
+        self.bytes_written = 0
+
+    def routes_changed(self, network_topology, forwarding_table):
+        self.network_topology = network_topology
+        self.forwarding_table = forwarding_table
+        if self.timer is not None:
+            return
+
+        time_now = self.event_loop.time()
+        if self.interval <= 0 or self.last_write is None or time_now - self.last_write >= self.interval:
+            self.write_changes()
+        else:
+            self.timer = self.event_loop.call_at(self.last_write + self.interval, self.on_write_timer)
+
+    def on_write_timer(self):
+        self.timer = None
+        self.write_changes()
+
+    def write_changes(self):
+        self.last_write = self.event_loop.time()
+        if self.mode == 'full' or self.written_forwarding_table is None:
+            self.write_full()
+            return
+
+        written_forwarding_table = self.written_forwarding_table
+        changed_entries = {dest: next_hops for dest, next_hops in self.forwarding_table.items() if written_forwarding_table.get(dest) != next_hops}
+        removed_dests = [dest for dest in written_forwarding_table if dest not in self.forwarding_table]
+        if len(changed_entries) == 0 and len(removed_dests) == 0:
+            return
+
+        if self.mode == 'json':
+            text = json.dumps({
+                "time": wall_time_in_milliseconds_now(),
+                "router": self.my_addr,
+                "changed": changed_entries,
+                "removed": removed_dests,
+            }) + '\n'
+        else:
+            text = format_forwarding_table_changes(changed_entries, removed_dests)
+        self.write(text)
+        self.written_forwarding_table = dict(self.forwarding_table)
+
+    def write_full(self):
+        if self.forwarding_table is None:
+            return
+        if self.mode == 'json':
+            text = json.dumps({
+                "time": wall_time_in_milliseconds_now(),
+                "router": self.my_addr,
+                "topology": {node: dict(self.network_topology[node].items()) for node in self.network_topology},
+                "forwarding_table": self.forwarding_table,
+            }) + '\n'
+        else:
+            text = format_topology_and_forwarding_table(self.network_topology, self.forwarding_table)
+        self.write(text)
+        self.written_forwarding_table = dict(self.forwarding_table)
+
+    def write(self, text):
+        self.file.write(text)
+        self.file.flush()
+        self.writes += 1
+        self.bytes_written += len(text)
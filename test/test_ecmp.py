@@ -0,0 +1,86 @@
+import math
+import os
+import random
+
+import pytest
+
+from benchmark import walk_flow
+from shortest_path import construct_adjacency_list, find_shortest_path_and_return_forwarding_table, heap_dijkstra, select_next_hop
+from simulator import VirtualAddresses
+from topology import read_topology, synthetic_node, synthetic_topology
+
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# flows with a random source per ingress node and dest
+FLOWS = 1000
+# how far the flows a next hop gets may be from an even split, in standard deviations of the split
+# a uniformly random pick would give
+SPREAD_BOUND = 4
+
+# { node: { dest: distance } } of every pair
+def all_distances(network_topology):
+    adjacency_list, index_to_node_map, node_to_index_map = construct_adjacency_list(network_topology)
+    distances = {}
+    for node in network_topology:
+        min_distance = heap_dijkstra(adjacency_list, node_to_index_map[node])[0]
+        distances[node] = {index_to_node_map[index]: distance for index, distance in enumerate(min_distance)}
+    return distances
+
+def check_equal_cost_routes(network_topology, flows=FLOWS):
+    nodes = list(network_topology)
+    distances = all_distances(network_topology)
+    forwarding_tables = {node: find_shortest_path_and_return_forwarding_table(node, network_topology, 'heap') for node in nodes}
+
+    # the next hops of every dest are exactly the neighbors a shortest path to it starts with
+    for node in nodes:
+        for dest, next_hops in forwarding_tables[node].items():
+            shortest_next_hops = {neighbor for neighbor, cost in network_topology[node].items() if cost + distances[neighbor][dest] == distances[node][dest]}
+            assert set(next_hops) == shortest_next_hops, (node, dest)
+
+    # every flow stays on a shortest path, and every node with a choice splits flows about evenly
+    rng = random.Random(1)
+    picks = {}
+    for ingress in nodes:
+        for dest in forwarding_tables[ingress]:
+            for flow in range(flows):
+                source_addr = synthetic_node(rng.randrange(1 << 24))
+                assert select_next_hop(forwarding_tables[ingress][dest], source_addr, dest, ingress) in forwarding_tables[ingress][dest]
+                assert walk_flow(network_topology, forwarding_tables, source_addr, ingress, dest, picks) == distances[ingress][dest]
+
+    for (node, dest), node_picks in picks.items():
+        total_flows = sum(node_picks.values())
+        fair_share = total_flows / len(node_picks)
+        deviation = math.sqrt(total_flows * (1 / len(node_picks)) * (1 - 1 / len(node_picks)))
+        for next_hop, next_hop_flows in node_picks.items():
+            assert abs(next_hop_flows - fair_share) <= SPREAD_BOUND * deviation, (node, dest, node_picks)
+    return picks
+
+# the test topologies have a few nodes with two equal cost next hops to a dest
+@pytest.mark.parametrize('filename', ['topology.txt', 'topology2.txt'])
+def test_test_topologies(filename):
+    # flows are hashed over packed addresses, hostnames get made up ones like in the simulator
+    network_topology = read_topology(os.path.join(TEST_DIRECTORY, filename), resolve=VirtualAddresses().__getitem__, resolve_workers=1)
+    picks = check_equal_cost_routes(network_topology)
+    assert len(picks) > 0
+
+# four equal cost paths from the first node to the last and a fifth that is one hop longer
+def test_fan():
+    nodes = [synthetic_node(index) for index in range(8)]
+    first, last = nodes[0], nodes[5]
+    network_topology = {node: {} for node in nodes}
+    def add_link(a, b, cost):
+        network_topology[a][b] = cost
+        network_topology[b][a] = cost
+    for middle in nodes[1:5]:
+        add_link(first, middle, 2)
+        add_link(middle, last, 3)
+    add_link(first, nodes[6], 1)
+    add_link(nodes[6], nodes[7], 2)
+    add_link(nodes[7], last, 3)
+
+    assert find_shortest_path_and_return_forwarding_table(first, network_topology, 'heap')[last] == tuple(nodes[1:5])
+    picks = check_equal_cost_routes(network_topology)
+    assert sorted(picks[(first, last)]) == sorted(nodes[1:5])
+
+@pytest.mark.parametrize('max_cost', [1, 3])
+def test_random_topology(max_cost):
+    check_equal_cost_routes(synthetic_topology(20, 4, 1, max_cost), flows=200)
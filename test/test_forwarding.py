@@ -0,0 +1,105 @@
+import pytest
+
+from emulator import Router
+from packet import HEADER_FORMATS, PacketCache, Packet_Type, decrement_time_to_live, encode_lsp_payload, pack_node, parse_header, socket_addresses
+from simulator import SimulatedEventLoop
+from topology import synthetic_node, synthetic_topology
+
+LINK_STATE_MESSAGE = Packet_Type.LINK_STATE_MESSAGE.value
+ROUTE_TRACE = Packet_Type.ROUTE_TRACE.value
+
+SOURCE_NODE = pack_node(synthetic_node(1))
+DEST_NODE = pack_node(synthetic_node(2))
+PAYLOAD = encode_lsp_payload({synthetic_node(index): index for index in range(1, 101)})
+
+# keeps every packet a router sends, as the bytes they were when sent
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, packet, address):
+        self.sent.append((bytes(packet), address))
+
+def build_packet(header_format, packet_type, time_to_live, payload=PAYLOAD):
+    return bytearray(HEADER_FORMATS[header_format](packet_type, SOURCE_NODE, 7, time_to_live, DEST_NODE) + payload)
+
+# the parsed header of packet with its time to live left out, and its payload
+def header_without_ttl_and_payload(packet):
+    packet_type, source_node, sequence_number, time_to_live, dest_node, payload_offset = parse_header(packet)
+    return (packet_type, source_node, sequence_number, dest_node), bytes(packet[payload_offset:])
+
+@pytest.mark.parametrize('header_format', HEADER_FORMATS)
+@pytest.mark.parametrize('time_to_live', [1, 2, 20, 255])
+@pytest.mark.parametrize('as_memoryview', [False, True])
+def test_decrement_time_to_live(header_format, time_to_live, as_memoryview):
+    packet = build_packet(header_format, LINK_STATE_MESSAGE, time_to_live)
+    original = bytes(packet)
+    forwarded = decrement_time_to_live(memoryview(packet) if as_memoryview else packet)
+
+    assert parse_header(forwarded)[3] == time_to_live - 1
+    assert header_without_ttl_and_payload(forwarded) == header_without_ttl_and_payload(original)
+    assert header_without_ttl_and_payload(forwarded)[1] == PAYLOAD
+    # in place, the packet itself changed and only in the time to live
+    assert len(packet) == len(original)
+    assert sum(1 for a, b in zip(packet, original) if a != b) == 1
+
+@pytest.mark.parametrize('header_format', HEADER_FORMATS)
+def test_decrement_time_to_live_at_zero(header_format):
+    packet = build_packet(header_format, ROUTE_TRACE, 0, b'')
+    original = bytes(packet)
+    with pytest.raises(ValueError):
+        decrement_time_to_live(packet)
+    assert packet == original
+
+def router_at_first_node(header_format):
+    network_topology = synthetic_topology(50, 4, 1)
+    nodes = list(network_topology)
+    sock = RecordingSocket()
+    router = Router(nodes[0], network_topology, sock, SimulatedEventLoop(), header_format=header_format, output=None, log=None)
+    return router, sock, network_topology, nodes
+
+# routetrace packets from a tool outside the topology are forwarded with one hop less, or answered
+# once no hops are left
+@pytest.mark.parametrize('header_format', HEADER_FORMATS)
+@pytest.mark.parametrize('time_to_live', [0, 1, 5])
+def test_router_forwards_routetrace(header_format, time_to_live):
+    router, sock, network_topology, nodes = router_at_first_node(header_format)
+    dest = next(node for node in nodes if node not in network_topology[nodes[0]] and node != nodes[0])
+    tool_node = pack_node('127.0.0.1:9')
+    packet = bytearray(HEADER_FORMATS[header_format](ROUTE_TRACE, tool_node, 3, time_to_live, pack_node(dest)) + b'probe')
+    original = bytes(packet)
+    router.handle_packet(packet, ('127.0.0.1', 9))
+
+    assert len(sock.sent) == 1
+    sent, address = sock.sent[0]
+    packet_type, source_node, sequence_number, sent_time_to_live, dest_node, payload_offset = parse_header(sent)
+    if time_to_live == 0:
+        # the answer goes back to the tool from this router
+        assert address == ('127.0.0.1', 9)
+        assert source_node == pack_node(nodes[0])
+        assert (packet_type, sequence_number, sent_time_to_live, dest_node) == (ROUTE_TRACE, 3, 0, pack_node(dest))
+    else:
+        assert address in [socket_addresses[hop] for hop in router.forwarding_table[dest]]
+        assert sent_time_to_live == time_to_live - 1
+        assert header_without_ttl_and_payload(sent) == header_without_ttl_and_payload(original)
+        assert sent[payload_offset:] == b'probe'
+
+# LSPs are flooded with one hop less and the payload as it came in, and not at all once no hops are left
+@pytest.mark.parametrize('header_format', HEADER_FORMATS)
+@pytest.mark.parametrize('time_to_live', [0, 1, 20])
+def test_router_floods_lsp(header_format, time_to_live):
+    router, sock, network_topology, nodes = router_at_first_node(header_format)
+    neighbors = list(network_topology[nodes[0]])
+    origin = next(node for node in network_topology[neighbors[0]] if node != nodes[0])
+    packet = bytearray(PacketCache(HEADER_FORMATS[header_format], pack_node(origin)).link_state_packet(1, time_to_live, network_topology[origin]))
+    original = bytes(packet)
+    router.handle_packet(packet, socket_addresses[neighbors[0]])
+
+    if time_to_live == 0:
+        assert sock.sent == []
+        return
+    expected_addresses = [socket_addresses[neighbor] for neighbor in neighbors if neighbor != neighbors[0] and neighbor != origin]
+    assert [address for sent, address in sock.sent] == expected_addresses
+    for sent, address in sock.sent:
+        assert parse_header(sent)[3] == time_to_live - 1
+        assert header_without_ttl_and_payload(sent) == header_without_ttl_and_payload(original)
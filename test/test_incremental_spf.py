@@ -0,0 +1,86 @@
+import os
+import random
+import sys
+
+import pytest
+
+from benchmark import random_flap, topology_without
+from shortest_path import IncrementalSPF, construct_adjacency_list, find_shortest_path_and_return_forwarding_table, heap_dijkstra
+from topology import read_topology, synthetic_topology
+
+TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TOPOLOGY_FILES = ['topology.txt', 'topology2.txt']
+EVENTS = 300
+
+# { node: distance } of every node the start node can reach
+def reachable_distances(min_distance, index_to_node_map):
+    return {index_to_node_map[node_index]: distance for node_index, distance in enumerate(min_distance) if distance != sys.maxsize}
+
+# the same topology with every link given a random cost between 1 and max_cost, the same both ways
+def with_random_costs(network_topology, rng, max_cost):
+    weighted_topology = {node: {} for node in network_topology}
+    for node, neighbors in network_topology.items():
+        for neighbor in neighbors:
+            if neighbor not in weighted_topology[node]:
+                cost = rng.randint(1, max_cost)
+                weighted_topology[node][neighbor] = cost
+                weighted_topology[neighbor][node] = cost
+    return weighted_topology
+
+# replays seeded random node and link flaps, and cost changes when max_cost is above 1, from every
+# node of the topology, and checks the patched table and the distances against a full recompute
+# after every event, and that the entries handed back are exactly the ones that changed
+def replay_flaps(network_topology, seed, max_cost):
+    rng = random.Random(seed)
+    nodes = list(network_topology)
+    for my_addr in nodes[:10]:
+        spf = IncrementalSPF(my_addr, network_topology)
+        down_nodes = set()
+        down_links = set()
+        assert spf.forwarding_table == find_shortest_path_and_return_forwarding_table(my_addr, network_topology, 'heap')
+
+        for event in range(EVENTS // min(10, len(nodes))):
+            old_table = dict(spf.forwarding_table)
+            kind, node, neighbor, available = random_flap(rng, network_topology, nodes, my_addr, down_nodes, down_links, max_cost)
+            if kind == 'node':
+                changed_entries = spf.set_node_available(node, available)
+            elif kind == 'cost':
+                changed_entries = spf.set_link_cost(node, neighbor, available)
+            else:
+                changed_entries = spf.set_link_available(node, neighbor, available)
+
+            live_topology = topology_without(network_topology, down_nodes, down_links)
+            assert spf.forwarding_table == find_shortest_path_and_return_forwarding_table(my_addr, live_topology, 'heap'), (kind, node, neighbor, available)
+
+            adjacency_list, index_to_node_map, node_to_index_map = construct_adjacency_list(live_topology)
+            min_distance = heap_dijkstra(adjacency_list, node_to_index_map[my_addr])[0]
+            assert reachable_distances(spf.min_distance, spf.index_to_node_map) == reachable_distances(min_distance, index_to_node_map)
+
+            for dest, next_hops in changed_entries.items():
+                if next_hops is None:
+                    old_table.pop(dest, None)
+                else:
+                    old_table[dest] = next_hops
+            assert old_table == spf.forwarding_table
+
+@pytest.mark.parametrize('filename', TOPOLOGY_FILES)
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_topology_file_flaps(filename, seed):
+    network_topology = read_topology(os.path.join(TEST_DIRECTORY, filename), resolve=None)
+    replay_flaps(network_topology, seed, 1)
+
+@pytest.mark.parametrize('filename', TOPOLOGY_FILES)
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_topology_file_flaps_with_costs(filename, seed):
+    network_topology = read_topology(os.path.join(TEST_DIRECTORY, filename), resolve=None)
+    replay_flaps(with_random_costs(network_topology, random.Random(seed), 5), seed, 5)
+
+@pytest.mark.parametrize('num_nodes, degree', [(20, 2), (50, 3), (200, 4)])
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_random_topology_flaps(num_nodes, degree, seed):
+    replay_flaps(synthetic_topology(num_nodes, degree, seed), seed, 1)
+
+@pytest.mark.parametrize('num_nodes, degree', [(20, 2), (50, 3), (200, 4)])
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_random_topology_flaps_with_costs(num_nodes, degree, seed):
+    replay_flaps(synthetic_topology(num_nodes, degree, seed, max_cost=5), seed, 5)
@@ -0,0 +1,463 @@
+import argparse
+import array
+import collections.abc
+import concurrent.futures
+import mmap
+import queue
+import random
+import socket
+import struct
+import sys
+import threading
+
+from packet import LSP_MAX_LINK_COST
+
+RESOLVE_WORKERS = 16 # hostnames resolved at once
+RESOLVE_TIMEOUT = 5 # seconds to wait for any one hostname
+
+# compiled topology file: header, node names, then the links as CSR arrays of node ids, see
+# write_compiled_topology
+COMPILED_TOPOLOGY_MAGIC = b'LSTOPO1\n'
+COMPILED_TOPOLOGY_HEADER = struct.Struct('<8sIII') # magic, number of nodes, number of links, size of the names
+
+# hostnames already resolved, so a topology file or a tool reading several of them asks the
+# resolver once per hostname
+# { (resolve, hostname): ip }
+resolved_hostnames = {}
+
+# { hostname: ip } for every hostname in hostnames, each resolved once through the cache
+# the hostnames that aren't cached yet are resolved by up to workers threads, a slow resolver then
+# costs about the slowest hostname instead of the sum of all of them. with one worker they are
+# resolved one after the other, in order. a hostname that takes longer than timeout seconds raises
+# TimeoutError, however many workers there are
+def resolve_hostnames(hostnames, resolve=socket.gethostbyname, workers=RESOLVE_WORKERS, timeout=RESOLVE_TIMEOUT):
+    hostnames_to_resolve = [hostname for hostname in dict.fromkeys(hostnames) if (resolve, hostname) not in resolved_hostnames]
+    if len(hostnames_to_resolve) > 0:
+        futures = resolve_in_threads(hostnames_to_resolve, resolve, max(1, min(workers, len(hostnames_to_resolve))))
+        try:
+            for hostname, future in futures.items():
+                try:
+                    resolved_hostnames[(resolve, hostname)] = future.result(timeout)
+                except concurrent.futures.TimeoutError:
+                    raise TimeoutError('resolving ' + hostname + ' took more than ' + str(timeout) + ' seconds')
+        finally:
+            # the hostnames nobody started on aren't resolved anymore
+            for future in futures.values():
+                future.cancel()
+    return {hostname: resolved_hostnames[(resolve, hostname)] for hostname in hostnames}
+
+# { hostname: future of its ip }, resolved by daemon threads so a resolver that hangs keeps neither
+# the caller nor the process from exiting, the way a thread pool's threads would
+def resolve_in_threads(hostnames, resolve, workers):
+    jobs = queue.SimpleQueue()
+    futures = {}
+    for hostname in hostnames:
+        futures[hostname] = concurrent.futures.Future()
+        jobs.put(hostname)
+
+    def work():
+        while True:
+            try:
+                hostname = jobs.get_nowait()
+            except queue.Empty:
+                return
+            future = futures[hostname]
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(resolve(hostname))
+            except BaseException as error:
+                future.set_exception(error)
+
+    for i in range(workers):
+        threading.Thread(target=work, daemon=True).start()
+    return futures
+
+# read topology file and build the network structure in a dict
+# each neighbor in the file is "hostname,port" or "hostname,port,cost", without a cost the link
+# costs 1. a cost has to be a whole number from 1, which every engine and all_pairs.py count on, up
+# to LSP_MAX_LINK_COST, the most an LSP can carry
+# key: node
+# value: dict of neighboring nodes and the cost of the link to each
+# all nodes are in string format "ip:port"
+# {
+#   "ip:port": { "ip:port": cost, "ip:port": cost }
+# }
+# hostnames are turned into ips with resolve, with resolve=None they are kept as they are, which is
+# what tools reading topology files for hosts they can't resolve want. every hostname is resolved
+# once, resolve_workers at a time, see resolve_hostnames. a resolve that has to hand out addresses
+# in file order, like the simulator's, wants resolve_workers=1
+# a compiled topology file, see write_compiled_topology, is loaded as it is without any parsing and
+# comes back as a CompiledTopology, which reads like the dict
+def read_topology(filename, resolve=socket.gethostbyname, resolve_workers=RESOLVE_WORKERS, resolve_timeout=RESOLVE_TIMEOUT):
+    try:
+        file = open(filename, 'rb')
+    except:
+        print('ERROR: Reading topology file')
+        return
+
+    with file:
+        if file.read(len(COMPILED_TOPOLOGY_MAGIC)) == COMPILED_TOPOLOGY_MAGIC:
+            return CompiledTopology(filename)
+        file.seek(0)
+        file_lines = file.read().decode().splitlines()
+
+    # [ (hostname, port, cost) ], the source node of a line first with no cost
+    lines = []
+    for line in file_lines:
+        nodes_in_line = line.split()
+        if len(nodes_in_line) == 0:
+            continue
+        fields_in_line = []
+        for node_in_line in nodes_in_line:
+            node_fields = node_in_line.split(',')
+            cost = parse_link_cost(node_fields[2]) if len(node_fields) > 2 else 1
+            if cost is None:
+                print('ERROR: Reading topology file, link cost of ' + node_in_line + ' is not a whole number from 1 to ' + str(LSP_MAX_LINK_COST))
+                return
+            fields_in_line.append((node_fields[0], node_fields[1], cost))
+        lines.append(fields_in_line)
+
+    hostnames = {hostname for fields_in_line in lines for hostname, port, cost in fields_in_line}
+    if resolve is None:
+        ips = {hostname: hostname for hostname in hostnames}
+    else:
+        # file order, so a resolve that numbers hostnames numbers them the same every time
+        ordered_hostnames = dict.fromkeys(hostname for fields_in_line in lines for hostname, port, cost in fields_in_line)
+        ips = resolve_hostnames(list(ordered_hostnames), resolve, resolve_workers, resolve_timeout)
+
+    network_topology = {}
+    for fields_in_line in lines:
+        source_hostname, source_port, source_cost = fields_in_line[0]
+        source_node = ips[source_hostname] + ':' + source_port
+        network_topology[source_node] = {}
+        for node_hostname, node_port, cost in fields_in_line[1:]:
+            node = ips[node_hostname] + ':' + node_port
+            if node not in network_topology[source_node]:
+                network_topology[source_node][node] = cost
+
+    return network_topology
+
+# the link cost in a topology file field, None when it isn't one
+def parse_link_cost(field):
+    try:
+        cost = int(field)
+    except ValueError:
+        return None
+    if cost < 1 or cost > LSP_MAX_LINK_COST:
+        return None
+    return cost
+
+# writes network_topology as a compiled topology file that read_topology and CompiledTopology load
+# without parsing or resolving anything
+# nodes get ids 0 to n - 1 in topology order. the file is, all little endian:
+# - COMPILED_TOPOLOGY_HEADER: magic, number of nodes, number of links, size of the names
+# - the "ip:port" names of the nodes in id order, utf-8, one per line, padded to 4 bytes
+# - offsets: number of nodes + 1 uint32s, the links of node i are offsets[i] up to offsets[i + 1]
+# - neighbors: number of links uint32 node ids
+# - costs: number of links uint32 link costs
+def write_compiled_topology(network_topology, filename):
+    nodes = list(network_topology)
+    node_ids = {node: node_id for node_id, node in enumerate(nodes)}
+    offsets = array.array('I', [0])
+    neighbors = array.array('I')
+    costs = array.array('I')
+    for node in nodes:
+        for neighbor, cost in network_topology[node].items():
+            neighbors.append(node_ids[neighbor])
+            costs.append(cost)
+        offsets.append(len(neighbors))
+
+    names = '\n'.join(nodes).encode()
+    names += b'\0' * (-len(names) % 4)
+    if sys.byteorder != 'little':
+        for values in (offsets, neighbors, costs):
+            values.byteswap()
+
+    with open(filename, 'wb') as file:
+        file.write(COMPILED_TOPOLOGY_HEADER.pack(COMPILED_TOPOLOGY_MAGIC, len(nodes), len(neighbors), len(names)))
+        file.write(names)
+        file.write(offsets.tobytes())
+        file.write(neighbors.tobytes())
+        file.write(costs.tobytes())
+
+# a compiled topology file mapped into memory, nothing is copied until it is read
+# nodes is the list of "ip:port" names indexed by node id, offsets, neighbors and costs are the
+# uint32 arrays described at write_compiled_topology, which a nodes.NodeRegistry takes as they are
+# it reads like the { "ip:port": { "ip:port": link cost } } dict read_topology returns, a node's
+# neighbor dict is only built the first time it is looked up, and the { "ip:port": node id } dict
+# the lookups go through the first time any node is
+class CompiledTopology(collections.abc.Mapping):
+    def __init__(self, filename):
+        with open(filename, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, num_nodes, num_links, names_size = COMPILED_TOPOLOGY_HEADER.unpack_from(self.buffer)
+        if magic != COMPILED_TOPOLOGY_MAGIC:
+            raise ValueError(filename + ' is not a compiled topology file')
+
+        offset = COMPILED_TOPOLOGY_HEADER.size
+        self.nodes = self.buffer[offset:offset + names_size].rstrip(b'\0').decode().split('\n') if num_nodes > 0 else []
+        offset += names_size
+        self.offsets = self.uint32_array(offset, num_nodes + 1)
+        offset += 4 * (num_nodes + 1)
+        self.neighbors = self.uint32_array(offset, num_links)
+        offset += 4 * num_links
+        self.costs = self.uint32_array(offset, num_links)
+
+        self.node_ids = None # { "ip:port": node id }
+        self.neighbor_dicts = {} # { node id: { "ip:port": link cost } }
+
+    def uint32_array(self, offset, length):
+        view = memoryview(self.buffer)[offset:offset + 4 * length]
+        if sys.byteorder == 'little':
+            return view.cast('I')
+        values = array.array('I', view)
+        values.byteswap()
+        return values
+
+    # the neighbor ids and link costs of node_id
+    def links(self, node_id):
+        start = self.offsets[node_id]
+        end = self.offsets[node_id + 1]
+        return self.neighbors[start:end], self.costs[start:end]
+
+    def id_of(self, node):
+        if self.node_ids is None:
+            self.node_ids = {node: node_id for node_id, node in enumerate(self.nodes)}
+        return self.node_ids[node]
+
+    def neighbors_of(self, node_id):
+        neighbors = self.neighbor_dicts.get(node_id)
+        if neighbors is None:
+            nodes = self.nodes
+            neighbor_ids, costs = self.links(node_id)
+            neighbors = self.neighbor_dicts[node_id] = dict(zip([nodes[neighbor_id] for neighbor_id in neighbor_ids], costs))
+        return neighbors
+
+    def __getitem__(self, node):
+        return self.neighbors_of(self.id_of(node))
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        try:
+            self.id_of(node)
+        except KeyError:
+            return False
+        return True
+
+    # the whole topology as a plain dict, for callers that want one
+    def to_dict(self):
+        return {node: dict(self.neighbors_of(node_id)) for node_id, node in enumerate(self.nodes)}
+
+# a made up "ip:port" for the node with the given index, unique up to 16M nodes
+def synthetic_node(index):
+    return '10.' + str((index >> 16) & 255) + '.' + str((index >> 8) & 255) + '.' + str(index & 255) + ':' + str(1024 + index % 60000)
+
+# builds a random connected topology in the same shape read_topology returns
+# a random spanning tree keeps it connected, extra random links bring it up to the average degree
+# link costs are picked between 1 and max_cost
+def synthetic_topology(num_nodes, degree, seed, max_cost=1):
+    rng = random.Random(seed)
+    nodes = [synthetic_node(index) for index in range(num_nodes)]
+    network_topology = {node: {} for node in nodes}
+
+    def add_link(a, b):
+        if a != b and b not in network_topology[a]:
+            cost = rng.randint(1, max_cost)
+            network_topology[a][b] = cost
+            network_topology[b][a] = cost
+
+    for index in range(1, num_nodes):
+        add_link(nodes[index], nodes[rng.randrange(index)])
+
+    num_extra_links = max(0, num_nodes * degree // 2 - (num_nodes - 1))
+    for i in range(num_extra_links):
+        add_link(nodes[rng.randrange(num_nodes)], nodes[rng.randrange(num_nodes)])
+
+    return network_topology
+
+# the topology the emulator routes over: the topology read from the topology file, which is never
+# modified, plus the nodes and links that are currently down and the link costs nodes advertised
+# it reads like the { "ip:port": { "ip:port": link cost } } dict read_topology returns with the down
+# nodes and links left out, but nothing is copied. a node or link going up or down only adds to or
+# removes from down_nodes / down_links, the neighbor lists skip them while they are iterated
+#
+# a link has a single cost used in both directions. each end has its own say in it, from the
+# topology file or from its LSPs, and the higher of the two is used
+#
+# with a nodes.NodeRegistry of the topology it also keeps a byte per node id, 1 while the node is
+# up, which the heap engine builds its graph from without looking up a single "ip:port" string
+class LiveTopology(collections.abc.Mapping):
+    def __init__(self, original_network_topology, registry=None):
+        self.original_network_topology = original_network_topology
+        self.registry = registry
+        self.available = None if registry is None else bytearray(b'\x01') * registry.num_topology_nodes
+        self.down_nodes = set()
+        self.down_links = set() # frozenset((node_a, node_b))
+        self.advertised_costs = {} # { (node, neighbor): cost node advertised for the link }
+
+    # returns True if the node's status changed
+    def set_node_available(self, node, available):
+        if available == (node not in self.down_nodes):
+            return False
+        if available:
+            self.down_nodes.discard(node)
+        else:
+            self.down_nodes.add(node)
+        if self.available is not None:
+            self.available[self.registry.ids[node]] = available
+        return True
+
+    # returns True if the link's status changed
+    def set_link_available(self, node_a, node_b, available):
+        link = frozenset((node_a, node_b))
+        if available == (link not in self.down_links):
+            return False
+        if available:
+            self.down_links.discard(link)
+        else:
+            self.down_links.add(link)
+        return True
+
+    # node advertised cost for its link to neighbor, returns True if the cost of the link changed
+    # a cost that is the same as in the topology file isn't kept, every LSP advertises every link
+    # and the neighbor lists are quicker to go through while nothing differs from the file
+    def set_link_cost(self, node, neighbor, cost):
+        file_cost = self.original_network_topology[node].get(neighbor) if node in self.original_network_topology else None
+        # the same cost as in the file and nothing else advertised before, which is what almost
+        # every LSP says about almost every link
+        if file_cost == cost and (node, neighbor) not in self.advertised_costs:
+            return False
+
+        old_cost = self.link_cost(node, neighbor)
+        if file_cost == cost:
+            self.advertised_costs.pop((node, neighbor), None)
+        else:
+            self.advertised_costs[(node, neighbor)] = cost
+        return self.link_cost(node, neighbor) != old_cost
+
+    # the cost of the link as node sees it, None if node doesn't know about the link
+    def directed_link_cost(self, node, neighbor):
+        cost = self.advertised_costs.get((node, neighbor))
+        if cost is not None:
+            return cost
+        if node in self.original_network_topology:
+            return self.original_network_topology[node].get(neighbor)
+        return None
+
+    def link_cost(self, node_a, node_b):
+        cost_a = self.directed_link_cost(node_a, node_b)
+        cost_b = self.directed_link_cost(node_b, node_a)
+        if cost_a is None:
+            return cost_b
+        if cost_b is None:
+            return cost_a
+        return max(cost_a, cost_b)
+
+    def is_available(self, node):
+        return node not in self.down_nodes
+
+    def link_is_up(self, node_a, node_b):
+        if node_a in self.down_nodes or node_b in self.down_nodes:
+            return False
+        return len(self.down_links) == 0 or frozenset((node_a, node_b)) not in self.down_links
+
+    def __getitem__(self, node):
+        if node in self.down_nodes:
+            raise KeyError(node)
+        return LiveNeighbors(self, node, self.original_network_topology[node])
+
+    def __iter__(self):
+        down_nodes = self.down_nodes
+        for node in self.original_network_topology:
+            if node not in down_nodes:
+                yield node
+
+    def __len__(self):
+        return len(self.original_network_topology) - len(self.down_nodes)
+
+    def __contains__(self, node):
+        return node in self.original_network_topology and node not in self.down_nodes
+
+# the neighbors of node that are up and reachable over a link that is up, in topology file order
+class LiveNeighbors:
+    def __init__(self, live_topology, node, original_neighbors):
+        self.live_topology = live_topology
+        self.node = node
+        self.original_neighbors = original_neighbors
+
+    # with nothing down the original list is iterated as is
+    def __iter__(self):
+        if len(self.live_topology.down_nodes) == 0 and len(self.live_topology.down_links) == 0:
+            return iter(self.original_neighbors)
+        if len(self.live_topology.down_links) == 0:
+            down_nodes = self.live_topology.down_nodes
+            return (neighbor for neighbor in self.original_neighbors if neighbor not in down_nodes)
+        return self.neighbors_over_links_that_are_up()
+
+    def neighbors_over_links_that_are_up(self):
+        link_is_up = self.live_topology.link_is_up
+        for neighbor in self.original_neighbors:
+            if link_is_up(self.node, neighbor):
+                yield neighbor
+
+    # (neighbor, link cost) for every neighbor that is up
+    def items(self):
+        if len(self.live_topology.advertised_costs) == 0:
+            return self.items_with_original_costs()
+        link_cost = self.live_topology.link_cost
+        return ((neighbor, link_cost(self.node, neighbor)) for neighbor in self)
+
+    # link_cost without any advertised costs to look up, the higher cost of both ends in the file
+    def items_with_original_costs(self):
+        original_network_topology = self.live_topology.original_network_topology
+        original_neighbors = self.original_neighbors
+        node = self.node
+        for neighbor in self:
+            cost = original_neighbors[neighbor]
+            reverse_neighbors = original_network_topology.get(neighbor)
+            if reverse_neighbors is not None:
+                reverse_cost = reverse_neighbors.get(node)
+                if reverse_cost is not None and reverse_cost > cost:
+                    cost = reverse_cost
+            yield neighbor, cost
+
+    def __getitem__(self, neighbor):
+        if neighbor not in self:
+            raise KeyError(neighbor)
+        return self.live_topology.link_cost(self.node, neighbor)
+
+    def __len__(self):
+        return sum(1 for neighbor in self)
+
+    def __contains__(self, neighbor):
+        return neighbor in self.original_neighbors and self.live_topology.link_is_up(self.node, neighbor)
+
+    def __repr__(self):
+        return repr(list(self))
+
+def parse_command_line_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-f', '--filename', help='the name of the topology file', required=True, type=str)
+    parser.add_argument('-o', '--output', help='the compiled topology file to write', required=True, type=str)
+    parser.add_argument('-n', '--no_resolve', help='keep hostnames as they are instead of resolving them', action='store_true')
+
+    args = parser.parse_args()
+    return args
+
+# resolves a topology file once and writes it compiled, the emulator and the other tools then load
+# it without parsing or resolving anything
+def main():
+    args = parse_command_line_args()
+    network_topology = read_topology(args.filename, resolve=None if args.no_resolve else socket.gethostbyname)
+    write_compiled_topology(network_topology, args.output)
+    print('compiled', len(network_topology), 'nodes into', args.output, file=sys.stderr)
+
+if __name__ == '__main__':
+    main()